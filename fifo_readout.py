@@ -2,10 +2,11 @@ import sys
 import logging
 import datetime
 
+import numpy as np
+
 from time import sleep, time, mktime
-from threading import Thread, Event, Lock
+from threading import Thread, Event, Lock, Condition
 from collections import deque
-from Queue import Queue, Empty
 
 data_iterable = ("data", "timestamp_start", "timestamp_stop", "error")
 
@@ -30,8 +31,283 @@ class StopTimeout(Exception):
     pass
 
 
+class DataBuffer(object):
+    ''' Software data buffer of FifoReadout (fill_buffer=True): the data words of the readouts in one preallocated
+        array, their timestamps and errors in parallel arrays. The words of all readouts are one contiguous array,
+        get_data, drain and popleft return copies of it, the readout thread can append while they are used.
+
+        The buffer grows up to max_words. If a readout does not fit then, overflow applies:
+            'drop_oldest': the oldest readouts are dropped
+            'drop_newest': the readout is dropped
+        The dropped readouts are counted (dropped_chunks, dropped_words).
+    '''
+    META_DTYPE = [('index_start', '<i8'), ('index_stop', '<i8'), ('timestamp_start', '<f8'),
+                  ('timestamp_stop', '<f8'), ('error', '<u4')]
+
+    def __init__(self, n_words=2 ** 20, max_words=2 ** 27, overflow='drop_oldest'):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError('Unknown overflow policy {}'.format(overflow))
+        self.max_words = max_words
+        self.overflow = overflow
+        self._words = np.empty(min(n_words, max_words), dtype=np.uint32)
+        self._meta = np.empty(1024, dtype=self.META_DTYPE)
+        self._lock = Lock()
+        self.clear()
+
+    def __len__(self):
+        ''' Number of readouts in the buffer
+        '''
+        return self._stop_chunk - self._start_chunk
+
+    @property
+    def n_words(self):
+        return self._stop - self._start
+
+    def clear(self):
+        with self._lock:
+            self._start = 0  # Words in the buffer: _words[_start:_stop]
+            self._stop = 0
+            self._start_chunk = 0  # Readouts in the buffer: _meta[_start_chunk:_stop_chunk]
+            self._stop_chunk = 0
+            self.dropped_chunks = 0
+            self.dropped_words = 0
+
+    def append(self, data, timestamp_start=0., timestamp_stop=0., error=0):
+        n_words = data.shape[0]
+        with self._lock:
+            if self._stop + n_words > self._words.shape[0] and not self._make_space(n_words):
+                self.dropped_chunks += 1
+                self.dropped_words += n_words
+                return
+            if self._stop_chunk == self._meta.shape[0]:
+                self._compact()
+                if self._stop_chunk == self._meta.shape[0]:
+                    self._meta = np.resize(self._meta, 2 * self._meta.shape[0])
+            self._words[self._stop:self._stop + n_words] = data
+            self._meta[self._stop_chunk] = (self._stop, self._stop + n_words, timestamp_start, timestamp_stop, error)
+            self._stop += n_words
+            self._stop_chunk += 1
+
+    def _make_space(self, n_words):
+        ''' Make space for n_words words at the end of the buffer, returns False if the readout has to be dropped
+        '''
+        if n_words > self.max_words:
+            return False
+        if self.n_words + n_words > self.max_words:
+            if self.overflow == 'drop_newest':
+                return False
+            # Drop the oldest readouts
+            index_stop = self._meta['index_stop'][self._start_chunk:self._stop_chunk]
+            n_chunks = np.searchsorted(index_stop, self._stop + n_words - self.max_words) + 1
+            self.dropped_chunks += int(n_chunks)
+            self.dropped_words += int(index_stop[n_chunks - 1] - self._start)
+            self._start_chunk += n_chunks
+            self._start = index_stop[n_chunks - 1]
+        self._compact()
+        if self._stop + n_words > self._words.shape[0]:
+            size = max(self._words.shape[0], 1)
+            while size < self._stop + n_words:
+                size *= 2
+            words = np.empty(min(size, self.max_words), dtype=np.uint32)
+            words[:self._stop] = self._words[:self._stop]
+            self._words = words
+        return True
+
+    def _compact(self):
+        ''' Move the words and readouts in the buffer to its start
+        '''
+        if self._start:
+            n_words = self._stop - self._start
+            self._words[:n_words] = self._words[self._start:self._stop]
+            self._stop = n_words
+        n_chunks = self._stop_chunk - self._start_chunk
+        self._meta[:n_chunks] = self._meta[self._start_chunk:self._stop_chunk]
+        self._meta['index_start'][:n_chunks] -= self._start
+        self._meta['index_stop'][:n_chunks] -= self._start
+        self._start = 0
+        self._start_chunk = 0
+        self._stop_chunk = n_chunks
+
+    def get_data(self):
+        ''' Data words of all readouts in the buffer (copy)
+        '''
+        with self._lock:
+            return self._words[self._start:self._stop].copy()
+
+    def get_meta_data(self):
+        ''' Index of the words in get_data, timestamps and error of the readouts in the buffer (copy)
+        '''
+        with self._lock:
+            meta = self._meta[self._start_chunk:self._stop_chunk].copy()
+            meta['index_start'] -= self._start
+            meta['index_stop'] -= self._start
+            return meta
+
+    def drain(self):
+        ''' Data words of all readouts in the buffer (copy), the buffer is empty afterwards
+        '''
+        with self._lock:
+            data = self._words[self._start:self._stop].copy()
+            self._start = self._stop
+            self._start_chunk = self._stop_chunk
+            return data
+
+    def popleft(self):
+        ''' Remove the oldest readout from the buffer, returns its (data (copy), timestamp_start, timestamp_stop,
+            error) like the data tuples of FifoReadout
+        '''
+        with self._lock:
+            if self._start_chunk == self._stop_chunk:
+                raise IndexError('pop from an empty DataBuffer')
+            meta = self._meta[self._start_chunk]
+            self._start_chunk += 1
+            self._start = meta['index_stop']
+            return (self._words[meta['index_start']:meta['index_stop']].copy(), meta['timestamp_start'],
+                    meta['timestamp_stop'], meta['error'])
+
+
+class ReadoutTelemetry(object):
+    ''' Time series of the readout statistics: one sample every interval seconds, the last n_samples are kept.
+        The counters are updated without lock by the readout thread (polls) and the worker thread (handled readouts),
+        every counter by only one of them. The readout thread takes the samples, get_series can be called any time.
+    '''
+    SAMPLE_DTYPE = [('timestamp', '<f8'), ('words_per_s', '<f8'), ('chunks_per_s', '<f8'), ('polls_per_s', '<f8'),
+                    ('poll_latency', '<f8'), ('max_poll_latency', '<f8'), ('worker_latency', '<f8'),
+                    ('max_worker_latency', '<f8'), ('queue_words', '<u8'), ('queue_chunks', '<u4'),
+                    ('dropped_words', '<u8'), ('data_rx_discards', '<u4'), ('tdc_discards', '<u4'),
+                    ('tlu_discards', '<u4'), ('timestamp_discards', '<u4'), ('errors', '<u8'), ('exceptions', '<u4')]
+
+    def __init__(self, interval=1.0, n_samples=86400):
+        self.interval = interval
+        self._samples = np.zeros(n_samples, dtype=self.SAMPLE_DTYPE)
+        self._n_samples = 0  # Samples taken, the last n_samples are in _samples
+        # Readout thread
+        self._words = 0
+        self._chunks = 0
+        self._polls = 0
+        self._poll_time = 0.
+        self._max_poll_time = 0.
+        self._reader_errors = 0
+        self._last_sample = None
+        # Worker thread
+        self._handled_chunks = 0
+        self._worker_time = 0.
+        self._max_worker_time = 0.
+        self._worker_errors = 0
+        self._rx_errors = 0
+
+    def add_poll(self, n_words, poll_time):
+        self._words += n_words
+        self._chunks += n_words > 0
+        self._polls += 1
+        self._poll_time += poll_time
+        self._max_poll_time = max(self._max_poll_time, poll_time)
+
+    def add_reader_error(self):
+        self._reader_errors += 1
+
+    def add_handled_chunk(self, latency):
+        self._handled_chunks += 1
+        self._worker_time += latency
+        self._max_worker_time = max(self._max_worker_time, latency)
+
+    def add_worker_error(self):
+        self._worker_errors += 1
+
+    def set_rx_errors(self, n_errors):
+        ''' RX decoder errors: TJ data words discarded by the decoder of the readout data
+        '''
+        self._rx_errors = n_errors
+
+    def _get_counters(self):
+        return self._words, self._chunks, self._polls, self._poll_time, self._handled_chunks, self._worker_time
+
+    def start(self, now):
+        ''' Start the interval of the next sample, e.g. when the readout starts
+        '''
+        self._max_poll_time = 0.
+        self._max_worker_time = 0.
+        self._last_sample = (now, self._get_counters())
+
+    def sample(self, now, queue_status, discard_counts):
+        ''' Take a sample of the counters since the last sample or start.
+            discard_counts: data_rx, tdc, tlu and timestamp FIFO discard counters
+        '''
+        counters = self._get_counters()
+        if self._last_sample is not None:
+            last_time, last_counters = self._last_sample
+            words, chunks, polls, poll_time, handled_chunks, worker_time = [
+                counter - last for counter, last in zip(counters, last_counters)]
+            dt = max(now - last_time, 1e-9)
+            sample = self._samples[self._n_samples % self._samples.shape[0]]
+            sample['timestamp'] = now
+            sample['words_per_s'] = words / dt
+            sample['chunks_per_s'] = chunks / dt
+            sample['polls_per_s'] = polls / dt
+            sample['poll_latency'] = poll_time / polls if polls else 0.
+            sample['max_poll_latency'] = self._max_poll_time
+            sample['worker_latency'] = worker_time / handled_chunks if handled_chunks else 0.
+            sample['max_worker_latency'] = self._max_worker_time
+            sample['queue_words'] = queue_status['queued_words']
+            sample['queue_chunks'] = queue_status['queued_chunks']
+            sample['dropped_words'] = queue_status['dropped_words']
+            sample['data_rx_discards'], sample['tdc_discards'], sample['tlu_discards'], \
+                sample['timestamp_discards'] = [count or 0 for count in discard_counts]
+            sample['errors'] = self._rx_errors
+            sample['exceptions'] = self._reader_errors + self._worker_errors
+            self._n_samples += 1
+        self._max_poll_time = 0.
+        self._max_worker_time = 0.  # Can miss a readout handled by the worker thread at the same time
+        self._last_sample = (now, counters)
+
+    def get_series(self, period=None):
+        ''' Samples in time order (copy), of the last period seconds or all kept samples
+        '''
+        n_samples = self._n_samples
+        size = self._samples.shape[0]
+        if n_samples > size:
+            series = np.concatenate((self._samples[n_samples % size:], self._samples[:n_samples % size]))
+        else:
+            series = self._samples[:n_samples].copy()
+        if period is not None:
+            series = series[series['timestamp'] >= time() - period]
+        return series
+
+
+# Policies of the data queue when the high-water mark is exceeded, see FifoReadout
+QUEUE_POLICIES = ('block', 'coalesce', 'drop')
+# Polling modes of the SRAM FIFO, see FifoReadout
+POLLING_MODES = ('fixed', 'adaptive', 'latency')
+
+
 class FifoReadout(object):
-    def __init__(self, dut):
+    ''' Reads the SRAM FIFO in the readout thread and hands the data chunks to the callback in the worker thread.
+
+        The data queue between the threads holds at most max_queued_words data words (0: unbounded). When a new chunk
+        exceeds it, queue_policy applies:
+            'block': the readout thread waits for the worker (data piles up in the SRAM FIFO instead)
+            'coalesce': above half of max_queued_words new chunks are merged into the last queued chunk, which the
+                worker handles with one callback, beyond max_queued_words coalesce_fallback ('block' or 'drop') applies
+            'drop': the chunk is dropped and counted (dropped_chunks, dropped_words)
+
+        The SRAM FIFO is polled according to polling:
+            'fixed': every readout_interval
+            'adaptive': every readout_interval at most, shorter when the FIFO fills up faster than fill_threshold
+                words per readout_interval (the words of a read are the fill level of the FIFO), exponential back-off up
+                to max_readout_interval when the FIFO is empty
+            'latency': as 'adaptive', but polling at least every target_latency, also when the FIFO is empty
+
+        The data_rx module has no decoder error counter. With rx_tj_words (number of data words of a TJ hit, 4 for the
+        current firmware, 3 for older firmware) the worker thread decodes the TJ data of the readouts after the
+        callback and the TJ data words the decoder discards are the RX decoder errors of the telemetry. Off by default,
+        decoding every readout costs CPU time of the host.
+    '''
+
+    def __init__(self, dut, max_queued_words=2 ** 26, queue_policy='block', polling='fixed', rx_tj_words=None):
+        if queue_policy not in QUEUE_POLICIES:
+            raise ValueError('Unknown queue policy {}, use one of {}'.format(queue_policy, QUEUE_POLICIES))
+        if polling not in POLLING_MODES:
+            raise ValueError('Unknown polling mode {}, use one of {}'.format(polling, POLLING_MODES))
         self.dut = dut
         self.callback = None
         self.errback = None
@@ -40,19 +316,33 @@ class FifoReadout(object):
         self.watchdog_thread = None
         self.fill_buffer = False
         self.readout_interval = 0.003
+        self.polling = polling
+        self.min_readout_interval = 0.0005
+        self.max_readout_interval = 0.1
+        self.target_latency = 0.01
+        self.fill_threshold = 2 ** 17  # Words, a quarter of the 2 MB SRAM FIFO
         self._moving_average_time_period = 10.0
-        self._words_per_read = deque(maxlen=int(self._moving_average_time_period / self.readout_interval))
+        self.telemetry = ReadoutTelemetry()
+        self._rx_decoder = None
+        if rx_tj_words:
+            from tjmonopix.analysis import decoder  # numba compiles the decoder on import
+            self._rx_decoder = decoder.Decoder(tj_words=rx_tj_words, formats=decoder.TJ_DATA,
+                                               options=decoder.RESYNC_TJ_DATA)
+            self._rx_records = np.empty(0, dtype=decoder.RECORD_DTYPE)
         self._data_deque = deque()
-        self._data_buffer = deque()
-        self._words_per_read = deque(maxlen=int(self._moving_average_time_period / self.readout_interval))
-        self._result = Queue(maxsize=1)
-        self._calculate = Event()
+        self._data_condition = Condition()  # Guards _data_deque and the queue counters
+        self.max_queued_words = max_queued_words
+        self.queue_policy = queue_policy
+        self.coalesce_fallback = 'block'
+        self._reset_queue_status()
+        self._data_buffer = DataBuffer()
+        self._reset_poll_status()
         self.stop_readout = Event()
         self.force_stop = Event()
+        self.start_event = None  # Readout thread waits for it before the first read, see MultiFifoReadout
         self.timestamp = None
         self.update_timestamp()
         self._is_running = False
-        self.reset_rx()
         self.reset_sram_fifo()
         self._record_count_lock = Lock()
         self.set_record_count(0, reset=True)
@@ -76,17 +366,22 @@ class FifoReadout(object):
             logging.warning('Data requested but software data buffer not active')
 
     def data_words_per_second(self):
-        if self._result.full():
-            self._result.get()
-        self._calculate.set()
-        try:
-            result = self._result.get(timeout=2 * self.readout_interval)
-        except Empty:
-            self._calculate.clear()
+        series = self.telemetry.get_series(self._moving_average_time_period)
+        if series.shape[0] == 0:
             return None
-        return result / float(self._moving_average_time_period)
+        return float(np.mean(series['words_per_s']))
 
-    def start(self, callback=None, errback=None, reset_rx=False, reset_sram_fifo=False, clear_buffer=False, fill_buffer=False, no_data_timeout=None):
+    def get_telemetry(self, period=None):
+        ''' Readout statistics of the last period seconds (all kept samples if None), see ReadoutTelemetry
+        '''
+        return self.telemetry.get_series(period)
+
+    def _sample_telemetry(self, now):
+        self.telemetry.sample(now, self.get_queue_status(), (
+            self.get_data_rx_fifo_discard_count(), self.get_tdc_fifo_discard_count(),
+            self.get_data_tlu_fifo_discard_count(), self.get_data_timestamp_fifo_discard_count()))
+
+    def start(self, callback=None, errback=None, reset_sram_fifo=False, clear_buffer=False, fill_buffer=False, no_data_timeout=None):
         if self._is_running:
             raise RuntimeError("Readout already running: use stop() before start()")
 
@@ -96,18 +391,19 @@ class FifoReadout(object):
         self.errback = errback
         self.fill_buffer = fill_buffer
         self._record_count = 0
-        if reset_rx:
-            self.reset_rx()
         if reset_sram_fifo:
             self.reset_sram_fifo()
         else:
             fifo_size = self.dut['fifo']['FIFO_SIZE']
             if fifo_size != 0:
                 logging.warning("SRAM FIFO not empty when starting FIFO readout: size = {}".format(fifo_size))
-        self._words_per_read.clear()
         if clear_buffer:
-            self._data_deque.clear()
+            with self._data_condition:
+                self._data_deque.clear()
+                self._queued_words = 0
             self._data_buffer.clear()
+        self._reset_queue_status()
+        self._reset_poll_status()
         self.stop_readout.clear()
         self.force_stop.clear()
         if self.errback:
@@ -158,8 +454,19 @@ class FifoReadout(object):
         tlu_lost_count = self.get_data_tlu_fifo_discard_count()
         timestamp_lost_count = self.get_data_timestamp_fifo_discard_count()
 
+        queue_status = self.get_queue_status()
         logging.info('Recived words: %d', self._record_count)
-        logging.info('Data queue size: %d', len(self._data_deque))
+        logging.info('Data queue size: %d chunks, %d words (peak %d words)', queue_status['queued_chunks'],
+                     queue_status['queued_words'], queue_status['peak_queued_words'])
+        logging.info('Worker lag: %.3f s (max %.3f s)', queue_status['worker_lag'], queue_status['max_worker_lag'])
+        poll_status = self.get_poll_status()
+        logging.info('FIFO polls: %d (%d empty), %.1f words per poll (max %d), %.2f ms per poll (max %.2f ms)',
+                     poll_status['polls'], poll_status['empty_polls'], poll_status['mean_words_per_poll'],
+                     poll_status['max_words_per_poll'], 1e3 * poll_status['mean_poll_duration'],
+                     1e3 * poll_status['max_poll_duration'])
+        if queue_status['dropped_chunks']:
+            logging.warning('Dropped %d chunks with %d words (data queue full)', queue_status['dropped_chunks'],
+                            queue_status['dropped_words'])
         logging.info('SRAM FIFO size: %d', self.dut['fifo']['FIFO_SIZE'])
         logging.info('Channel:                     %s', " | ".join(['TDC', 'DATA_RX', 'TLU', 'TIMESTAMP']))
         logging.info('Discard counter:             %s', " | ".join([str(tdc_discard_count).rjust(3), str(data_rx_lost_count).rjust(7),
@@ -174,72 +481,229 @@ class FifoReadout(object):
         Readout thread continuously reading SRAM
         """
         logging.debug("Starting {}".format(self.readout_thread.name))
+        if self.start_event is not None:
+            self.start_event.wait()
         curr_time = self.get_float_time()
         time_wait = 0.
+        self._poll_interval = self.readout_interval
+        last_read = time()
+        self.telemetry.start(last_read)
+        next_sample = last_read + self.telemetry.interval
 
-        while not self.force_stop.wait(time_wait if time_wait >= 0. else 0.):
-            try:
-                time_read = time()
-                if no_data_timeout and curr_time + no_data_timeout < self.get_float_time():
-                    raise NoDataTimeout("Received no data for {:.2f} second(s)".format(no_data_timeout))
-                data = self.read_data()
-                self._record_count += len(data)
+        try:
+            while not self.force_stop.wait(time_wait if time_wait >= 0. else 0.):
+                data_words = 0
+                try:
+                    time_read = time()
+                    if time_read >= next_sample:
+                        next_sample = time_read + self.telemetry.interval
+                        self._sample_telemetry(time_read)
+                    if no_data_timeout and curr_time + no_data_timeout < self.get_float_time():
+                        raise NoDataTimeout("Received no data for {:.2f} second(s)".format(no_data_timeout))
+                    data = self.read_data()
+                    self._record_count += len(data)
+
+                except Exception as exc:
+                    no_data_timeout = None
+                    self.telemetry.add_reader_error()
+                    if self.errback:
+                        self.errback(sys.exc_info())
+                    else:
+                        raise exc
+                    if self.stop_readout.is_set():
+                        break
+
+                else:  # update timestamp and handle data
+                    data_words = data.shape[0]
+                    if data_words > 0:
+                        last_time, curr_time = self.update_timestamp()
+                        status = 0
+
+                        if self.callback:
+                            self._queue_data((data, last_time, curr_time, status))
+                        if self.fill_buffer:
+                            self._data_buffer.append(data, last_time, curr_time, status)
+                    elif self.stop_readout.is_set():
+                        break
+
+                finally:
+                    poll_duration = time() - time_read
+                    self._update_poll_status(data_words, poll_duration)
+                    self.telemetry.add_poll(data_words, poll_duration)
+                    self._poll_interval = self._next_interval(self._poll_interval, data_words, time_read - last_read)
+                    last_read = time_read
+                    time_wait = self._poll_interval - poll_duration
 
+            try:
+                self._sample_telemetry(time())
             except Exception as exc:
-                no_data_timeout = None
+                self.telemetry.add_reader_error()
                 if self.errback:
                     self.errback(sys.exc_info())
                 else:
                     raise exc
-                if self.stop_readout.is_set():
-                    break
-
-            else:  # update timestamp and handle data
-                data_words = data.shape[0]
-                if data_words > 0:
-                    last_time, curr_time = self.update_timestamp()
-                    status = 0
-
-                    if self.callback:
-                        self._data_deque.append((data, last_time, curr_time, status))
-                    if self.fill_buffer:
-                        self._data_buffer.append((data, last_time, curr_time, status))
-                    self._words_per_read.append(data_words)
-                elif self.stop_readout.is_set():
-                    break
-                else:
-                    self._words_per_read.append(0)
-
-            finally:
-                time_wait = self.readout_interval - (time() - time_read)
-            if self._calculate.is_set():
-                self._calculate.clear()
-                self._result.put(sum(self._words_per_read))
-
-        if self.callback:
-            self._data_deque.append(None)  # Set last item to None to stop worker_thread
+        finally:
+            if self.callback:
+                self._queue_data(None)  # Set last item to None to stop worker_thread, also if the readout failed
         logging.debug("Stopped {}".format(self.readout_thread.name))
 
     def worker(self):
         """
-        Worker thread continuously calling callback function when data is available"
+        Worker thread calling callback function when data is available
         """
         logging.debug("Stating {}".format(self.worker_thread.name))
         while True:
-            try:
+            with self._data_condition:
+                while not self._data_deque:
+                    self._data_condition.wait()
                 data = self._data_deque.popleft()
-            except IndexError:
-                self.stop_readout.wait(self.readout_interval)  # sleep to reduce CPU usage
+                if data is not None:
+                    self._queued_words -= _chunk_words(data)
+                    self._worker_lag = self.get_float_time() - data[2]
+                    self._max_worker_lag = max(self._max_worker_lag, self._worker_lag)
+                self._data_condition.notify_all()  # Wake up readout thread waiting for space
+            if data is None:  # if None then exit
+                break
             else:
-                if data is None:  # if None then exit
-                    break
-                else:
+                if isinstance(data[0], list):  # Coalesced chunk
+                    data = (np.concatenate(data[0]), data[1], data[2], data[3])
+                try:
+                    self.callback(data)
+                except Exception:
+                    self.telemetry.add_worker_error()
+                    self.errback(sys.exc_info())
+                if self._rx_decoder is not None:  # After the callback, the data is handled also if decoding fails
                     try:
-                        self.callback(data)
+                        self._decode_rx_data(data[0])
                     except Exception:
+                        self.telemetry.add_worker_error()
                         self.errback(sys.exc_info())
+                self.telemetry.add_handled_chunk(self.get_float_time() - data[2])
+
+        logging.debug("Stopped {}".format(self.worker_thread.name))
 
-        logging.debug("Stopped {}".format(self.watchdog_thread.name))
+    def _decode_rx_data(self, data):
+        """
+        Decode the TJ data of a readout to count the RX decoder errors (discarded TJ data words)
+        """
+        if self._rx_records.shape[0] < data.shape[0]:
+            self._rx_records = np.empty(data.shape[0], dtype=self._rx_records.dtype)
+        self._rx_decoder.decode(data, self._rx_records)
+        self.telemetry.set_rx_errors(self._rx_decoder.get_discarded_count())
+
+    def _queue_data(self, data):
+        """
+        Append data chunk (or None to stop the worker) to the data queue, applying the queue policy
+        """
+        with self._data_condition:
+            if data is not None:
+                n_words = data[0].shape[0]
+                coalesce = self.queue_policy == 'coalesce'
+                if self.max_queued_words and self._queued_words + n_words > self.max_queued_words:
+                    policy = self.coalesce_fallback if coalesce else self.queue_policy
+                    if policy == 'drop':
+                        self._dropped_chunks += 1
+                        self._dropped_words += n_words
+                        return
+                    # Stop waiting on forced stop, or if the chunk alone exceeds the high-water mark
+                    while (self._data_deque and not self.force_stop.is_set() and
+                           self._queued_words + n_words > self.max_queued_words):
+                        self._data_condition.wait(self.readout_interval)
+                self._queued_words += n_words
+                self._peak_queued_words = max(self._peak_queued_words, self._queued_words)
+                if coalesce and 2 * self._queued_words > self.max_queued_words and self._coalesce_tail(data):
+                    self._data_condition.notify_all()
+                    return
+            self._data_deque.append(data)
+            self._data_condition.notify_all()
+
+    def _coalesce_tail(self, data):
+        """
+        Merge the data chunk into the last queued chunk, returns False if there is none. The words of a coalesced
+        chunk are a list of the words of its chunks, the worker concatenates them once. Called with _data_condition
+        acquired.
+        """
+        if not self._data_deque or self._data_deque[-1] is None:
+            return False
+        words, timestamp_start, _, status = self._data_deque[-1]
+        if isinstance(words, list):
+            words.append(data[0])
+        else:
+            words = [words, data[0]]
+        self._data_deque[-1] = (words, timestamp_start, data[2], status | data[3])
+        self._coalesced_chunks += 1
+        return True
+
+    def _reset_queue_status(self):
+        with self._data_condition:
+            self._queued_words = sum(_chunk_words(data) for data in self._data_deque if data is not None)
+            self._peak_queued_words = self._queued_words
+            self._dropped_chunks = 0
+            self._dropped_words = 0
+            self._coalesced_chunks = 0
+            self._worker_lag = 0.
+            self._max_worker_lag = 0.
+
+    def get_queue_status(self):
+        """
+        Status of the data queue between readout and worker thread: queued chunks and words, peak queued words,
+        dropped and coalesced chunks, time from readout to handling of the last chunk (worker_lag) and its maximum
+        """
+        with self._data_condition:
+            return {'queued_chunks': len(self._data_deque),
+                    'queued_words': self._queued_words,
+                    'peak_queued_words': self._peak_queued_words,
+                    'dropped_chunks': self._dropped_chunks,
+                    'dropped_words': self._dropped_words,
+                    'coalesced_chunks': self._coalesced_chunks,
+                    'worker_lag': self._worker_lag,
+                    'max_worker_lag': self._max_worker_lag}
+
+    def _next_interval(self, interval, data_words, time_since_last_read):
+        """
+        Time from this to the next read of the SRAM FIFO according to the polling mode
+        """
+        if self.polling == 'fixed':
+            return self.readout_interval
+        max_interval = self.readout_interval if self.polling == 'adaptive' else self.target_latency
+        if data_words == 0:  # Exponential back-off
+            if self.polling == 'adaptive':
+                max_interval = max(max_interval, self.max_readout_interval)
+            return min(2 * max(interval, self.min_readout_interval), max_interval)
+        # Time until the FIFO fills up to the threshold at the current rate
+        interval = self.fill_threshold * time_since_last_read / data_words
+        return min(max(interval, self.min_readout_interval), max_interval)
+
+    def _update_poll_status(self, data_words, poll_duration):
+        self._polls += 1
+        self._empty_polls += data_words == 0
+        self._polled_words += data_words
+        self._max_words_per_poll = max(self._max_words_per_poll, data_words)
+        self._poll_duration += poll_duration
+        self._max_poll_duration = max(self._max_poll_duration, poll_duration)
+
+    def _reset_poll_status(self):
+        self._poll_interval = self.readout_interval
+        self._polls = 0
+        self._empty_polls = 0
+        self._polled_words = 0
+        self._max_words_per_poll = 0
+        self._poll_duration = 0.
+        self._max_poll_duration = 0.
+
+    def get_poll_status(self):
+        """
+        Statistics of the SRAM FIFO reads: current polling interval, number of polls and empty polls, mean and maximum words per poll (the fill
+        level of the FIFO) and mean and maximum poll duration in seconds
+        """
+        polls = max(self._polls, 1)
+        return {'poll_interval': self._poll_interval,
+                'polls': self._polls,
+                'empty_polls': self._empty_polls,
+                'mean_words_per_poll': self._polled_words / float(polls),
+                'max_words_per_poll': self._max_words_per_poll,
+                'mean_poll_duration': self._poll_duration / polls,
+                'max_poll_duration': self._max_poll_duration}
 
     def watchdog(self):
         logging.debug('Starting %s', self.watchdog_thread.name)
@@ -306,18 +770,12 @@ class FifoReadout(object):
         if fifo_size != 0:
             logging.warning('SRAM FIFO not empty after reset: size = %i', fifo_size)
 
-    def reset_rx(self, channels=None):
-        pass
-        #logging.info('Resetting RX')
-        #if channels:
-        #    filter(lambda channel: self.dut[channel].RX_RESET, channels)
-        #else:
-        #    filter(lambda channel: channel.RX_RESET, self.dut.get_modules('fei4_rx'))
-        #sleep(0.1)  # sleep here for a while
-
     def get_tdc_fifo_discard_count(self, channels=None):
-        pass
-        # return self.dut['tdc'].LOST_DATA_COUNTER
+        try:
+            ret = self.dut['tdc'].LOST_COUNT
+        except:
+            ret = 0
+        return ret
 
     def get_data_rx_fifo_discard_count(self, channels=None):
         return self.dut['data_rx'].LOST_COUNT
@@ -344,3 +802,83 @@ class FifoReadout(object):
         t1 = time()
         t2 = datetime.datetime.fromtimestamp(t1)
         return mktime(t2.timetuple()) + 1e-6 * t2.microsecond
+
+
+def _chunk_words(data):
+    """
+    Number of data words of a queued data chunk, also of a coalesced one
+    """
+    if isinstance(data[0], list):
+        return sum(words.shape[0] for words in data[0])
+    return data[0].shape[0]
+
+
+def _board_property(name):
+    """
+    Attribute of the FifoReadout of every board, e.g. the readout interval
+    """
+    def getter(self):
+        return getattr(self.readouts[0], name)
+
+    def setter(self, value):
+        for readout in self.readouts:
+            setattr(readout, name, value)
+    return property(getter, setter)
+
+
+class MultiFifoReadout(object):
+    """
+    Synchronized readout of several boards: one FifoReadout (readout and worker thread) per board, started and
+    stopped together. The callback is called as callback(data, board) with the board index and never concurrently
+    for different boards, so a single writer can write the data of all boards.
+    """
+
+    readout_interval = _board_property('readout_interval')
+    max_queued_words = _board_property('max_queued_words')
+    queue_policy = _board_property('queue_policy')
+    coalesce_fallback = _board_property('coalesce_fallback')
+    polling = _board_property('polling')
+
+    def __init__(self, duts, **kwargs):
+        self.readouts = [FifoReadout(dut, **kwargs) for dut in duts]
+        self._callback_lock = Lock()
+
+    @property
+    def is_running(self):
+        return any(readout.is_running for readout in self.readouts)
+
+    def _board_callback(self, callback, board):
+        def board_callback(data):
+            with self._callback_lock:
+                callback(data, board)
+        return board_callback
+
+    def start(self, callback=None, **kwargs):
+        """
+        Start the readout of all boards, see FifoReadout.start. The boards read their FIFOs only after all of them
+        are started.
+        """
+        start_event = Event()
+        try:
+            for board, readout in enumerate(self.readouts):
+                readout.start_event = start_event
+                readout.start(callback=self._board_callback(callback, board) if callback else None, **kwargs)
+        finally:
+            start_event.set()
+
+    def stop(self, timeout=10.):
+        for readout in self.readouts:  # All boards read out their FIFO for the last time at the same time
+            readout.stop_readout.set()
+        for readout in self.readouts:
+            readout.stop(timeout=timeout)
+
+    def print_readout_status(self):
+        for board, readout in enumerate(self.readouts):
+            logging.info('Board %d:', board)
+            readout.print_readout_status()
+
+    def get_record_count(self):
+        return sum(readout.get_record_count() for readout in self.readouts)
+
+    def get_telemetry(self, period=None, board=0):
+        return self.readouts[board].get_telemetry(period)
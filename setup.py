@@ -28,5 +28,10 @@ setup(
     install_requires=install_requires,
     packages=find_packages(),
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'tjmonopix-warmup = tjmonopix.warmup:main',
+        ]
+    },
     platforms='any'
 )
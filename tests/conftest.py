@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.benchmarks import raw_data_generator
+
+
+@pytest.fixture
+def tmp_dir(request):
+    # Temporary directory of the test, removed afterwards. Set as tmp_dir of unittest test cases (usefixtures).
+    tmp_dir = tempfile.mkdtemp()
+    if request.instance is not None:
+        request.instance.tmp_dir = tmp_dir
+    yield tmp_dir
+    shutil.rmtree(tmp_dir)
+
+
+@pytest.fixture
+def write_raw_data(request, tmp_dir):
+    # Writes raw data with meta data like a scan to a file in tmp_dir and returns the file name. The raw data of
+    # raw_data_generator by default, readouts of readout_size words, the scan parameter changes every
+    # readouts_per_scan_param readouts. Set as write_raw_data of unittest test cases (usefixtures).
+    def write_raw_data(raw_data=None, readout_size=97, readouts_per_scan_param=None, file_name="raw_data.h5"):
+        if raw_data is None:
+            raw_data = raw_data_generator.generate_raw_data(n_events=2000, bit_error_rate=1e-4)
+        raw_data_file = os.path.join(tmp_dir, file_name)
+        raw_data_generator.write_raw_data_file(raw_data_file, np.asarray(raw_data, dtype=np.uint32),
+                                               readout_size=readout_size)
+        if readouts_per_scan_param:
+            with tb.open_file(raw_data_file, "a") as h5_file:
+                h5_file.root.meta_data.modify_column(
+                    colname="scan_param_id", column=np.arange(h5_file.root.meta_data.nrows) // readouts_per_scan_param)
+        return raw_data_file
+
+    if request.instance is not None:
+        request.instance.write_raw_data = write_raw_data
+    return write_raw_data
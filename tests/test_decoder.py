@@ -0,0 +1,129 @@
+import unittest
+import numpy as np
+import pytest
+from tjmonopix.analysis import decoder
+from tjmonopix.analysis import interpreter
+
+# Configuration of interpreter_idx.interpret_idx_h5 with debug 0x0 and 0x7 (see interpreter_idx.get_decoder_config)
+IDX_CONFIG = {"tj_words": 3, "formats": decoder.ALL_FORMATS,
+              "options": decoder.UNKNOWN_IS_ERROR | decoder.IDX_RECORDS | decoder.EXTEND_TLU_TS}
+IDX_DEBUG_CONFIG = dict(IDX_CONFIG, options=IDX_CONFIG["options"] | decoder.ERROR_RECORDS |
+                        decoder.TIMESTAMP_RECORDS | decoder.TLU_RECORDS)
+
+
+@pytest.mark.usefixtures("write_raw_data")
+class TestDecoder(unittest.TestCase):
+    def setUp(self):
+        # Five TJ data blocks, one HitOr timestamp, one TLU word, one TLU timestamp (see test_interpreter)
+        self.raw_data = np.array([119565277, 533409971, 654311425, 805306368, 117615582, 533409971,
+                                  654311425, 805306368, 111038963, 533410220, 671088641, 805306368,
+                                  110957044, 533410220, 671088641, 805306368, 98674900, 533410806, 687865857,
+                                  805306368, 1661002752, 1644167572, 1633608547, 3258017254, 1929379840,
+                                  1912686510, 1902803753], dtype=np.uint32)
+        # Same data for the 3 word TJ data format of older firmware
+        self.raw_data_3 = self.raw_data[(self.raw_data & 0xF0000000) != 0x30000000]
+        self.configs = [(interpreter.RAW_DATA_CONFIG, self.raw_data),
+                        (IDX_DEBUG_CONFIG, self.raw_data_3),
+                        (IDX_CONFIG, self.raw_data_3)]
+
+    def _decode(self, config, raw_data, chunk_size):
+        hit_decoder = decoder.Decoder(**config)
+        hit_data = np.concatenate([hit_decoder.decode_array(raw_data[start:start + chunk_size])
+                                   for start in range(0, len(raw_data), chunk_size)])
+        return hit_data, hit_decoder
+
+    def test_tj_hits(self):
+        # TJ hits have to be the same for all configurations
+        tj_hits = []
+        for config, raw_data in self.configs:
+            hit_data, hit_decoder = self._decode(config, raw_data, len(raw_data))
+            tj_hits.append(hit_data[hit_data["col"] < 0xE0][["col", "row", "le", "te", "cnt", "timestamp"]])
+            self.assertEqual(hit_decoder.get_error_count(), 0)
+            self.assertEqual(hit_decoder.get_counters()[0].sum(), len(raw_data))
+        self.assertEqual(len(tj_hits[0]), 5)
+        for hits in tj_hits[1:]:
+            np.testing.assert_array_equal(hits, tj_hits[0])
+
+    def test_chunked_data(self):
+        # Data split across chunks has to give the same result as decoding all at once, also with broken data
+        for config, raw_data in self.configs:
+            for data in (raw_data, np.delete(raw_data, [1, 17, 20])):
+                hit_data, hit_decoder = self._decode(config, data, len(data))
+                for chunk_size in (1, 2, 3, 5, 7):
+                    chunk_hit_data, chunk_decoder = self._decode(config, data, chunk_size)
+                    np.testing.assert_array_equal(chunk_hit_data, hit_data)
+                    self.assertEqual(chunk_decoder.get_error_count(), hit_decoder.get_error_count())
+                    np.testing.assert_array_equal(chunk_decoder.get_counters(), hit_decoder.get_counters())
+
+    def test_state(self):
+        # Decoding has to continue from a stored state
+        config, raw_data = self.configs[1]
+        hit_data, hit_decoder = self._decode(config, raw_data, len(raw_data))
+        first_decoder = decoder.Decoder(**config)
+        first_hit_data = first_decoder.decode_array(raw_data[:10])
+        second_decoder = decoder.Decoder(**config)
+        second_decoder.set_state(first_decoder.get_state())
+        np.testing.assert_array_equal(np.concatenate((first_hit_data, second_decoder.decode_array(raw_data[10:]))),
+                                      hit_data)
+
+    def test_error_records(self):
+        config = IDX_DEBUG_CONFIG
+        hit_decoder = decoder.Decoder(**config)
+        raw_data = np.delete(self.raw_data_3, [1])  # TJ data1 word of the first hit is missing
+        hit_data = hit_decoder.decode_array(raw_data)
+        self.assertEqual(hit_decoder.get_error_count(), 1)
+        error = hit_data[0]
+        self.assertEqual((error["col"], error["row"], error["le"], error["cnt"], error["scan_param_id"]),
+                         (2, 0xE1, 1, raw_data[1], 1))
+        # Without error records only the TJ hits of the complete blocks are left
+        hit_decoder = decoder.Decoder(**dict(config, options=config["options"] & ~decoder.ERROR_RECORDS))
+        self.assertEqual(np.count_nonzero(hit_decoder.decode_array(raw_data)["col"] < 0xE0), 4)
+
+    def test_resync_tj_data(self):
+        # A data word 0 within an incomplete hit starts the next hit (see TJMonoPix.interpret_data_timestamp)
+        d0, d1, d2 = self.raw_data_3[:3]
+        config = {"tj_words": 3, "formats": decoder.TJ_DATA, "options": decoder.RESYNC_TJ_DATA}
+        hit, _ = self._decode(config, self.raw_data_3[:3], 3)
+        for raw_data, n_hits, n_discarded in (([d0, d1, d0, d1, d2], 1, 2),
+                                              ([d1, d0, d1, d2, d2], 1, 2),
+                                              ([d0, d0, d0, d1, d2, d0, d1], 1, 2)):
+            raw_data = np.array(raw_data, dtype=np.uint32)
+            for chunk_size in (1, 2, len(raw_data)):
+                hit_data, hit_decoder = self._decode(config, raw_data, chunk_size)
+                self.assertEqual(len(hit_data), n_hits)
+                np.testing.assert_array_equal(hit_data[["col", "row", "le", "te", "timestamp"]],
+                                              hit[["col", "row", "le", "te", "timestamp"]])
+                self.assertEqual(hit_decoder.get_discarded_count(), n_discarded)
+        # Without the option the data word 0 is only an error
+        hit_data, _ = self._decode(dict(config, options=0), np.array([d0, d1, d0, d1, d2], dtype=np.uint32), 5)
+        self.assertEqual(len(hit_data), 0)
+
+    def test_hit_dtype(self):
+        # Records are projected onto other hit dtypes
+        config, raw_data = self.configs[0]
+        hit_data, _ = self._decode(config, raw_data, len(raw_data))
+        hit_decoder = decoder.Decoder(**config)
+        hits = hit_decoder.decode_array(raw_data, [("col", "u1"), ("row", "<u2"), ("tot", "u1")])
+        np.testing.assert_array_equal(hits["col"], hit_data["col"])
+        np.testing.assert_array_equal(hits["row"], hit_data["row"])
+        self.assertFalse(np.any(hits["tot"]))
+
+    def test_parallel_data(self):
+        # Parallel decoding has to give the same result as sequential decoding, for all configurations
+        for config, raw_data in self.configs:
+            raw_data_file = self.write_raw_data(np.tile(np.concatenate((raw_data, np.delete(raw_data, [1, 17]))), 50))
+            for chunk_size in (10, 33, 1000):
+                hit_data, errors, counters = [], [], []
+                for n_processes in (1, 2):
+                    hit_decoder = decoder.Decoder(**config)
+                    hit_data.append(np.concatenate([hits for _, _, hits in decoder.decode_h5_chunks(
+                        hit_decoder, raw_data_file, decoder.RECORD_DTYPE, chunk_size, n_processes=n_processes)]))
+                    errors.append(hit_decoder.get_error_count())
+                    counters.append(hit_decoder.get_counters())
+                np.testing.assert_array_equal(hit_data[0], hit_data[1])
+                self.assertEqual(errors[0], errors[1])
+                np.testing.assert_array_equal(counters[0], counters[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import time
+import unittest
+from threading import current_thread
+import numpy as np
+import pytest
+from fifo_readout import DataBuffer, FifoReadout, MultiFifoReadout, ReadoutTelemetry
+
+
+class FakeFifo(dict):
+    def __init__(self, data):
+        dict.__init__(self, FIFO_SIZE=0, RESET=0)
+        self.data = list(data)
+
+    def get_data(self):
+        return self.data.pop(0) if self.data else np.zeros(0, dtype=np.uint32)
+
+
+class FakeDataRx(object):
+    LOST_COUNT = 0
+
+
+class BrokenDataRx(object):
+    @property
+    def LOST_COUNT(self):
+        raise IOError("Readout board not responding")
+
+
+class TestDataBuffer(unittest.TestCase):
+    def test_append(self):
+        data_buffer = DataBuffer(n_words=16, max_words=1000)
+        readouts = [np.arange(i, 10 * i, dtype=np.uint32) for i in range(1, 14)]
+        for i, data in enumerate(readouts):
+            data_buffer.append(data, float(i), i + 1., i)
+        self.assertEqual(len(data_buffer), len(readouts))
+        np.testing.assert_array_equal(data_buffer.get_data(), np.concatenate(readouts))
+        meta_data = data_buffer.get_meta_data()
+        np.testing.assert_array_equal(meta_data["index_stop"] - meta_data["index_start"],
+                                      [r.shape[0] for r in readouts])
+        np.testing.assert_array_equal(meta_data["timestamp_start"], np.arange(len(readouts)))
+
+        data, timestamp_start, _, error = data_buffer.popleft()
+        np.testing.assert_array_equal(data, readouts[0])
+        self.assertEqual((timestamp_start, error), (0., 0))
+        np.testing.assert_array_equal(data_buffer.drain(), np.concatenate(readouts[1:]))
+        self.assertEqual(len(data_buffer), 0)
+        self.assertRaises(IndexError, data_buffer.popleft)
+
+        # Space of drained readouts is reused
+        for _ in range(100):
+            data_buffer.append(readouts[-1])
+            np.testing.assert_array_equal(data_buffer.drain(), readouts[-1])
+        self.assertEqual(data_buffer._words.shape[0], 1000)
+
+    def test_copies(self):
+        # Data taken from the buffer is not changed by later appends, which reuse the space of drained readouts
+        data_buffer = DataBuffer(n_words=16, max_words=16)
+        data_buffer.append(np.full(8, 1, dtype=np.uint32))
+        data = data_buffer.get_data()
+        drained = data_buffer.drain()
+        data_buffer.append(np.full(8, 2, dtype=np.uint32))
+        data_buffer.append(np.full(8, 3, dtype=np.uint32))
+        popped = data_buffer.popleft()[0]
+        data_buffer.drain()
+        data_buffer.append(np.full(16, 4, dtype=np.uint32))
+        np.testing.assert_array_equal(data, 1)
+        np.testing.assert_array_equal(drained, 1)
+        np.testing.assert_array_equal(popped, 2)
+
+    def test_overflow(self):
+        readouts = [np.full(30, i, dtype=np.uint32) for i in range(10)]
+        data_buffer = DataBuffer(n_words=16, max_words=100, overflow="drop_oldest")
+        for data in readouts:
+            data_buffer.append(data)
+        np.testing.assert_array_equal(data_buffer.get_data(), np.concatenate(readouts[-3:]))
+        self.assertEqual((data_buffer.dropped_chunks, data_buffer.dropped_words), (7, 210))
+
+        data_buffer = DataBuffer(n_words=16, max_words=100, overflow="drop_newest")
+        for data in readouts:
+            data_buffer.append(data)
+        np.testing.assert_array_equal(data_buffer.get_data(), np.concatenate(readouts[:3]))
+        self.assertEqual((data_buffer.dropped_chunks, data_buffer.dropped_words), (7, 210))
+        data_buffer.append(np.zeros(101, dtype=np.uint32))
+        self.assertEqual(data_buffer.dropped_chunks, 8)
+
+
+class TestReadoutTelemetry(unittest.TestCase):
+    def test_series(self):
+        telemetry = ReadoutTelemetry(n_samples=5)
+        queue_status = {"queued_words": 10, "queued_chunks": 1, "dropped_words": 0}
+        telemetry.start(0.)
+        for i in range(1, 8):
+            telemetry.add_poll(1000 * i, 0.001)
+            telemetry.add_poll(0, 0.003)
+            telemetry.add_handled_chunk(0.01)
+            telemetry.sample(float(i), queue_status, (i, None, 0, 0))
+        series = telemetry.get_series()
+        # Last 5 samples in time order
+        np.testing.assert_array_equal(series["timestamp"], np.arange(3, 8))
+        np.testing.assert_array_equal(series["words_per_s"], 1000 * np.arange(3, 8))
+        np.testing.assert_array_equal(series["chunks_per_s"], 1)
+        np.testing.assert_allclose(series["poll_latency"], 0.002)
+        np.testing.assert_allclose(series["max_poll_latency"], 0.003)
+        np.testing.assert_allclose(series["worker_latency"], 0.01)
+        np.testing.assert_array_equal(series["data_rx_discards"], np.arange(3, 8))
+        np.testing.assert_array_equal(series["tdc_discards"], 0)
+
+
+class TestFifoReadout(unittest.TestCase):
+    def test_rx_errors(self):
+        hit = np.array([0x00012345, 0x10000000, 0x20000000, 0x30000000], dtype=np.uint32)
+        # The second hit misses data words 2 and 3, the fourth hit is split across readouts
+        data = [np.concatenate((hit, hit[:2], hit, hit[:1])), hit[1:], hit[1:3], np.concatenate((hit, hit))]
+        readout = FifoReadout({"fifo": FakeFifo(data), "data_rx": FakeDataRx()}, rx_tj_words=4)
+        readout.readout_interval = 0.001
+        readout._decode_rx_data(np.zeros(0, dtype=np.uint32))  # Compile the decoder before the readout
+        readout.start(callback=lambda data_tuple: None)
+        time.sleep(0.1)
+        readout.stop()
+        series = readout.get_telemetry()
+        self.assertEqual(series["errors"][-1], 4)  # Second hit and data words 1 and 2 of the fifth hit
+        self.assertEqual(series["exceptions"][-1], 0)
+
+    def test_coalesce(self):
+        # The queued words stay bounded with a slow worker, coalesced chunks keep the data in order
+        data = [np.arange(100 * i, 100 * (i + 1), dtype=np.uint32) for i in range(200)]
+        for fallback in ("block", "drop"):
+            readout = FifoReadout({"fifo": FakeFifo(data), "data_rx": FakeDataRx()}, max_queued_words=1000,
+                                  queue_policy="coalesce")
+            readout.coalesce_fallback = fallback
+            readout.readout_interval = 0.0005
+            received = []
+
+            def callback(data_tuple):
+                received.append(data_tuple[0])
+                time.sleep(0.01)
+            readout.start(callback=callback)
+            time.sleep(0.5)
+            readout.stop()
+            queue_status = readout.get_queue_status()
+            self.assertLessEqual(queue_status["peak_queued_words"], 1000)
+            self.assertGreater(queue_status["coalesced_chunks"], 0)
+            received = np.concatenate(received)
+            self.assertEqual(received.shape[0] + queue_status["dropped_words"], 20000)
+            self.assertTrue(np.all(np.diff(received.astype(np.int64)) > 0))
+            if fallback == "block":
+                self.assertEqual(queue_status["dropped_words"], 0)
+
+    @pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_telemetry_error(self):
+        # The worker thread is stopped also if the readout fails when taking a telemetry sample. Without errback the
+        # exception ends the readout thread.
+        readout = FifoReadout({"fifo": FakeFifo([]), "data_rx": BrokenDataRx()})
+        readout.readout_interval = 0.001
+        readout.telemetry.interval = 0.01
+        readout.start(callback=lambda data_tuple: None)
+        readout.readout_thread.join(1.)
+        self.assertFalse(readout.readout_thread.is_alive())
+        readout.stop()
+        self.assertFalse(readout.worker_thread.is_alive())
+
+    def test_final_telemetry_error(self):
+        # A failing last telemetry sample after the readout loop is passed to the errback
+        errors = []
+
+        def errback(exc_info):
+            if current_thread().name == "ReadoutThread":  # Not the ones of the watchdog
+                errors.append(exc_info)
+        readout = FifoReadout({"fifo": FakeFifo([]), "data_rx": BrokenDataRx()})
+        readout.readout_interval = 0.001
+        readout.telemetry.interval = 1000.  # No sample within the readout loop
+        readout.start(callback=lambda data_tuple: None, errback=errback)
+        time.sleep(0.05)
+        self.assertEqual(len(errors), 0)
+        readout.stop()
+        self.assertFalse(readout.readout_thread.is_alive())
+        self.assertFalse(readout.worker_thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertIs(errors[0][0], IOError)
+
+
+class TestMultiFifoReadout(unittest.TestCase):
+    def test_readout(self):
+        data = [[np.full(10, 100 * board + i, dtype=np.uint32) for i in range(20)] for board in range(3)]
+        readout = MultiFifoReadout([{"fifo": FakeFifo(board_data), "data_rx": FakeDataRx()} for board_data in data])
+        readout.readout_interval = 0.001
+        received = [[] for _ in data]
+
+        def callback(data_tuple, board):
+            received[board].append(data_tuple[0])
+        readout.start(callback=callback)
+        time.sleep(0.2)
+        readout.stop()
+
+        for board, board_data in enumerate(data):
+            np.testing.assert_array_equal(np.concatenate(received[board]), np.concatenate(board_data))
+        self.assertEqual(readout.get_record_count(), 600)
+        self.assertEqual(readout.readouts[2].readout_interval, 0.001)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,18 @@
+import os
 import unittest
 import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.analysis import analysis_utils as au
+from tjmonopix.analysis import decoder
 from tjmonopix.analysis import interpreter
 
+HIT_DTYPE = interpreter.Interpreter.hit_dtype
 
+
+@pytest.mark.usefixtures("write_raw_data")
 class TestInterpreter(unittest.TestCase):
     def setUp(self):
-        hit_dtype = [("col", "<u1"), ("row", "<u2"), ("le", "<u1"), ("te", "<u1"), ("cnt", "<u4"),
-                     ("timestamp", "<i8"), ("scan_param_id", "<u4")]
         meta_dtype = [("index_start", "<u4"), ("index_stop", "<u4"), ("scan_param_id", "<u4")]
 
         # Meta data
@@ -34,7 +40,7 @@ class TestInterpreter(unittest.TestCase):
                                                    (253, 0, 0, 0, 228, 6784213859, 25),
                                                    (255, 0, 0, 0, 26086, 271120, 25),
                                                    (251, 0, 0, 0, 0, 1407380519721, 25)],
-                                                  dtype=hit_dtype)
+                                                  dtype=HIT_DTYPE)
 
         self.expected_broken_hit_data = np.array([(60, 175, 56, 5, 0, 8534559536, 1),
                                                   (103, 71, 52, 60, 0, 8534563520, 2),
@@ -42,7 +48,7 @@ class TestInterpreter(unittest.TestCase):
                                                   (40, 163, 47, 3, 0, 8534572896, 2),
                                                   (253, 0, 0, 0, 228, 6784213859, 3),
                                                   (255, 0, 0, 0, 26086, 271120, 3)],
-                                                 dtype=hit_dtype)
+                                                 dtype=HIT_DTYPE)
 
     def test_correct_data(self):
         my_interpreter = interpreter.Interpreter()
@@ -59,6 +65,124 @@ class TestInterpreter(unittest.TestCase):
 
         np.testing.assert_array_equal(hit_data, self.expected_broken_hit_data)
         self.assertEqual(errors, 2)
+        counters = my_interpreter.get_counters()
+        self.assertEqual(counters[au.COUNT_WORDS].sum(), len(self.broken_raw_data))
+        self.assertEqual(counters[au.COUNT_ERRORS, 0x20], 1)  # TJ data2 without data1
+        self.assertEqual(counters[au.COUNT_ERRORS, 0x30], 1)  # TJ data3 without data2
+        self.assertEqual(counters[au.COUNT_ERRORS].sum(), errors)
+
+    def test_iter_hits(self):
+        my_interpreter = interpreter.Interpreter()
+        hit_data = [hits.copy() for hits in my_interpreter.iter_hits(self.correct_raw_data, self.meta_data_for_correct,
+                                                                      chunk_size=5)]
+
+        np.testing.assert_array_equal(np.concatenate(hit_data), self.expected_correct_hit_data)
+        self.assertEqual(my_interpreter.get_error_count(), 0)
+
+    def test_chunked_data(self):
+        # Data blocks split across chunk boundaries have to give the same result as interpreting all at once
+        for chunk_size in (1, 2, 3, 5, 7):
+            data_interpreter = interpreter.RawDataInterpreter(chunk_size)
+            hit_data = np.zeros(shape=len(self.broken_raw_data), dtype=HIT_DTYPE)
+            hit_index = 0
+            for start in range(0, len(self.broken_raw_data), chunk_size):
+                hit_index = data_interpreter.decode(self.broken_raw_data[start:start + chunk_size], hit_data, hit_index)
+
+            np.testing.assert_array_equal(hit_data[:hit_index][["col", "row", "le", "te", "cnt", "timestamp"]],
+                                          self.expected_broken_hit_data[["col", "row", "le", "te", "cnt", "timestamp"]])
+            self.assertEqual(data_interpreter.get_error_count(), 2)
+
+    def test_parallel_data(self):
+        # Decoding chunks in parallel has to give the same result as sequential decoding, also if chunk boundaries
+        # are not at resynchronisation points
+        raw_data_file = self.write_raw_data(np.tile(np.concatenate((self.correct_raw_data, self.broken_raw_data)), 100))
+        for chunk_size in (10, 33, 1000):
+            hit_data, errors, counters = [], [], []
+            for n_processes in (1, 2):
+                data_interpreter = interpreter.RawDataInterpreter(chunk_size)
+                hit_data.append(np.concatenate([hits for _, _, hits in decoder.decode_h5_chunks(
+                    data_interpreter, raw_data_file, HIT_DTYPE, chunk_size, n_processes=n_processes)]))
+                errors.append(data_interpreter.get_error_count())
+                counters.append(data_interpreter.get_counters())
+            np.testing.assert_array_equal(hit_data[0], hit_data[1])
+            self.assertEqual(errors[0], errors[1])
+            np.testing.assert_array_equal(counters[0], counters[1])
+
+    def test_split_records(self):
+        # Record type tables have to contain the same data as the mixed Hits table, in the same order
+        records = []
+        for split_records in (False, True):
+            hit_file = os.path.join(self.tmp_dir, "hits_%s.h5" % split_records)
+            data_interpreter = interpreter.RawDataInterpreter(chunk_size=10)
+            with tb.open_file(hit_file, "w") as out_file:
+                hit_writer = au.HitWriter(out_file, HIT_DTYPE, split_records=split_records)
+                for start in range(0, len(self.correct_raw_data), 10):
+                    hit_data = np.zeros(10, dtype=HIT_DTYPE)
+                    hit_index = data_interpreter.decode(self.correct_raw_data[start:start + 10], hit_data, 0)
+                    hit_writer.append(hit_data[:hit_index], self.meta_data_for_correct)
+            with tb.open_file(hit_file) as in_file:
+                records.append(au.read_records(in_file, dict((name, None) for name in au.RECORD_TABLES)))
+
+        mixed, split = records
+        self.assertEqual([len(split[name]) for name in au.RECORD_TABLES], [5, 1, 1, 1, 0])
+        np.testing.assert_array_equal(split["Hits"][["col", "row", "le", "te", "timestamp", "scan_param_id"]],
+                                      self.expected_correct_hit_data[:5][["col", "row", "le", "te", "timestamp",
+                                                                          "scan_param_id"]])
+        self.assertEqual(split["TLU"]["trigger_number"][0], 26086)
+        self.assertEqual(split["HitOr"]["cnt"][0], 228)
+        self.assertEqual(split["Timestamps"]["source"][0], 251)
+        raw_index = np.concatenate([split[name]["raw_index"] for name in au.RECORD_TABLES])
+        self.assertTrue(np.all(np.diff(np.sort(raw_index)) > 0))
+        for name in au.RECORD_TABLES:
+            for field in mixed[name].dtype.names:
+                if field != "raw_index":  # Row in the mixed Hits table
+                    np.testing.assert_array_equal(mixed[name][field], split[name][field])
+        np.testing.assert_array_equal(np.argsort(raw_index), np.argsort(np.concatenate(
+            [mixed[name]["raw_index"] for name in au.RECORD_TABLES])))
+
+    def test_compact_hits(self):
+        # The compact Hits table has to give the same hits, also for differences that do not fit
+        raw_data = np.tile(self.correct_raw_data, 3)
+        raw_data[29] += 0xFFFF  # Timestamp of one hit about 2 ** 48 later
+        meta_data = np.array([(0, len(raw_data), 7)], dtype=self.meta_data_for_correct.dtype)
+        records = []
+        for compact in (False, True):
+            hit_file = os.path.join(self.tmp_dir, "hits_%s.h5" % compact)
+            data_interpreter = interpreter.RawDataInterpreter(chunk_size=10)
+            with tb.open_file(hit_file, "w") as out_file:
+                hit_writer = au.HitWriter(out_file, HIT_DTYPE, split_records=True, compact=compact)
+                for start in range(0, len(raw_data), 30):
+                    hit_writer.append(data_interpreter.decode_array(raw_data[start:start + 30], HIT_DTYPE),
+                                      meta_data)
+                if compact:
+                    self.assertGreater(out_file.root.HitsBase.nrows, 3)  # More than one per chunk
+            with tb.open_file(hit_file) as in_file:
+                records.append(au.read_records(in_file, {"Hits": None})["Hits"])
+        self.assertEqual(len(records[0]), 15)
+        for field in records[1].dtype.names:
+            np.testing.assert_array_equal(records[0][field], records[1][field])
+
+    def test_packed_hits(self):
+        hits = self.expected_correct_hit_data[:5]
+        packed = au.pack_hits(hits, timestamp_base=8534500000)
+        self.assertEqual(packed.dtype, np.uint64)
+        unpacked = au.unpack_hits(packed, timestamp_base=8534500000, hit_dtype=hits.dtype)
+        np.testing.assert_array_equal(unpacked[["col", "row", "le", "te", "cnt", "timestamp"]],
+                                      hits[["col", "row", "le", "te", "cnt", "timestamp"]])
+        with self.assertRaises(ValueError):
+            au.pack_hits(self.expected_correct_hit_data)  # TLU and timestamp records
+
+    def test_compact_hits_range(self):
+        # Hits without scan parameter id keep -1, other values that do not fit raise ValueError
+        hits = au.split_records(self.expected_correct_hit_data, np.arange(8))["Hits"]
+        hits["scan_param_id"][1] = 0xFFFFFFFF  # -1 of assign_scan_param_id
+        compact, bases = au.compact_hits(hits)
+        np.testing.assert_array_equal(au.expand_hits(compact, bases)["scan_param_id"], [22, -1, 24, 24, 24])
+        for field, value in (("scan_param_id", 0xFFFF), ("scan_param_id", 0x10000), ("row", 0x100)):
+            broken_hits = hits.copy()
+            broken_hits[field][0] = value
+            with self.assertRaises(ValueError):
+                au.compact_hits(broken_hits)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import os
+import unittest
+import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.analysis import interpreter_idx
+
+
+@pytest.mark.usefixtures("write_raw_data")
+class TestLiveInterpreter(unittest.TestCase):
+    def setUp(self):
+        self.raw_data_file = self.write_raw_data(readouts_per_scan_param=20)
+        with tb.open_file(self.raw_data_file) as h5_file:
+            self.raw_data = h5_file.root.raw_data[:]
+            self.meta_data = h5_file.root.meta_data[:]
+        self.hit_file = os.path.join(self.tmp_dir, "raw_data_hit.h5")
+        interpreter_idx.interpret_idx_h5(self.raw_data_file, self.hit_file)
+        with tb.open_file(self.hit_file) as h5_file:
+            self.hits = h5_file.root.Hits[:]
+        self.live_hit_file = os.path.join(self.tmp_dir, "live_hit.h5")
+
+    def _append(self, live_interpreter, meta_data):
+        for meta in meta_data:
+            live_interpreter.append(self.raw_data[meta["index_start"]:meta["index_stop"]], meta["scan_param_id"])
+
+    def test_live_interpreter(self):
+        # Hits have to be the same as the ones interpreted from the raw data file
+        live_interpreter = interpreter_idx.LiveInterpreter(self.live_hit_file, batch_words=1000)
+        self._append(live_interpreter, self.meta_data)
+        live_interpreter.close()
+        with tb.open_file(self.live_hit_file) as h5_file:
+            np.testing.assert_array_equal(h5_file.root.Hits[:], self.hits)
+        self.assertFalse(os.path.exists(self.live_hit_file + ".lock"))
+
+    def test_continue_incremental(self):
+        # Interpretation stopped during the scan is continued by the incremental interpretation
+        live_interpreter = interpreter_idx.LiveInterpreter(self.live_hit_file, batch_words=1000)
+        self._append(live_interpreter, self.meta_data[:self.meta_data.shape[0] // 2])
+        live_interpreter.close()
+        interpreter_idx.interpret_idx_h5(self.raw_data_file, self.live_hit_file, incremental=True)
+        with tb.open_file(self.live_hit_file) as h5_file:
+            np.testing.assert_array_equal(h5_file.root.Hits[:], self.hits)
+        self.assertFalse(os.path.exists(self.live_hit_file + ".lock"))
+
+
+    def test_error_records(self):
+        # Errors are only counted by default, debug 0x4 also writes their records (see analysis_utils.RECORD_TABLES)
+        def is_error(hits):
+            return ((hits["col"] >= 0xE0) & (hits["col"] < 0xF0)) | ((hits["row"] == 0xE1) & (hits["col"] < 3))
+
+        self.assertFalse(np.any(is_error(self.hits)))
+        with tb.open_file(self.hit_file) as h5_file:
+            n_errors = h5_file.root.RawDataCounters[:]["errors"].sum()
+        self.assertGreater(n_errors, 0)
+        interpreter_idx.interpret_idx_h5(self.raw_data_file, self.hit_file, debug=0x7)
+        with tb.open_file(self.hit_file) as h5_file:
+            hits = h5_file.root.Hits[:]
+        self.assertGreater(np.count_nonzero(is_error(hits)), 0)
+        np.testing.assert_array_equal(hits[~is_error(hits)], self.hits)
+
+
+class TestInterRawIdx(unittest.TestCase):
+    def test_reset_on_error(self):
+        # Data partially decoded at the end of a chunk is kept, unless the chunk has errors
+        d0, d1, d2 = np.array([119565277, 533409971, 654311425], dtype=np.uint32)  # TJ hit of older firmware
+        hits = interpreter_idx.InterRawIdx(chunk=5).run(np.array([d0, d1, d2, d0, d1, d2], dtype=np.uint32))
+        np.testing.assert_array_equal(hits["scan_param_id"], [2, 5])
+        hits = interpreter_idx.InterRawIdx(chunk=5).run(np.array([d1, d0, d1, d2, d0, d1, d2], dtype=np.uint32))
+        # Data words 1 and 2 of the hit split across the chunks are errors
+        np.testing.assert_array_equal(hits["row"] == 0xE1, [True, False, True, True])
+        np.testing.assert_array_equal(hits["scan_param_id"], [0, 3, 5, 6])
+        self.assertEqual(len(interpreter_idx.raw2list(np.array([d0, d1, d2], dtype=np.uint32))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.analysis import decoder
+from tjmonopix.analysis import interpreter
+from tjmonopix.analysis import raw_cache
+
+
+@pytest.mark.usefixtures("write_raw_data")
+class TestRawCache(unittest.TestCase):
+    def setUp(self):
+        raw_data = np.array([119565277, 533409971, 654311425, 805306368, 117615582, 533409971,
+                             654311425, 805306368, 1661002752, 1644167572, 1633608547, 3258017254], dtype=np.uint32)
+        self.raw_data = np.tile(raw_data, 100)
+        self.raw_data_file = self.write_raw_data(self.raw_data, readout_size=12, readouts_per_scan_param=10)
+        with tb.open_file(self.raw_data_file) as h5_file:
+            self.meta_data = h5_file.root.meta_data[:]
+
+    def test_create_raw_cache(self):
+        self.assertFalse(raw_cache.has_raw_cache(self.raw_data_file))
+        raw_file = raw_cache.create_raw_cache(self.raw_data_file, chunk_size=100)
+        self.assertTrue(raw_cache.has_raw_cache(self.raw_data_file))
+        for file_name in (raw_file, self.raw_data_file):
+            with raw_cache.open_raw_data(file_name) as (raw_data, meta_data):
+                self.assertIsInstance(raw_data, np.memmap)
+                np.testing.assert_array_equal(raw_data[:], self.raw_data)
+                for name in ("index_start", "index_stop", "scan_param_id"):
+                    np.testing.assert_array_equal(meta_data[name], self.meta_data[name])
+        with raw_cache.open_raw_data(self.raw_data_file, use_cache=False) as (raw_data, _):
+            self.assertIsInstance(raw_data, tb.EArray)
+
+    def test_raw_cache_writer(self):
+        # Cache written readout by readout has to be the same as the one created from the raw data file
+        writer = raw_cache.RawCacheWriter(self.raw_data_file)
+        for meta in self.meta_data:
+            writer.append(self.raw_data[meta["index_start"]:meta["index_stop"]], scan_param_id=meta["scan_param_id"])
+        writer.close()
+        self.assertTrue(raw_cache.has_raw_cache(self.raw_data_file))
+        raw_file, idx_file = raw_cache.get_cache_files(self.raw_data_file)
+        with open(raw_file, "rb") as in_file:
+            written = in_file.read()
+        raw_cache.create_raw_cache(self.raw_data_file)
+        with open(raw_file, "rb") as in_file:
+            self.assertEqual(in_file.read(), written)
+
+    def test_decode(self):
+        # Decoding the cache has to give the same result as decoding the raw data file
+        def decode(file_name, n_processes):
+            data_interpreter = interpreter.RawDataInterpreter(chunk_size=50)
+            return np.concatenate([hits for _, _, hits in decoder.decode_h5_chunks(
+                data_interpreter, file_name, decoder.RECORD_DTYPE, 50, n_processes=n_processes)])
+
+        hit_data = [decode(self.raw_data_file, 1)]
+        raw_file = raw_cache.create_raw_cache(self.raw_data_file)
+        hit_data += [decode(raw_file, 1), decode(raw_file, 2), decode(self.raw_data_file, 2)]
+        for hits in hit_data[1:]:
+            np.testing.assert_array_equal(hits, hit_data[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
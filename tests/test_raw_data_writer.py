@@ -0,0 +1,133 @@
+import os
+import unittest
+import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.analysis import raw_cache
+from tjmonopix.raw_data_writer import RawDataWriter, SegmentedRawDataWriter, create_raw_data, extract_board
+
+
+@pytest.mark.usefixtures("tmp_dir")
+class TestRawDataWriter(unittest.TestCase):
+    def setUp(self):
+        self.h5_file = tb.open_file(os.path.join(self.tmp_dir, "raw_data.h5"), "w")
+        self.raw_data_earray, self.meta_data_table = create_raw_data(self.h5_file)
+
+    def tearDown(self):
+        self.h5_file.close()
+
+    def test_batches(self):
+        writer = RawDataWriter(self.raw_data_earray, self.meta_data_table, batch_words=100, max_age=1e9)
+        readouts = [np.arange(n, dtype=np.uint32) for n in (30, 0, 50, 40, 10, 20)]
+        for i, raw_data in enumerate(readouts[:4]):
+            writer.append(raw_data, float(i), i + 1., scan_param_id=0, error=i)
+        # Written when reaching batch_words
+        self.assertEqual(self.raw_data_earray.nrows, 120)
+        self.assertEqual(self.meta_data_table.nrows, 4)
+        writer.append(readouts[4], 4., 5., scan_param_id=0)
+        self.assertEqual(self.meta_data_table.nrows, 4)
+        # Written on change of the scan parameter
+        writer.append(readouts[5], 5., 6., scan_param_id=1)
+        self.assertEqual(self.meta_data_table.nrows, 5)
+        writer.close()
+
+        np.testing.assert_array_equal(self.raw_data_earray[:], np.concatenate(readouts))
+        meta_data = self.meta_data_table[:]
+        np.testing.assert_array_equal(meta_data["data_length"], [r.shape[0] for r in readouts])
+        np.testing.assert_array_equal(meta_data["index_stop"], np.cumsum(meta_data["data_length"]))
+        np.testing.assert_array_equal(meta_data["index_start"], meta_data["index_stop"] - meta_data["data_length"])
+        np.testing.assert_array_equal(meta_data["timestamp_start"], np.arange(6))
+        np.testing.assert_array_equal(meta_data["scan_param_id"], [0, 0, 0, 0, 0, 1])
+        np.testing.assert_array_equal(meta_data["error"][:4], np.arange(4))
+
+    def test_max_age(self):
+        writer = RawDataWriter(self.raw_data_earray, self.meta_data_table, max_age=0.)
+        writer.append(np.arange(10, dtype=np.uint32))
+        self.assertEqual(self.raw_data_earray.nrows, 10)
+        self.assertEqual(self.meta_data_table.nrows, 1)
+
+    def test_layout(self):
+        self.assertEqual((self.raw_data_earray.filters.complib, self.raw_data_earray.filters.complevel), ("blosc", 5))
+        self.assertEqual(self.meta_data_table.filters.complib, "zlib")
+        with tb.open_file(os.path.join(self.tmp_dir, "layout.h5"), "w") as h5_file:
+            raw_data_earray, meta_data_table = create_raw_data(h5_file, {
+                "raw_data": {"complib": "blosc:zstd", "complevel": 3, "shuffle": "bit", "chunkshape": 4096},
+                "meta_data": {"complib": None}})
+            self.assertEqual(raw_data_earray.filters.complib, "blosc:zstd")
+            self.assertTrue(raw_data_earray.filters.bitshuffle)
+            self.assertEqual(raw_data_earray.chunkshape, (4096, ))
+            self.assertEqual(meta_data_table.filters.complevel, 0)
+            self.assertRaises(ValueError, create_raw_data, h5_file, {"raw_data": {"complib": "lzma"}})
+            self.assertRaises(ValueError, create_raw_data, h5_file, {"raw_data": {"level": 3}})
+
+    def test_extract_board(self):
+        self.meta_data_table.attrs.scan_id = "test_scan"
+        writer = RawDataWriter(self.raw_data_earray, self.meta_data_table)
+        writer.append(np.arange(10, dtype=np.uint32))
+        writer.close()
+        group = self.h5_file.create_group(self.h5_file.root, "board_1")
+        raw_data_earray, meta_data_table = create_raw_data(self.h5_file, where=group)
+        meta_data_table.attrs.scan_id = "test_scan_1"
+        writer = RawDataWriter(raw_data_earray, meta_data_table)
+        writer.append(np.arange(5, dtype=np.uint32))
+        writer.close()
+        self.h5_file.create_vlarray(self.h5_file.root, name="kwargs", atom=tb.VLStringAtom())
+        self.h5_file.close()
+
+        for board, n_words in ((0, 10), (1, 5)):
+            with tb.open_file(extract_board(self.h5_file.filename, board)) as in_file:
+                np.testing.assert_array_equal(in_file.root.raw_data[:], np.arange(n_words))
+                self.assertEqual(in_file.root.meta_data.nrows, 1)
+                self.assertEqual(in_file.root.meta_data.attrs.scan_id, "test_scan_1" if board else "test_scan")
+                self.assertIn("kwargs", in_file.root)
+                self.assertNotIn("board_1", in_file.root)
+
+
+@pytest.mark.usefixtures("tmp_dir")
+class TestSegmentedRawDataWriter(unittest.TestCase):
+    def setUp(self):
+        self.scan_file = os.path.join(self.tmp_dir, "scan.h5")
+
+    def test_segments(self):
+        readouts = [np.arange(i, i + 10 * i, dtype=np.uint32) for i in range(30)]
+        with tb.open_file(self.scan_file, "w") as h5_file:
+            _, meta_data_table = create_raw_data(h5_file)
+            meta_data_table.attrs.scan_id = "test_scan"
+            h5_file.create_vlarray(h5_file.root, name="kwargs", atom=tb.VLStringAtom())
+            writer = SegmentedRawDataWriter(h5_file, segment_words=1000, segment_scan_param=True)
+            for i, raw_data in enumerate(readouts):
+                writer.append(raw_data, float(i), i + 1., scan_param_id=i // 20)
+                if i == 16:  # Closed segments can be read during the scan
+                    with raw_cache.open_raw_data(self.scan_file) as (closed_raw_data, _):
+                        self.assertEqual(closed_raw_data.shape[0], 910)
+            meta_data_table.attrs.status = "end"
+            writer.close()
+
+        manifest = raw_cache.read_manifest(self.scan_file)
+        self.assertTrue(manifest["complete"])
+        segments = manifest["segments"]
+        # New segment before exceeding 1000 words and with the new scan parameter
+        self.assertEqual([s["index_start"] for s in segments], [0, 910, 1900, 2760, 3510])
+        self.assertEqual([s["scan_param_id_start"] for s in segments], [0, 0, 1, 1, 1])
+        for segment_file in raw_cache.get_segment_files(self.scan_file):
+            with tb.open_file(segment_file) as in_file:
+                self.assertEqual(in_file.root.meta_data.attrs.scan_id, "test_scan")
+                self.assertEqual(in_file.root.meta_data[0]["index_start"], 0)
+                self.assertIn("kwargs", in_file.root)
+        with tb.open_file(raw_cache.get_segment_file(self.scan_file, 4)) as in_file:
+            self.assertEqual(in_file.root.meta_data.attrs.status, "end")
+
+        with raw_cache.open_raw_data(self.scan_file) as (raw_data, meta_data):
+            np.testing.assert_array_equal(raw_data[:], np.concatenate(readouts))
+            np.testing.assert_array_equal(raw_data[440:2000], np.concatenate(readouts)[440:2000])
+            self.assertEqual(raw_data[-1], readouts[-1][-1])
+        np.testing.assert_array_equal(meta_data["index_stop"], np.cumsum([r.shape[0] for r in readouts]))
+        np.testing.assert_array_equal(meta_data["scan_param_id"], np.arange(30) // 20)
+
+        # Analysis cache of the whole scan
+        raw_cache.create_raw_cache(self.scan_file)
+        self.assertTrue(raw_cache.has_raw_cache(self.scan_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
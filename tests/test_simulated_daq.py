@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from tjmonopix.analysis import decoder
+from tjmonopix.analysis import interpreter
+from tjmonopix.simulated_daq import ChipSimulation
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 1000.
+
+    def __call__(self):
+        return self.time
+
+
+class FakeDut(dict):
+    fl_n = 1
+
+
+def _one_hot(value):
+    bits = np.zeros(128, dtype=bool)
+    bits[value] = True
+    return bits
+
+
+class TestChipSimulation(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dut = FakeDut(CONF_SR={"COL_PULSE_SEL": np.zeros(448, dtype=bool), "INJ_ROW": np.zeros(224, dtype=bool),
+                                    "SET_VH": _one_hot(80), "SET_VL": _one_hot(40)})
+
+    def _simulation(self, **config):
+        simulation = ChipSimulation(self.dut, clock=self.clock, **config)
+        self.dut.update(simulation.modules)
+        return simulation
+
+    def _decode(self, raw_data):
+        hit_decoder = decoder.Decoder(**interpreter.RAW_DATA_CONFIG)
+        hit_data = hit_decoder.decode_array(raw_data)
+        self.assertEqual(hit_decoder.get_error_count(), 0)
+        return hit_data
+
+    def test_source(self):
+        self._simulation(hit_rate=1e5, hot_pixels=2, hot_pixel_rate=1e3)
+        self.clock.time += 1.
+        self.assertEqual(self.dut["fifo"]["FIFO_SIZE"], 0)  # data_rx is not enabled
+        self.dut["data_rx"].set_en(True)
+        self.dut["tlu"]["TRIGGER_ENABLE"] = 1
+        raw_data = []
+        for _ in range(10):
+            self.clock.time += 0.01
+            raw_data.append(self.dut["fifo"].get_data())
+        raw_data = np.concatenate(raw_data)
+        hit_data = self._decode(raw_data)
+        tj_hits = hit_data[hit_data["col"] < 0xE0]
+        self.assertEqual(tj_hits.shape[0], np.count_nonzero(raw_data & 0xF0000000 == 0))
+        self.assertTrue(9000 < tj_hits.shape[0] < 11000)
+        # TLU trigger numbers continue from readout to readout
+        trigger_number = raw_data[raw_data & 0x80000000 != 0] & 0xFFFF
+        np.testing.assert_array_equal(trigger_number, np.arange(trigger_number.shape[0]))
+        self.assertEqual(self.dut["data_rx"].LOST_COUNT, 0)
+
+    def test_injection(self):
+        simulation = self._simulation(hit_rate=0., threshold=25., threshold_sigma=1., noise=1.)
+        self.dut["data_rx"].set_en(True)
+        self.dut["timestamp_inj"]["ENABLE"] = 1
+        self.dut["inj"].set_delay(500)
+        self.dut["inj"].set_width(500)
+        self.dut["inj"].set_repeat(50)
+        self.dut["CONF_SR"]["COL_PULSE_SEL"][112 + 10] = True
+        self.dut["CONF_SR"]["COL_PULSE_SEL"][112 + 20] = True
+        self.dut["CONF_SR"]["INJ_ROW"][5:10] = True
+        n_hits = []
+        for charge in (15, 25, 35):
+            self.dut["CONF_SR"]["SET_VH"] = _one_hot(40 + charge)
+            self.dut["inj"].start()
+            self.assertFalse(self.dut["inj"].is_ready)
+            self.clock.time += 0.01
+            self.assertTrue(self.dut["inj"].is_ready)
+            hit_data = self._decode(self.dut["fifo"].get_data())
+            tj_hits = hit_data[hit_data["col"] < 0xE0]
+            self.assertEqual(np.count_nonzero(hit_data["col"] == 0xFC), 50)  # Injection timestamps
+            self.assertTrue(np.all(np.isin(tj_hits["col"], [10, 20])))
+            self.assertTrue(np.all((tj_hits["row"] >= 5) & (tj_hits["row"] < 10)))
+            n_hits.append(tj_hits.shape[0])
+        self.assertEqual(n_hits[0], 0)
+        self.assertTrue(0 < n_hits[1] < 500)
+        self.assertEqual(n_hits[2], 500)
+        self.assertEqual(simulation.lost_hits, 0)
+
+    def test_fifo_overflow(self):
+        simulation = self._simulation(hit_rate=1e6, cluster_size=1., fifo_words=4000)
+        self.dut["data_rx"].set_en(True)
+        self.clock.time += 0.1  # The host falls behind: 100000 hits, 1000 fit into the FIFO
+        self.assertEqual(self.dut["fifo"]["FIFO_SIZE"], 4 * 4000)
+        self.assertTrue(90000 < simulation.lost_hits < 110000)
+        self.assertEqual(self.dut["data_rx"].LOST_COUNT, 0xFF)
+        self.assertEqual(self._decode(self.dut["fifo"].get_data()).shape[0], 1000)
+        self.dut["fifo"]["RESET"]
+        self.dut["data_rx"].reset()
+        self.clock.time += 0.001
+        self.assertTrue(0 < self.dut["fifo"]["FIFO_SIZE"] < 4 * 4000)
+        self.assertEqual(self.dut["data_rx"].LOST_COUNT, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
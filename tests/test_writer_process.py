@@ -0,0 +1,53 @@
+import os
+import unittest
+import numpy as np
+import pytest
+import tables as tb
+from tjmonopix.analysis import raw_cache
+from tjmonopix.raw_data_writer import create_raw_data
+from tjmonopix.writer_process import RingBuffer, WriterProcess, merge_raw_data
+
+
+@pytest.mark.usefixtures("tmp_dir")
+class TestWriterProcess(unittest.TestCase):
+    def test_ring_buffer(self):
+        ring_buffer = RingBuffer(10)
+        position = ring_buffer.put(np.arange(7, dtype=np.uint32))
+        self.assertIsNone(ring_buffer.put(np.arange(4, dtype=np.uint32), timeout=0.01))  # Full
+        np.testing.assert_array_equal(ring_buffer.get(position, 7), np.arange(7))
+        ring_buffer.release(7)
+        # Wraps around the end of the buffer
+        position = ring_buffer.put(np.arange(10, 16, dtype=np.uint32))
+        np.testing.assert_array_equal(ring_buffer.get(position, 6), np.arange(10, 16))
+        self.assertEqual(ring_buffer.get_fill_level(), 6)
+        self.assertRaises(ValueError, ring_buffer.put, np.arange(11, dtype=np.uint32))
+
+    def test_writer_process(self):
+        scan_file = os.path.join(self.tmp_dir, "scan.h5")
+        with tb.open_file(scan_file, "w") as h5_file:
+            _, meta_data_table = create_raw_data(h5_file)
+            meta_data_table.attrs.scan_id = "test_scan"
+            h5_file.create_vlarray(h5_file.root, name="kwargs", atom=tb.VLStringAtom())
+        # Ring buffer smaller than the data, the writer process has to release words for the readouts to continue
+        writer_process = WriterProcess(os.path.join(self.tmp_dir, "scan_raw_data.h5"), ring_size=1000,
+                                       raw_cache_file=scan_file)
+        writer_process.start()
+        readouts = [np.arange(i, i + 10 * i, dtype=np.uint32) for i in range(50)]
+        for i, raw_data in enumerate(readouts):
+            writer_process.append(raw_data, float(i), i + 1., scan_param_id=i // 10)
+        writer_process.close()
+        merge_raw_data(writer_process.raw_data_file, scan_file)
+
+        self.assertFalse(os.path.exists(writer_process.raw_data_file))
+        with tb.open_file(scan_file) as in_file:
+            np.testing.assert_array_equal(in_file.root.raw_data[:], np.concatenate(readouts))
+            meta_data = in_file.root.meta_data[:]
+            self.assertEqual(in_file.root.meta_data.attrs.scan_id, "test_scan")
+            self.assertIn("kwargs", in_file.root)
+        np.testing.assert_array_equal(meta_data["data_length"], [r.shape[0] for r in readouts])
+        np.testing.assert_array_equal(meta_data["scan_param_id"], np.arange(50) // 10)
+        self.assertTrue(raw_cache.has_raw_cache(scan_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,9 @@ import numba
 from tqdm import tqdm
 
 from tjmonopix.analysis import analysis_utils as au
+from tjmonopix.analysis import decoder
 from tjmonopix.analysis import interpreter
+from tjmonopix.analysis import raw_cache
 from pixel_clusterizer.clusterizer import HitClusterizer
 
 logging.basicConfig(
@@ -14,7 +16,7 @@ loglevel = logging.INFO
 
 
 class Analysis():
-    def __init__(self, raw_data_file=None, cluster_hits=False):
+    def __init__(self, raw_data_file=None, cluster_hits=False, n_processes=1, split_records=False, compact=False):
 
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(loglevel)
@@ -23,6 +25,9 @@ class Analysis():
 
         self.raw_data_file = raw_data_file
         self.chunk_size = 10000000
+        self.n_processes = n_processes  # Processes for raw data interpretation, None: one per CPU core
+        self.split_records = split_records  # One table per record type, see analysis_utils.split_records
+        self.compact = compact  # Compact Hits table, see analysis_utils.COMPACT_HITS_DTYPE
         self.cluster_hits = cluster_hits
         if self.cluster_hits:
             self._setup_clusterizer()
@@ -207,10 +212,9 @@ class Analysis():
         if self.cluster_hits:
             hit_dtype.append(('tot', 'u1'))
             hit_dtype.append(('event_number', '<i8'))
+        with raw_cache.open_raw_data(self.raw_data_file) as (raw_data, meta_data):
+            n_words = raw_data.shape[0]
         with tb.open_file(self.raw_data_file) as in_file:
-            n_words = in_file.root.raw_data.shape[0]
-            meta_data = in_file.root.meta_data[:]
-
             if meta_data.shape[0] == 0:
                 self.logger.warning('Data is empty. Skip analysis!')
                 return
@@ -218,7 +222,9 @@ class Analysis():
             self.n_params = np.amax(meta_data["scan_param_id"])
 
             with tb.open_file(self.analyzed_data_file, "w") as out_file:
-                hit_table = None
+                hit_writer = au.HitWriter(out_file, hit_dtype, split_records=self.split_records, compact=self.compact,
+                                          expectedrows=self.chunk_size,
+                                          filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
 
                 if self.cluster_hits:
                     cluster_table = out_file.create_table(
@@ -232,35 +238,16 @@ class Analysis():
                     hist_cs_tot = np.zeros(shape=(100, ), dtype=np.uint32)
                     hist_cs_shape = np.zeros(shape=(300, ), dtype=np.int32)
 
-                start = 0
-
                 data_interpreter = interpreter.RawDataInterpreter(chunk_size=self.chunk_size)
                 pbar = tqdm(total=n_words)
-                while start < n_words:
-                    tmp_end = min(n_words, start + self.chunk_size)
-                    raw_data = in_file.root.raw_data[start:tmp_end]
-                    hit_buffer = np.zeros(shape=self.chunk_size, dtype=hit_dtype)
-
-                    hit_dat = data_interpreter.interpret(raw_data, meta_data, hit_buffer)
-
+                for start, tmp_end, hit_dat in decoder.decode_h5_chunks(data_interpreter, self.raw_data_file,
+                                                                        hit_dtype, self.chunk_size,
+                                                                        n_processes=self.n_processes):
                     if self.cluster_hits:
                         hit_dat["tot"] = ((hit_dat["te"] - hit_dat["le"]) & 0x3F) + 1  # Add one to get also hits where LE = TE
                         hit_dat["event_number"] = hit_dat["timestamp"]
 
-                    if hit_table is None:
-                        hit_table = out_file.create_table(
-                            where=out_file.root,
-                            name="Hits",
-                            description=hit_dat.dtype,
-                            expectedrows=self.chunk_size,
-                            title='hit_data',
-                            filters=tb.Filters(
-                                complib='blosc',
-                                complevel=5,
-                                fletcher32=False))
-
-                    hit_table.append(hit_dat)
-                    hit_table.flush()
+                    hit_writer.append(hit_dat, meta_data)  # Also assigns the scan parameter ids
 
                     if self.cluster_hits:
                         _, cluster = self.clz.cluster_hits(hit_dat)
@@ -284,8 +271,8 @@ class Analysis():
                         hist_cs_shape += cs_shape.astype(np.uint32)
 
                     pbar.update(tmp_end - start)
-                    start = tmp_end
                 pbar.close()
+                au.write_counters(out_file, data_interpreter.get_counters())
                 # TODO: Copy all attributes properly to output_file, maybe own table
                 out_file.root.Hits.attrs.scan_id = in_file.root.meta_data.attrs.scan_id
                 self._create_additional_hit_data()
@@ -23,21 +23,356 @@ def line(x, m, b):
     return m * x + b
 
 
-@numba.njit
+@numba.njit(cache=True)
+def assign_scan_param_id(hits, meta_data):
+    ''' Replace the raw data index stored in hits["scan_param_id"] by the scan parameter id of the meta data
+        readout (index_start <= raw data index < index_stop) containing it. Meta data can have gaps and does not need
+        to be sorted. Hits are in the order of their raw data index, so the readout of a hit is searched from the
+        readout of the previous hit on, by binary search for the first hit and hits out of order.
+
+        Hits that do not belong to any readout get scan_param_id -1 (all bits set for unsigned types).
+        Returns the number of these hits.
+    '''
+    index_start = meta_data['index_start']
+    index_stop = meta_data['index_stop']
+    scan_param_id = meta_data['scan_param_id']
+    if np.any(index_start[1:] < index_start[:-1]):
+        order = np.argsort(index_start, kind='mergesort')
+        index_start = index_start[order]
+        index_stop = index_stop[order]
+        scan_param_id = scan_param_id[order]
+
+    n_meta = index_start.shape[0]
+    n_unassigned = 0
+    meta_idx = -1  # Last readout with index_start <= raw data index, -1 if there is none
+    for i in range(hits.shape[0]):
+        raw_index = np.int64(hits[i]['scan_param_id'])  # Signed, comparing signed and uint64 is done as float
+        if i == 0 or (meta_idx >= 0 and raw_index < np.int64(index_start[meta_idx])):
+            meta_idx = np.searchsorted(index_start, raw_index, side='right') - 1
+        else:
+            while meta_idx + 1 < n_meta and np.int64(index_start[meta_idx + 1]) <= raw_index:
+                meta_idx += 1
+        if meta_idx >= 0 and raw_index < np.int64(index_stop[meta_idx]):
+            hits[i]['scan_param_id'] = scan_param_id[meta_idx]
+        else:
+            hits[i]['scan_param_id'] = -1
+            n_unassigned += 1
+    return n_unassigned
+
+
+@numba.njit(cache=True)
 def correlate_scan_ids(hits, meta_data):
-    meta_i = 0
-
-    for idx, param_id in enumerate(hits["scan_param_id"]):
-        while meta_i < len(meta_data):
-            if param_id >= meta_data[meta_i]['index_start'] and param_id < meta_data[meta_i]['index_stop']:
-                hits[idx]['scan_param_id'] = meta_data[meta_i]['scan_param_id']
-                break
-            elif param_id >= meta_data[meta_i]['index_stop']:
-                meta_i += 1
+    assign_scan_param_id(hits, meta_data)
+    return hits
+
+
+# Raw data word counters of the interpreter kernels: counters[COUNT_WORDS, word class] counts all data words,
+# counters[COUNT_ERRORS, word class] the words dropped by the interpreter, e.g. a TJ data1 word without data0 or
+# a word with unknown header. The word class is the header byte (upper 8 bit) of the word, apart from TJ data
+# (0x00, 0x10, 0x20, 0x30 for data0 - data3) and TLU words (0x80), see WORD_CLASS_LUT.
+COUNT_WORDS = 0
+COUNT_ERRORS = 1
+N_WORD_CLASSES = 0x81
+
+
+def _get_word_class_lut():
+    lut = np.arange(256, dtype=np.uint8)
+    lut[:0x40] &= 0xF0
+    lut[0x80:] = 0x80
+    return lut
+
+
+WORD_CLASS_LUT = _get_word_class_lut()
+
+
+def get_word_class_name(word_class):
+    if word_class < 0x40:
+        return 'tj_data%d' % (word_class >> 4)
+    if word_class == 0x80:
+        return 'tlu'
+    return '%s%d' % ({0x4: 'ext_ts', 0x5: 'inj_ts', 0x6: 'hitor_ts', 0x7: 'tlu_ts'}[word_class >> 4], word_class & 0xF)
+
+
+def create_counters():
+    return np.zeros((2, N_WORD_CLASSES), dtype=np.uint64)
+
+
+def write_counters(out_file, counters, name='RawDataCounters'):
+    ''' Write the word counters of the interpreter (see create_counters) as table, one row per word class that
+        occurred. An existing table is replaced.
+    '''
+    word_classes = np.flatnonzero(counters.sum(axis=0) > 0)
+    table = np.zeros(len(word_classes), dtype=[('word_class', 'S12'), ('header', 'u1'), ('words', '<u8'),
+                                                ('errors', '<u8')])
+    table['word_class'] = [get_word_class_name(word_class) for word_class in word_classes]
+    table['header'] = word_classes
+    table['words'] = counters[COUNT_WORDS, word_classes]
+    table['errors'] = counters[COUNT_ERRORS, word_classes]
+    if name in out_file.root:
+        out_file.remove_node(out_file.root, name)
+    out_file.create_table(out_file.root, name=name, obj=table, title='Raw data words and errors by word class')
+
+
+# Record types of the interpreted data. In the mixed Hits table they are marked by the col value of the record:
+# pixel hits have col < 0xE0, errors 0xE0 - 0xEF, TLU words 0xFF, HitOr timestamps 0xFD and
+# timestamps 0xFB (TLU), 0xFC (injection / TLU) and 0xFE (external).
+# Errors of TJ data words are marked by row 0xE1 instead, col is the number of the TJ data word (0 - 2).
+RECORD_TABLES = ('Hits', 'TLU', 'HitOr', 'Timestamps', 'Errors')
+_RECORD_TYPE = np.full(256, RECORD_TABLES.index('Errors'), dtype=np.uint8)
+_RECORD_TYPE[:0xE0] = RECORD_TABLES.index('Hits')
+_RECORD_TYPE[0xFF] = RECORD_TABLES.index('TLU')
+_RECORD_TYPE[0xFD] = RECORD_TABLES.index('HitOr')
+_RECORD_TYPE[[0xFB, 0xFC, 0xFE]] = RECORD_TABLES.index('Timestamps')
+
+
+def get_record_dtypes(hit_dtype):
+    ''' Data types of the record type tables for hits of the mixed hit_dtype. Every record has the raw data index
+        raw_index, sorting all records by it gives the order of the mixed Hits table.
+    '''
+    hit_dtype = np.dtype(hit_dtype)
+    timestamp = hit_dtype['timestamp'].str
+    scan_param_id = hit_dtype['scan_param_id'].str
+    return {'Hits': np.dtype([('raw_index', '<i8'), ('col', 'u1'), ('row', hit_dtype['row'].str), ('le', 'u1'),
+                              ('te', 'u1'), ('cnt', 'u1'), ('timestamp', timestamp),
+                              ('scan_param_id', scan_param_id)]),
+            'TLU': np.dtype([('raw_index', '<i8'), ('trigger_number', '<u2'), ('timestamp', timestamp),
+                             ('scan_param_id', scan_param_id)]),
+            'HitOr': np.dtype([('raw_index', '<i8'), ('edge', 'u1'), ('cnt', '<u4'), ('timestamp', timestamp),
+                               ('scan_param_id', scan_param_id)]),
+            'Timestamps': np.dtype([('raw_index', '<i8'), ('source', 'u1'), ('cnt', '<u4'), ('timestamp', timestamp),
+                                    ('scan_param_id', scan_param_id)]),
+            'Errors': np.dtype([('raw_index', '<i8'), ('code', 'u1'), ('row', 'u1'), ('flag', 'u1'), ('word', '<u4'),
+                                ('scan_param_id', scan_param_id)])}
+
+
+# Fields of the record type tables taken from a field of the mixed hits
+_RECORD_FIELDS = {'Hits': {},
+                  'TLU': {'trigger_number': 'cnt'},
+                  'HitOr': {'edge': 'row'},
+                  'Timestamps': {'source': 'col'},
+                  'Errors': {'code': 'col', 'flag': 'le', 'word': 'cnt'}}
+
+
+def split_records(hits, raw_index):
+    ''' Split mixed hits into one array per record type (see RECORD_TABLES and get_record_dtypes).
+        raw_index is the raw data index of every hit, i.e. hits["scan_param_id"] before the scan parameter ids are
+        assigned. The interval of external timestamps (stored in row, le and te of the mixed hits) is not kept, it
+        is the difference of consecutive timestamps.
+    '''
+    record_type = _RECORD_TYPE[hits['col']]
+    record_type[(hits['row'] == 0xE1) & (hits['col'] < 3)] = RECORD_TABLES.index('Errors')
+    dtypes = get_record_dtypes(hits.dtype)
+    records = {}
+    for index, name in enumerate(RECORD_TABLES):
+        dtype = dtypes[name]
+        sel = np.flatnonzero(record_type == index)
+        records[name] = np.empty(len(sel), dtype=dtype)
+        records[name]['raw_index'] = raw_index[sel]
+        for field in dtype.names[1:]:
+            records[name][field] = hits[_RECORD_FIELDS[name].get(field, field)][sel]
+    return records
+
+
+# Compact layout of the Hits table of record type split files (HitWriter(compact=True)): u1 row, u2 scan parameter
+# id, raw_index and timestamp as difference to the previous hit. The differences restart from the values in the
+# HitsBase table at each of its rows: for every appended chunk and where a difference does not fit.
+# scan_param_id 0xFFFF marks hits without scan parameter id (-1, see assign_scan_param_id).
+COMPACT_HITS_DTYPE = np.dtype([('raw_index', '<u4'), ('col', 'u1'), ('row', 'u1'), ('le', 'u1'), ('te', 'u1'),
+                               ('cnt', 'u1'), ('timestamp', '<i4'), ('scan_param_id', '<u2')])
+HITS_BASE_DTYPE = np.dtype([('row', '<i8'), ('raw_index', '<i8'), ('timestamp', '<i8')])
+
+
+def compact_hits(hits, first_row=0):
+    ''' Convert the records of a Hits table (see get_record_dtypes) to the compact layout. first_row is the row
+        of the first hit in the table. Returns the compact hits and their HitsBase rows. Raises ValueError for
+        rows or scan parameter ids that do not fit.
+    '''
+    scan_param_id = hits['scan_param_id'].astype(np.int64)
+    if hits.dtype['scan_param_id'].kind == 'u':  # -1 has all bits set
+        scan_param_id[scan_param_id == np.iinfo(hits.dtype['scan_param_id']).max] = -1
+    if np.any(hits['row'] > 0xFF) or np.any(scan_param_id < -1) or np.any(scan_param_id >= 0xFFFF):
+        raise ValueError('Hits do not fit into the compact hit layout')
+    raw_index = hits['raw_index'].astype(np.int64)
+    timestamp = hits['timestamp'].astype(np.int64)
+    d_raw_index = np.zeros(len(hits), dtype=np.int64)
+    d_raw_index[1:] = np.diff(raw_index)
+    d_timestamp = np.zeros(len(hits), dtype=np.int64)
+    d_timestamp[1:] = np.diff(timestamp)  # Signed, timestamps of TJ hits are not sorted
+    new_base = (d_raw_index < 0) | (d_raw_index > 0xFFFFFFFF) | (d_timestamp < -2 ** 31) | (d_timestamp >= 2 ** 31)
+    new_base[:1] = True
+    d_raw_index[new_base] = 0
+    d_timestamp[new_base] = 0
+
+    compact = np.empty(len(hits), dtype=COMPACT_HITS_DTYPE)
+    compact['raw_index'] = d_raw_index
+    compact['timestamp'] = d_timestamp
+    for field in ('col', 'row', 'le', 'te', 'cnt'):
+        compact[field] = hits[field]
+    compact['scan_param_id'] = np.where(scan_param_id == -1, 0xFFFF, scan_param_id)
+    base_rows = np.flatnonzero(new_base)
+    bases = np.empty(len(base_rows), dtype=HITS_BASE_DTYPE)
+    bases['row'] = base_rows + first_row
+    bases['raw_index'] = raw_index[base_rows]
+    bases['timestamp'] = timestamp[base_rows]
+    return compact, bases
+
+
+def expand_hits(compact, bases, first_row=0):
+    ''' Convert compact hits back to absolute raw_index and timestamp. first_row is the row of the first hit in the
+        table, it has to be a row of the HitsBase rows bases. Hits without scan parameter id get scan_param_id -1.
+    '''
+    rows = np.arange(first_row, first_row + len(compact), dtype=np.int64)
+    base = np.searchsorted(bases['row'], rows, side='right') - 1
+    if len(compact) and (base[0] < 0 or bases['row'][base[0]] != first_row):
+        raise ValueError('Hits row %d is not a HitsBase row' % first_row)
+    hits = np.empty(len(compact), dtype=[(name, np.int64 if name in ('raw_index', 'timestamp', 'scan_param_id') else
+                                          COMPACT_HITS_DTYPE[name]) for name in COMPACT_HITS_DTYPE.names])
+    for field in ('col', 'row', 'le', 'te', 'cnt', 'scan_param_id'):
+        hits[field] = compact[field]
+    hits['scan_param_id'][compact['scan_param_id'] == 0xFFFF] = -1
+    base_index = bases['row'][base] - first_row
+    for field in ('raw_index', 'timestamp'):
+        cumsum = np.cumsum(compact[field].astype(np.int64))  # The difference at a base row is 0
+        hits[field] = bases[field][base] + cumsum - cumsum[base_index]
     return hits
 
 
-@numba.njit(locals={'cluster_shape': numba.int64})
+# Packed hit encoding: one 64 bit word per pixel hit, bits 0-6 col, 7-14 row, 15-20 le, 21-26 te, 27 noise flag
+# (cnt), 28-63 timestamp relative to a base timestamp (36 bit, 107 s at 640 MHz)
+PACKED_TIMESTAMP_BITS = 36
+
+
+def pack_hits(hits, timestamp_base=0):
+    ''' Encode pixel hits (fields col, row, le, te, cnt, timestamp) as packed 64 bit words. Raises ValueError for
+        hits that do not fit, e.g. other record types or timestamps outside of the range after timestamp_base.
+    '''
+    timestamp = hits['timestamp'].astype(np.int64) - timestamp_base
+    if (np.any(hits['col'] >= 0x80) or np.any(hits['row'] >= 0x100) or np.any(hits['le'] >= 0x40) or
+            np.any(hits['te'] >= 0x40) or np.any(hits['cnt'] > 1) or np.any(timestamp < 0) or
+            np.any(timestamp >= 2 ** PACKED_TIMESTAMP_BITS)):
+        raise ValueError('Hits do not fit into the packed hit encoding')
+    packed = hits['col'].astype(np.uint64)
+    packed |= hits['row'].astype(np.uint64) << np.uint64(7)
+    packed |= hits['le'].astype(np.uint64) << np.uint64(15)
+    packed |= hits['te'].astype(np.uint64) << np.uint64(21)
+    packed |= hits['cnt'].astype(np.uint64) << np.uint64(27)
+    packed |= timestamp.astype(np.uint64) << np.uint64(28)
+    return packed
+
+
+def unpack_hits(packed, timestamp_base=0, hit_dtype=None):
+    ''' Decode packed 64 bit words (see pack_hits) to hits of hit_dtype (default: fields of pack_hits)
+    '''
+    if hit_dtype is None:
+        hit_dtype = [('col', 'u1'), ('row', 'u1'), ('le', 'u1'), ('te', 'u1'), ('cnt', 'u1'), ('timestamp', '<i8')]
+    packed = np.asarray(packed, dtype=np.uint64)
+    hits = np.zeros(len(packed), dtype=hit_dtype)
+    hits['col'] = packed & np.uint64(0x7F)
+    hits['row'] = (packed >> np.uint64(7)) & np.uint64(0xFF)
+    hits['le'] = (packed >> np.uint64(15)) & np.uint64(0x3F)
+    hits['te'] = (packed >> np.uint64(21)) & np.uint64(0x3F)
+    hits['cnt'] = (packed >> np.uint64(27)) & np.uint64(0x1)
+    hits['timestamp'] = (packed >> np.uint64(28)).astype(np.int64) + timestamp_base
+    return hits
+
+
+class HitWriter(object):
+    ''' Append interpreted hits to out_file. By default all hits go into one mixed Hits table, with
+        split_records=True every record type is written to its own table (see split_records), with compact=True
+        the Hits table of pixel hits in the compact layout (see COMPACT_HITS_DTYPE).
+        Tables which already exist in out_file are appended to.
+    '''
+
+    def __init__(self, out_file, hit_dtype, split_records=False, title='hit_data', filters=None, expectedrows=10000,
+                 compact=False, chunkshape=None):
+        if compact and not split_records:
+            raise ValueError('The compact Hits table needs split_records=True')
+        self.split_records = split_records
+        self.compact = compact
+        if split_records:
+            dtypes = get_record_dtypes(hit_dtype)
+            if compact:
+                dtypes['Hits'] = COMPACT_HITS_DTYPE
+                dtypes['HitsBase'] = HITS_BASE_DTYPE
+        else:
+            dtypes = {'Hits': np.dtype(hit_dtype)}
+        self.tables = {}
+        for name in RECORD_TABLES + ('HitsBase', ):
+            if name in out_file.root:
+                self.tables[name] = out_file.get_node(out_file.root, name)
+            elif name in dtypes:
+                self.tables[name] = out_file.create_table(out_file.root, name=name, description=dtypes[name],
+                                                          title=title if name == 'Hits' else name,
+                                                          expectedrows=expectedrows, filters=filters,
+                                                          chunkshape=chunkshape)
+
+    def append(self, hits, meta_data):
+        ''' Assign the scan parameter ids to hits (in place) and append them. Returns the number of hits without
+            scan parameter id.
+        '''
+        if self.split_records:
+            raw_index = hits['scan_param_id'].astype(np.int64)
+        n_unassigned = assign_scan_param_id(hits, meta_data)
+        if self.split_records:
+            for name, records in split_records(hits, raw_index).items():
+                if self.compact and name == 'Hits':
+                    records, bases = compact_hits(records, self.tables['Hits'].nrows)
+                    self.tables['HitsBase'].append(bases)
+                self.tables[name].append(records)
+        else:
+            self.tables['Hits'].append(hits)
+        for table in self.tables.values():
+            table.flush()
+        return n_unassigned
+
+
+def _select_fields(records, fields):
+    if fields is None:
+        return records
+    selected = np.empty(len(records), dtype=[(field, records.dtype[field]) for field in fields])
+    for field in fields:
+        selected[field] = records[field]
+    return selected
+
+
+def read_records(in_file, fields, chunk_size=10000000):
+    ''' Read records from an interpreted file. fields maps the record types to read (see RECORD_TABLES) to the
+        list of fields to read, None reads all fields. Returns the records by type.
+
+        Files with one mixed Hits table are split while reading (in one pass for all record types), raw_index is the
+        row in the Hits table then. Compact Hits tables are expanded (see expand_hits).
+    '''
+    hit_table = in_file.root.Hits
+    records = {}
+    if 'raw_index' in hit_table.colnames:  # Record type split file
+        for name, names in fields.items():
+            table = in_file.get_node(in_file.root, name)
+            if name == 'Hits' and 'HitsBase' in in_file.root:
+                records[name] = _select_fields(expand_hits(table[:], in_file.root.HitsBase[:]), names)
+            elif names is None:
+                records[name] = table[:]
+            else:
+                records[name] = np.empty(table.nrows, dtype=[(field, table.coldtypes[field]) for field in names])
+                for field in names:
+                    records[name][field] = table.col(field)
+        return records
+
+    chunks = dict((name, []) for name in fields)
+    for start in range(0, hit_table.nrows, chunk_size):
+        hits = hit_table[start:start + chunk_size]
+        for name, chunk in split_records(hits, np.arange(start, start + len(hits), dtype=np.int64)).items():
+            if name in fields:
+                chunks[name].append(_select_fields(chunk, fields[name]))
+    dtypes = get_record_dtypes(hit_table.dtype)
+    for name in fields:
+        if chunks[name]:
+            records[name] = np.concatenate(chunks[name])
+        else:
+            records[name] = _select_fields(np.empty(0, dtype=dtypes[name]), fields[name])
+    return records
+
+
+@numba.njit(cache=True, locals={'cluster_shape': numba.int64})
 def calc_cluster_shape(cluster_array):
     '''Boolean 8x8 array to number.
     '''
@@ -48,7 +383,7 @@ def calc_cluster_shape(cluster_array):
     return cluster_shape
 
 
-@numba.njit(numba.int64(numba.uint32, numba.uint32))
+@numba.njit(numba.int64(numba.uint32, numba.uint32), cache=True)
 def xy2d_morton(x, y):
     ''' Tuple to number.
 
@@ -70,7 +405,7 @@ def xy2d_morton(x, y):
     return x | (y << 1)
 
 
-@numba.njit
+@numba.njit(cache=True)
 def occ_hist2d(hits):
     hist_occ = np.zeros(shape=(112, 224), dtype=np.uint32)
 
@@ -83,7 +418,7 @@ def occ_hist2d(hits):
     return hist_occ
 
 
-@numba.njit
+@numba.njit(cache=True)
 def scurve_hist3d(hits, scan_param_range):
     hist_scurves = np.zeros(shape=(112, 224, len(scan_param_range)), dtype=np.uint16)
 
@@ -97,7 +432,7 @@ def scurve_hist3d(hits, scan_param_range):
     return hist_scurves
 
 
-@numba.njit
+@numba.njit(cache=True)
 def tot_ave3d(hits, scan_param_range):
     ave_tots = np.zeros(shape=(112, 224, len(scan_param_range)), dtype=np.uint16)
 
@@ -9,7 +9,7 @@ from tqdm import tqdm
 from tjmonopix.analysis import analysis_utils as au
 
 
-@njit
+@njit(cache=True)
 def tot_hist4d(hits, scan_param_range):
     """
     Returns a histogram of TOT values for every pixel and injection step
@@ -28,7 +28,7 @@ def tot_hist4d(hits, scan_param_range):
     return hist_tot
 
 
-@njit
+@njit(cache=True)
 def tot_hist2d(hits, scan_param_range):
     """
     Returns a histogram of TOT values for every injection step
@@ -0,0 +1,583 @@
+''' Decoding engine for the raw data words of TJ-MonoPix.
+
+    All interpreters (analysis.Analysis via interpreter.RawDataInterpreter, interpreter_idx, TJMonoPix and the online
+    monitor converter) use the Decoder of this module. A Decoder is configured by
+        tj_words: number of data words of a TJ hit (4 for the current firmware, 3 for older firmware)
+        formats: the word formats to decode, words of other formats are ignored
+        options: error handling and the records written
+    Every record (TJ hit, timestamp, TLU word, error) is written to a hit array with (at least) the fields col, row,
+    le, te, cnt, timestamp and scan_param_id, where scan_param_id is the raw data index of the last data word of the
+    record (see analysis_utils.assign_scan_param_id).
+
+    Records:
+        col < 0xE0: TJ hit (cnt: noise flag)
+        col 0xFD, row 0 / 1: HitOr leading / trailing edge timestamp (cnt: TDC value or sequence number)
+        col 0xFE: external timestamp, col 0xFC: injection timestamp, col 0xFB: TLU timestamp (cnt: sequence number)
+        col 0xFF: TLU word (cnt: trigger number, timestamp: 16 bit TLU timestamp, optionally extended)
+        error records: see ERROR_RECORDS
+'''
+
+import multiprocessing as mp
+from collections import deque
+
+import numpy as np
+import numba
+
+from tjmonopix.analysis import analysis_utils as au
+from tjmonopix.analysis import raw_cache
+
+# Word formats, see Decoder
+TJ_DATA = 0x01
+HITOR_TS = 0x02  # HitOr leading edge timestamp (0x61 - 0x63)
+HITOR_TE_TS = 0x04  # HitOr trailing edge timestamp (0x65 - 0x67)
+EXT_TS = 0x08  # External timestamp (0x41 - 0x43)
+INJ_TS = 0x10  # Injection timestamp (0x51 - 0x53)
+TLU_TS = 0x20  # TLU timestamp (0x71 - 0x73)
+TLU_WORD = 0x40  # TLU trigger word (bit 31 set)
+ALL_FORMATS = 0x7F
+
+# Options, see Decoder
+RESET_ON_ERROR = 0x01  # An error discards all partially decoded data, otherwise only the data of the same source
+UNKNOWN_IS_ERROR = 0x02  # Words with unknown header are errors, otherwise they are ignored
+ERROR_RECORDS = 0x04  # Write a record for every error: row 0xE1 and col 0 - 3 for TJ data words, col 0xE0 for
+#                       unknown words, col 0xED, 0xEE, 0xEC, 0xEB for HitOr, external, injection and TLU timestamp
+#                       words (row 3 - timestamp word ID, + 4 for HitOr trailing edge). le: state of the data source,
+#                       cnt: data word
+TIMESTAMP_RECORDS = 0x08  # Write timestamp records
+TLU_RECORDS = 0x10  # Write TLU word records
+EXTEND_TLU_TS = 0x20  # Extend the 16 bit timestamp of TLU words with the last external timestamp
+IDX_RECORDS = 0x40  # Record layout of interpreter_idx: cnt of timestamp records is the sequence number of the
+#                     timestamp, row, le, te of external timestamps the lowest 24 bit of the time since the last one,
+#                     row, le, te of TLU words 0xFF
+RESYNC_TJ_DATA = 0x80  # A TJ data word 0 within an incomplete TJ hit starts a new hit instead of being an error only.
+#                        The TJ data words which are discarded are counted (Decoder.get_discarded_count)
+
+# Default record dtype
+RECORD_DTYPE = [('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<i8'),
+                ('scan_param_id', '<u4')]
+RECORD_FIELDS = ('col', 'row', 'le', 'te', 'cnt', 'timestamp', 'scan_param_id')
+
+# Word kinds, looked up from the header byte (upper 8 bit) of a data word with _WORD_KIND
+_IGNORED = 0  # timestamp ID 0 words
+_UNKNOWN = 1
+_TJ = 2
+_TS = 3
+_TLU = 4
+
+# Timestamp sources, looked up from the header byte with _WORD_SOURCE
+_HITOR = 0
+_HITOR_TE = 1
+_EXT = 2
+_INJ = 3
+_TLU_TS = 4
+_N_TS = 5
+_TS_HEADER = np.array([0x60, 0x64, 0x40, 0x50, 0x70])  # Header byte of ID 0
+_TS_FORMAT = np.array([HITOR_TS, HITOR_TE_TS, EXT_TS, INJ_TS, TLU_TS])
+_TS_ID3_MASK = np.array([0xFF, 0xFF, 0xFFFF, 0xFFFF, 0xFFFF])  # Timestamp bits in ID 3 words (HitOr: TDC above)
+_TS_RECORD_COL = np.array([0xFD, 0xFD, 0xFE, 0xFC, 0xFB])
+_TS_RECORD_ROW = np.array([0, 1, 0, 0, 0])
+_TS_ERROR_COL = np.array([0xED, 0xED, 0xEE, 0xEC, 0xEB])
+_TS_ERROR_ROW = np.array([0, 4, 0, 0, 0])
+
+
+def _get_word_luts():
+    """ Word kind and TJ data word number / timestamp source for every possible header byte of a data word
+    """
+    kind = np.full(256, _UNKNOWN, dtype=np.uint8)
+    source = np.zeros(256, dtype=np.uint8)
+    for header in range(256):
+        if header < 0x40:
+            kind[header] = _TJ
+            source[header] = header >> 4
+        elif header >= 0x80:
+            kind[header] = _TLU
+    for ts_source, ts_header in enumerate(_TS_HEADER):
+        kind[ts_header] = _IGNORED
+        if ts_source == _HITOR_TE:
+            kind[ts_header] = _UNKNOWN
+        for ts_id in (1, 2, 3):
+            kind[ts_header + ts_id] = _TS
+            source[ts_header + ts_id] = ts_source
+    return kind, source
+
+
+_WORD_KIND, _WORD_SOURCE = _get_word_luts()
+
+# Positions in the decoder state array
+_TJ_FLAG = 0  # Number of TJ data words of the current hit decoded
+_COL = 1
+_ROW = 2
+_LE = 3
+_TE = 4
+_NOISE = 5
+_TJ_TIMESTAMP = 6
+_HITOR_CHARGE = 7
+_EXT_TS_PRE = 8  # External timestamp before the last one
+_ERRORS = 9
+_TS_FLAG = 10  # _N_TS timestamp flags (number of timestamp words of the current timestamp decoded)
+_TS_VALUE = _TS_FLAG + _N_TS  # _N_TS timestamps
+_TS_CNT = _TS_VALUE + _N_TS  # _N_TS timestamp sequence numbers
+_DISCARDED = _TS_CNT + _N_TS  # Discarded TJ data words, with RESYNC_TJ_DATA
+_STATE_SIZE = _DISCARDED + 1
+
+
+@numba.njit(cache=True)
+def _write_record(hit_data, hit_index, col, row, le, te, cnt, timestamp, raw_index):
+    hit_data[hit_index]["col"] = col
+    hit_data[hit_index]["row"] = row
+    hit_data[hit_index]["le"] = le
+    hit_data[hit_index]["te"] = te
+    hit_data[hit_index]["cnt"] = cnt
+    hit_data[hit_index]["timestamp"] = timestamp
+    hit_data[hit_index]["scan_param_id"] = raw_index
+    return hit_index + 1
+
+
+@numba.njit(cache=True)
+def _write_ts_record(hit_data, hit_index, source, timestamp, ts_cnt, ext_ts_pre, hitor_charge, options, raw_index):
+    row = _TS_RECORD_ROW[source]
+    le = 0
+    te = 0
+    if options & IDX_RECORDS:
+        cnt = ts_cnt
+        if source == _EXT:
+            interval = (timestamp - ext_ts_pre) & 0xFFFFFFFF
+            row = interval & 0xFF
+            le = (interval >> 8) & 0xFF
+            te = (interval >> 16) & 0xFF
+    elif source == _HITOR:
+        cnt = hitor_charge - ((hitor_charge & 0x8000) << 1)  # TDC value is signed 16 bit
+    else:
+        cnt = 0
+    return _write_record(hit_data, hit_index, _TS_RECORD_COL[source], row, le, te, cnt, timestamp, raw_index)
+
+
+@numba.njit(cache=True)
+def _is_tj_block(raw_data, i, tj_words):
+    for k in range(tj_words):
+        if (np.int64(raw_data[i + k]) >> 28) & 0xF != k:
+            return False
+    return True
+
+
+@numba.njit(cache=True, nogil=True)
+def decode_raw_data(raw_data, start, hit_data, hit_index, state, counters, tj_words, formats, options):
+    """ Decoding loop of Decoder.decode. raw_data[0] has the raw data index start. The decoding state and the word
+    counters are updated in place. Returns the index after the last written record.
+
+    The words are decoded in a single pass. A separate, vectorised pass classifying all words by their headers
+    costs about as much as decoding clean TJ data, whose speed is bound by writing the records.
+    """
+    tj_flag = state[_TJ_FLAG]
+    col = state[_COL]
+    row = state[_ROW]
+    le = state[_LE]
+    te = state[_TE]
+    noise = state[_NOISE]
+    tj_timestamp = state[_TJ_TIMESTAMP]
+    hitor_charge = state[_HITOR_CHARGE]
+    ext_ts_pre = state[_EXT_TS_PRE]
+    errors = state[_ERRORS]
+    discarded = state[_DISCARDED]
+    ts_flag = state[_TS_FLAG:_TS_FLAG + _N_TS]  # Views, updated in place
+    ts_value = state[_TS_VALUE:_TS_VALUE + _N_TS]
+    ts_cnt = state[_TS_CNT:_TS_CNT + _N_TS]
+    tj_last = tj_words - 1
+
+    n_words = raw_data.shape[0]
+    tj_block_words = 0  # Data words of the fast paths, counted once at the end
+    ts_blocks = np.zeros(_N_TS, dtype=np.int64)  # Complete timestamps of the fast path by source
+    tlu_words = 0
+    i = 0
+    while i < n_words:
+        # Fast path: runs of complete TJ data blocks, a block is validated at once by the headers of its data words.
+        # Only tried at a TJ data word 0, the attempt costs as much as decoding a word of the other formats.
+        if tj_flag == 0 and raw_data[i] < 0x10000000 and formats & TJ_DATA:
+            first_word = i
+            while i + tj_last < n_words and _is_tj_block(raw_data, i, tj_words):
+                word = np.int64(raw_data[i])
+                hit_index = _write_record(hit_data, hit_index, 2 * (word & 0x3F) + (((word & 0x7FC0) >> 6) // 256),
+                                          ((word & 0x7FC0) >> 6) % 256, (word & 0x7E00000) >> 21,
+                                          (word & 0x1F8000) >> 15, (word & 0x8000000) >> 27,
+                                          ((np.int64(raw_data[i + 1]) << 4) & 0xFFFFFFF0) |
+                                          ((np.int64(raw_data[i + 2]) << 32) & 0x00FFFFFF00000000),
+                                          start + i + tj_last)
+                i += tj_words
+            tj_block_words += i - first_word
+            if i >= n_words:
+                break
+
+        word = np.int64(raw_data[i])
+        header = (word >> 24) & 0xFF
+        kind = _WORD_KIND[header]
+        if kind == _TLU:  # TLU words have no sequence, they are never an error
+            if formats & TLU_WORD and options & TLU_RECORDS:
+                tlu_timestamp = (word >> 12) & 0x7FFF0  # TLU word contains a 16 bit timestamp
+                if options & EXTEND_TLU_TS:
+                    low_bits = tlu_timestamp
+                    tlu_timestamp = (ext_ts_pre & ~0x7FFFF) | low_bits
+                    if low_bits < (ext_ts_pre & 0x7FFF0):
+                        tlu_timestamp += 0x80000
+                fill = 0xFF if options & IDX_RECORDS else 0
+                hit_index = _write_record(hit_data, hit_index, 0xFF, fill, fill, fill, word & 0xFFFF, tlu_timestamp,
+                                          start + i)
+            tlu_words += 1
+            i += 1
+            continue
+
+        # Fast path: complete timestamps, the ID 3, 2 and 1 words of a source are validated at once by their headers
+        # if no timestamp of the source is partially decoded
+        if kind == _TS and (header & 0x3) == 3 and i + 2 < n_words and (raw_data[i + 1] >> 24) == header - 1 and \
+                (raw_data[i + 2] >> 24) == header - 2:
+            source = _WORD_SOURCE[header]
+            if formats & _TS_FORMAT[source] and ts_flag[source] == 0:
+                if source == _EXT:
+                    ext_ts_pre = ts_value[source]
+                if source == _HITOR:
+                    hitor_charge = (word & 0xFFFF00) >> 8
+                ts_value[source] = ((word & _TS_ID3_MASK[source]) << 48) | \
+                    ((np.int64(raw_data[i + 1]) & 0xFFFFFF) << 24) | (np.int64(raw_data[i + 2]) & 0xFFFFFF)
+                ts_cnt[source] += 1
+                if options & TIMESTAMP_RECORDS:
+                    hit_index = _write_ts_record(hit_data, hit_index, source, ts_value[source], ts_cnt[source],
+                                                 ext_ts_pre, hitor_charge, options, start + i + 2)
+                ts_blocks[source] += 1
+                i += 3
+                continue
+
+        word_class = au.WORD_CLASS_LUT[header]
+        counters[au.COUNT_WORDS, word_class] += 1
+        error = False
+        restart = False
+
+        if kind == _TJ:
+            number = _WORD_SOURCE[header]
+            if formats & TJ_DATA and number < tj_words:  # data word 3 is ignored in the 3 word format
+                if tj_flag != number:
+                    error = True
+                    if options & ERROR_RECORDS:
+                        hit_index = _write_record(hit_data, hit_index, number, 0xE1, tj_flag, 0, word, 0, start + i)
+                    if options & RESYNC_TJ_DATA:
+                        restart = number == 0  # The incomplete hit is discarded, the word starts the next hit
+                        discarded += tj_flag if restart else tj_flag + 1
+                    tj_flag = 0
+                if not error or restart:
+                    if number == 0:
+                        col = 2 * (word & 0x3F) + (((word & 0x7FC0) >> 6) // 256)
+                        row = ((word & 0x7FC0) >> 6) % 256
+                        te = (word & 0x1F8000) >> 15
+                        le = (word & 0x7E00000) >> 21
+                        noise = (word & 0x8000000) >> 27
+                    elif number == 1:  # Timestamp (recorded with 40MHz) is converted to 640 MHz domain
+                        tj_timestamp = (word << 4) & 0xFFFFFFF0
+                    elif number == 2:
+                        tj_timestamp = tj_timestamp | ((word << 32) & 0x00FFFFFF00000000)
+                    if number == tj_last:  # Data words are complete, write TJ hit
+                        hit_index = _write_record(hit_data, hit_index, col, row, le, te, noise, tj_timestamp,
+                                                  start + i)
+                        tj_flag = 0
+                    else:
+                        tj_flag = number + 1
+
+        elif kind == _TS:  # ID 3 comes first in data, the timestamp is complete with ID 1
+            source = _WORD_SOURCE[header]
+            if formats & _TS_FORMAT[source]:
+                ts_id = header & 0x3
+                data = word & 0xFFFFFF
+                if ts_id == 3:
+                    if source == _EXT:
+                        ext_ts_pre = ts_value[source]
+                    if source == _HITOR:
+                        hitor_charge = (word & 0xFFFF00) >> 8
+                    ts_value[source] = (ts_value[source] & 0x0000FFFFFFFFFFFF) | ((data & _TS_ID3_MASK[source]) << 48)
+                elif ts_id == 2:
+                    ts_value[source] = (ts_value[source] & ~0x0000FFFFFF000000) | (data << 24)
+                else:
+                    ts_value[source] = (ts_value[source] & ~0xFFFFFF) | data
+                    ts_cnt[source] += 1
+
+                if ts_flag[source] != 3 - ts_id:
+                    error = True
+                    if options & ERROR_RECORDS:
+                        hit_index = _write_record(hit_data, hit_index, _TS_ERROR_COL[source],
+                                                  _TS_ERROR_ROW[source] + 3 - ts_id, ts_flag[source], 0, word, 0,
+                                                  start + i)
+                    ts_flag[source] = 0
+                elif ts_id != 1:
+                    ts_flag[source] += 1
+                else:
+                    ts_flag[source] = 0
+                    if options & TIMESTAMP_RECORDS:
+                        hit_index = _write_ts_record(hit_data, hit_index, source, ts_value[source], ts_cnt[source],
+                                                     ext_ts_pre, hitor_charge, options, start + i)
+
+        elif kind == _UNKNOWN:
+            if options & UNKNOWN_IS_ERROR:
+                error = True
+                if options & ERROR_RECORDS:
+                    hit_index = _write_record(hit_data, hit_index, 0xE0, 0, 0, 0, word, 0, start + i)
+
+        if error:
+            errors += 1
+            counters[au.COUNT_ERRORS, word_class] += 1
+            if options & RESET_ON_ERROR:  # Discard all partially decoded data
+                if not restart:
+                    if options & RESYNC_TJ_DATA:
+                        discarded += tj_flag
+                    tj_flag = 0
+                ts_flag[:] = 0
+        i += 1
+
+    for k in range(tj_words):
+        counters[au.COUNT_WORDS, k << 4] += tj_block_words // tj_words
+    for source in range(_N_TS):
+        for ts_id in (1, 2, 3):
+            counters[au.COUNT_WORDS, _TS_HEADER[source] + ts_id] += ts_blocks[source]
+    counters[au.COUNT_WORDS, 0x80] += tlu_words
+    state[_TJ_FLAG] = tj_flag
+    state[_COL] = col
+    state[_ROW] = row
+    state[_LE] = le
+    state[_TE] = te
+    state[_NOISE] = noise
+    state[_TJ_TIMESTAMP] = tj_timestamp
+    state[_HITOR_CHARGE] = hitor_charge
+    state[_EXT_TS_PRE] = ext_ts_pre
+    state[_ERRORS] = errors
+    state[_DISCARDED] = discarded
+    return hit_index
+
+
+def _is_idle(state):
+    return state[_TJ_FLAG] == 0 and not np.any(state[_TS_FLAG:_TS_FLAG + _N_TS])
+
+
+class Decoder(object):
+    ''' Decodes raw data chunk by chunk, the decoding state (partially decoded data, error count, word counters and
+        raw data index) is carried across chunks.
+
+        Parameters:
+        -----------
+        tj_words : int
+            Number of data words of a TJ hit, 4 (current firmware) or 3 (older firmware)
+        formats : int
+            Word formats to decode (TJ_DATA, HITOR_TS, ...), words of other formats are ignored
+        options : int
+            Error handling and records to write (RESET_ON_ERROR, ERROR_RECORDS, ...)
+    '''
+
+    def __init__(self, tj_words=4, formats=ALL_FORMATS, options=TIMESTAMP_RECORDS | TLU_RECORDS):
+        self.tj_words = tj_words
+        self.formats = formats
+        self.options = options
+        self.state = np.zeros(_STATE_SIZE, dtype=np.int64)
+        self.counters = au.create_counters()  # Data words and errors by word class
+        self.raw_index = 0  # Raw data index of the next data word
+
+    def get_config(self):
+        return {'tj_words': self.tj_words, 'formats': self.formats, 'options': self.options}
+
+    def reset(self):
+        """ Discard all partially decoded data
+        """
+        self.state[_TJ_FLAG] = 0
+        self.state[_TS_FLAG:_TS_FLAG + _N_TS] = 0
+
+    def is_idle(self):
+        """ True if no data is partially decoded
+        """
+        return _is_idle(self.state)
+
+    def get_error_count(self):
+        return int(self.state[_ERRORS])
+
+    def get_discarded_count(self):
+        """ Number of TJ data words discarded as part of broken hits, counted with option RESYNC_TJ_DATA
+        """
+        return int(self.state[_DISCARDED])
+
+    def get_counters(self):
+        return self.counters
+
+    def get_state(self):
+        """ Decoding state as dict (e.g. to be sent to another process or stored in a file)
+        """
+        return {'state': self.state.copy(), 'counters': self.counters.copy(), 'raw_index': self.raw_index}
+
+    def set_state(self, state):
+        self.state = np.zeros(_STATE_SIZE, dtype=np.int64)
+        self.state[:len(state['state'])] = state['state']  # States stored before _DISCARDED was added are shorter
+        self.counters = np.array(state['counters'], dtype=np.uint64)
+        self.raw_index = int(state['raw_index'])
+
+    def decode(self, raw_data, hit_data, hit_index=0):
+        """ Decode the raw data words following the ones decoded before.
+
+        Runs of complete TJ data blocks and complete timestamps are validated by the headers of their data words and
+        decoded at once. All other words are classified by their header byte and processed one by one, using flags to
+        keep track of partially decoded data, e.g. of data that is interleaved with other data, split across chunks
+        or corrupted.
+
+        Records are written to hit_data starting at hit_index, every data word gives at most one record. Returns the
+        index after the last written record.
+        """
+        hit_index = decode_raw_data(raw_data, self.raw_index, hit_data, hit_index, self.state, self.counters,
+                                    self.tj_words, self.formats, self.options)
+        self.raw_index += raw_data.shape[0]
+        return hit_index
+
+    def decode_array(self, raw_data, hit_dtype=RECORD_DTYPE):
+        """ Decode the raw data words following the ones decoded before and return the records as new array with
+        dtype hit_dtype. Fields of hit_dtype which are not record fields are zero, record fields not in hit_dtype are
+        dropped.
+        """
+        hit_dtype = np.dtype(hit_dtype)
+        if all(name in hit_dtype.names for name in RECORD_FIELDS):
+            hit_data = np.zeros(raw_data.shape[0], dtype=hit_dtype)
+            return hit_data[:self.decode(raw_data, hit_data)]
+        records = np.zeros(raw_data.shape[0], dtype=RECORD_DTYPE)
+        records = records[:self.decode(raw_data, records)]
+        hit_data = np.zeros(records.shape[0], dtype=hit_dtype)
+        for name in hit_dtype.names:
+            if name in RECORD_FIELDS:
+                hit_data[name] = records[name]
+        return hit_data
+
+
+def _is_synchronised(options, true_state, reset_state):
+    """ True if the decoding from the actual and from the reset state give the same records from here on
+    """
+    if not _is_idle(true_state['state']) or not _is_idle(reset_state['state']):
+        return False
+    if options & (IDX_RECORDS | EXTEND_TLU_TS):  # Records depend on the previous external timestamp
+        for i in (_TS_VALUE + _EXT, _EXT_TS_PRE):
+            if true_state['state'][i] != reset_state['state'][i]:
+                return False
+    return True
+
+
+def find_resync_point(raw_data, tj_words=4):
+    """ Index of the first TJ data0 word directly following the last word of a TJ data block, -1 if there is none.
+    """
+    last_header = (tj_words - 1) << 28
+    sel = np.nonzero(((raw_data[1:] & 0xF0000000) == 0x00000000) & ((raw_data[:-1] & 0xF0000000) == last_header))[0]
+    return sel[0] + 1 if sel.shape[0] else -1
+
+
+def get_chunk_boundaries(raw_data, chunk_size, tj_words=4, search_size=100000):
+    """ Split raw_data (array or EArray) into chunks of about chunk_size words. Boundaries are moved to the next
+    resynchronisation point (see find_resync_point) within search_size words.
+    """
+    n_words = raw_data.shape[0]
+    boundaries = [0]
+    for start in range(chunk_size, n_words, chunk_size):
+        offset = find_resync_point(raw_data[start - 1:min(n_words, start + search_size)], tj_words)
+        boundary = start if offset < 0 else start - 1 + offset
+        if boundaries[-1] < boundary < n_words:
+            boundaries.append(boundary)
+    boundaries.append(n_words)
+    return boundaries
+
+
+def _decode_chunk(args):
+    """ Decode raw_data[start:stop] of a raw data file starting from reset state. Executed in worker processes.
+    """
+    config, raw_data_file, start, stop, hit_dtype = args
+    with raw_cache.open_raw_data(raw_data_file) as (raw_data, _):
+        raw_data = np.array(raw_data[start:stop])
+
+    chunk_decoder = Decoder(**config)
+    chunk_decoder.raw_index = start
+    hit_data = np.zeros(shape=stop - start, dtype=hit_dtype)  # every record needs at least one data word
+    hit_index = chunk_decoder.decode(raw_data, hit_data)
+    return hit_data[:hit_index], chunk_decoder.get_state()
+
+
+def _stitch_chunk(decoder, raw_data, start, stop, hit_data, end_state):
+    """ Correct records and end state of the chunk raw_data[start:stop], which was decoded starting from reset state,
+    for the actual state at the chunk start given by decoder. decoder is set to the state at the chunk end.
+
+    Both the actual and the reset state decoding are repeated on a growing prefix of the chunk until both have no
+    partially decoded data (and the same previous external timestamp, if records depend on it). From there on the
+    reset state result is valid, apart from an offset in the counters. Usually this is the case right away, since
+    chunk boundaries are placed at resynchronisation points.
+    """
+    start_state = decoder.get_state()
+    n_words = stop - start
+    n_prefix = 0
+    while True:
+        true_decoder = Decoder(**decoder.get_config())
+        true_decoder.set_state(start_state)
+        reset_decoder = Decoder(**decoder.get_config())
+        reset_decoder.raw_index = start
+        prefix = raw_data[start:start + n_prefix]
+        true_hits = np.zeros(shape=n_prefix, dtype=hit_data.dtype)
+        n_true_hits = true_decoder.decode(prefix, true_hits)
+        n_reset_hits = reset_decoder.decode(prefix, np.zeros_like(true_hits))
+        true_state = true_decoder.get_state()
+        reset_state = reset_decoder.get_state()
+        if _is_synchronised(decoder.options, true_state, reset_state):
+            break
+        if n_prefix == n_words:  # Did not resynchronise, use sequential result of whole chunk
+            decoder.set_state(true_state)
+            return true_hits[:n_true_hits]
+        n_prefix = min(n_words, max(1024, 2 * n_prefix))
+
+    hit_data = hit_data[n_reset_hits:]
+    end_state['counters'] += true_state['counters'] - reset_state['counters']
+    end_state['state'][_ERRORS] += true_state['state'][_ERRORS] - reset_state['state'][_ERRORS]
+    end_state['state'][_DISCARDED] += true_state['state'][_DISCARDED] - reset_state['state'][_DISCARDED]
+    for source in range(_N_TS):
+        offset = true_state['state'][_TS_CNT + source] - reset_state['state'][_TS_CNT + source]
+        end_state['state'][_TS_CNT + source] += offset
+        if decoder.options & IDX_RECORDS:  # Correct the sequence numbers in the records
+            sel = hit_data["col"] == _TS_RECORD_COL[source]
+            if source in (_HITOR, _HITOR_TE):
+                sel &= hit_data["row"] == _TS_RECORD_ROW[source]
+            hit_data["cnt"][sel] += np.uint32(offset & 0xFFFFFFFF)
+    decoder.set_state(end_state)
+    return np.concatenate((true_hits[:n_true_hits], hit_data))
+
+
+def decode_h5_chunks(decoder, raw_data_file, hit_dtype, chunk_size, n_processes=1):
+    """ Decode the raw data of a raw data file chunk by chunk.
+
+    With n_processes > 1 the chunks are decoded by a pool of processes (None: one per CPU core) and stitched together
+    in order, taking into account the decoding state at the chunk boundaries. The result is identical to sequential
+    decoding.
+
+    Yields start and stop raw data index of each chunk and its records, where scan_param_id is the raw data index
+    (see analysis_utils.assign_scan_param_id). decoder holds the state at the end of the yielded chunk.
+    raw_data_file can also be the .raw file of the analysis cache, see raw_cache.
+    """
+    with raw_cache.open_raw_data(raw_data_file) as (raw_data, _):
+        n_words = raw_data.shape[0]
+
+        if n_processes == 1:
+            start = 0
+            while start < n_words:
+                stop = min(n_words, start + chunk_size)
+                hit_buffer = np.zeros(shape=stop - start, dtype=hit_dtype)
+                hit_index = decoder.decode(raw_data[start:stop], hit_buffer)
+                yield start, stop, hit_buffer[:hit_index]
+                start = stop
+            return
+
+        boundaries = get_chunk_boundaries(raw_data, chunk_size, decoder.tj_words)
+        tasks = deque((decoder.get_config(), raw_data_file, start, stop, hit_dtype)
+                      for start, stop in zip(boundaries[:-1], boundaries[1:]))
+        pool = mp.Pool(n_processes)
+        max_pending = 2 * (n_processes or mp.cpu_count())  # Limit memory of decoded chunks waiting for stitching
+        pending = deque()
+        try:
+            while tasks or pending:
+                while tasks and len(pending) < max_pending:
+                    task = tasks.popleft()
+                    pending.append((task, pool.apply_async(_decode_chunk, (task, ))))
+                (_, _, start, stop, _), result = pending.popleft()
+                hit_data, end_state = result.get()
+                yield start, stop, _stitch_chunk(decoder, raw_data, start, stop, hit_data, end_state)
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
@@ -31,7 +31,7 @@ def check_tlu_sync(tlu_timestamp, tlu_ts_timestamp, tlu_offset):
         return False
 
 
-@numba.njit
+@numba.njit(cache=True)
 def align_tlu_timestamp(tlu_data, tlu_ts_data, output_buffer, tlu_offset):
     """ Attach high resolution timestamp to tlu word
 
@@ -65,7 +65,7 @@ def align_tlu_timestamp(tlu_data, tlu_ts_data, output_buffer, tlu_offset):
     return output_buffer[:out_i]
 
 
-@numba.njit
+@numba.njit(cache=True)
 def align_hit_data(tlu_data, hit_data, output_buffer, upper_lim=0x400, lower_lim=0x4000):
     """ Align hit data with TLU number by high resolution timestamp
 
@@ -114,7 +114,7 @@ def align_hit_data(tlu_data, hit_data, output_buffer, upper_lim=0x400, lower_lim
     return output_buffer[:out_i]
 
 
-@numba.njit
+@numba.njit(cache=True)
 def create_events(hits, output_buffer):
     """ Build events
     """
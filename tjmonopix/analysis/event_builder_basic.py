@@ -1,7 +1,7 @@
 import numpy as np
 from numba import njit 
 
-@njit
+@njit(cache=True)
 def _build_with_tlu(sync,tj,data_out,upper,lower,data_format):
     tj_i=0
     i=0
@@ -29,7 +29,7 @@ def _build_with_tlu(sync,tj,data_out,upper,lower,data_format):
             tj_i = tj_i+1
     return 0, i, sync_i, tj_i, data_out
 
-@njit
+@njit(cache=True)
 def _sync_tlu_timestamp(tlu,ts,data_out,offset):
     tlu_i=0
     ts_i=0
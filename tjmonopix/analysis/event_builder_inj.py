@@ -4,6 +4,8 @@ import numpy as np
 import tables
 import yaml
 
+from tjmonopix.analysis import raw_cache
+
 TS_TLU = 251
 TS_INJ = 252
 TS_MON = 253
@@ -108,7 +110,7 @@ buf_type = [  # ("event_number","<i8"),
 
 def build_inj_h5(fhit, fraw, fout, n=500000, debug=0x2):
     buf = np.empty(n, dtype=buf_type)
-    with tables.open_file(fraw) as f:
+    with tables.open_file(raw_cache.get_raw_data_file(fraw)) as f:  # Scan attributes are not in the analysis cache
         status = yaml.safe_load(f.root.meta_data.attrs.status)
         for i in range(0, len(f.root.kwargs), 2):
             if f.root.kwargs[i] == "injlist":
@@ -3,7 +3,9 @@ from numba import njit
 import tables
 import yaml
 
-@njit
+from tjmonopix.analysis import analysis_utils as au
+
+@njit(cache=True)
 def _build_with_tlu(sync,tj,data_out,upper,lower,data_format):
     tj_i=0
     i=0
@@ -33,7 +35,7 @@ def _build_with_tlu(sync,tj,data_out,upper,lower,data_format):
             tj_i = tj_i+1
     return 0, i, sync_i, tj_i, data_out
 
-@njit
+@njit(cache=True)
 def _sync_tlu_timestamp(tlu,ts,data_out,offset):
     tlu_i=0
     ts_i=0
@@ -69,7 +71,9 @@ def build_h5(fraw,fhit,fout,upper=0x80,lower=-0x100,data_format=0x2,n=1000000):
     else:
         data_out_type=[("column","u1"),("row","u2"), ("trigger_number","i2")]
     with tables.open_file(fhit) as f_i:
-        hits=f_i.root.Hits[:]
+        records=au.read_records(f_i,{"Hits":["timestamp","col","row","le","te","cnt"],
+                                     "TLU":["timestamp","trigger_number"],
+                                     "Timestamps":["timestamp","source"]})
 
     ## set parameters
     with tables.open_file(fraw) as f_i:
@@ -80,9 +84,11 @@ def build_h5(fraw,fhit,fout,upper=0x80,lower=-0x100,data_format=0x2,n=1000000):
     upper=np.uint64(np.abs(upper))
     lower=np.uint64(np.abs(lower))
     
-    tlu=hits[hits["col"]==255][["timestamp","cnt"]]
-    ts=hits[hits["col"]==252][["timestamp"]]
-    tj=hits[np.bitwise_and(hits["col"]<112, hits["cnt"]==0)][["timestamp","col","row"]]
+    tlu=records["TLU"]
+    tlu.dtype.names=("timestamp","cnt")
+    ts=records["Timestamps"][records["Timestamps"]["source"]==252][["timestamp"]]
+    tj=records["Hits"][np.bitwise_and(records["Hits"]["col"]<112, records["Hits"]["cnt"]==0)]
+    records=None
     print "# of data: tlu=%d ts=%d tj=%d"%(len(tlu),len(ts),len(tj))
     if len(tlu)==0 or len(ts)==0 or len(tj)==0:
        print "no data"
@@ -200,7 +206,9 @@ if  __name__ == "__main__":
     fhit=fraw[:-3]+"_hit.h5"
     
     with tables.open_file(fhit) as f_i:
-        hits=f_i.root.Hits[:]
+        records=au.read_records(f_i,{"Hits":["timestamp","col","row","le","te","cnt"],
+                                     "TLU":["timestamp","trigger_number"],
+                                     "Timestamps":["timestamp","source"]})
     with tables.open_file(fraw) as f_i:
         conf_s=f_i.root.meta_data.get_attr("status")    
     
@@ -7,10 +7,12 @@ import numpy as np
 import yaml
 from numba import njit
 
+from tjmonopix.analysis import analysis_utils as au
+
 COL=112
 ROW=224
 
-@njit
+@njit(cache=True)
 def _sync_tlu_timestamp(tlu,ts,data_out,higher_lim=470,lower_lim=500): ##477-495
     tlu_i=0
     ts_i=0
@@ -27,7 +29,7 @@ def _sync_tlu_timestamp(tlu,ts,data_out,higher_lim=470,lower_lim=500): ##477-495
             #print "next ts"
         else:
             data_out[i]["event_number"]=i
-            data_out[i]["trigger_number"]=np.uint32(tlu[tlu_i]["cnt"]) 
+            data_out[i]["trigger_number"]=np.uint32(tlu[tlu_i]["trigger_number"]) 
             data_out[i]["tlu_timestamp"]=tlu[tlu_i]["timestamp"]
             data_out[i]["ts_timestamp"]=ts[ts_i]["timestamp"]
             ts_i=ts_i+1
@@ -35,7 +37,7 @@ def _sync_tlu_timestamp(tlu,ts,data_out,higher_lim=470,lower_lim=500): ##477-495
             i=i+1
     return 0, tlu_i, ts_i, data_out[:i]
 
-@njit
+@njit(cache=True)
 def _build_event_token(dat,tmp,buf,ev,flg_mode):
     i=0
     ts=dat[0]['timestamp']
@@ -71,7 +73,7 @@ def _build_event_token(dat,tmp,buf,ev,flg_mode):
         i=i+d_i
     return 0, buf
 
-@njit
+@njit(cache=True)
 def _sync_tlu_token(buf,tlu):
     tlu_i=0
     i=0
@@ -108,9 +110,16 @@ def build_h5(fraw,fhit,fout,mode="frame128",debug=0x0):
     ####### read data
     print "event_builder.build_h5(), Input File:",fhit
     with tables.open_file(fhit) as f:
-        dat=f.root.Hits[:]
-    print "event_builder.build_h5() - Size of data: Total=%d"%len(dat),"TLU=%d"%len(dat[dat["col"]==0xFF]),"TS=%d"%len(dat[dat["col"]==0xFC]),
-    print "HIT_OR=%d"%len(dat[dat["col"]==0xFD]),"TJ-Monopix=%d"%len(dat[dat["col"]<COL])
+        records=au.read_records(f,{"Hits":None,
+                                   "TLU":["raw_index","trigger_number","timestamp"],
+                                   "Timestamps":["raw_index","source","timestamp"],
+                                   "HitOr":["raw_index"]})
+    dat=records["Hits"]
+    tlu=records["TLU"]
+    ts=records["Timestamps"][records["Timestamps"]["source"]==0xFC]
+    print "event_builder.build_h5() - Size of data: TLU=%d"%len(tlu),"TS=%d"%len(ts),
+    print "HIT_OR=%d"%len(records["HitOr"]),"TJ-Monopix=%d"%len(dat[dat["col"]<COL])
+    records=None
     
     with tables.open_file(fout, "w") as f_o:
 
@@ -128,7 +137,10 @@ def build_h5(fraw,fhit,fout,mode="frame128",debug=0x0):
             #    print i,(tmp[1:] < tmp[:-1])[i],tmp[1:][i], tmp[:-1][i]
             #for ii,i in enumerate(np.arange(tmp_arg[arg[0]+1]-5,tmp_arg[arg[0]+1]+5)):
             #    print ii+tmp_arg[arg[0]+1]-5, dat[i]
+            cut_index=dat["raw_index"][tmp_arg[arg[0]+1]]
             dat=dat[tmp_arg[arg[0]+1]:]
+            tlu=tlu[tlu["raw_index"]>=cut_index]
+            ts=ts[ts["raw_index"]>=cut_index]
         else:
             print "ERROR! Data must be ordered by timestamp. Fix the data!!!"
             for i, a in enumerate(arg):
@@ -142,7 +154,6 @@ def build_h5(fraw,fhit,fout,mode="frame128",debug=0x0):
 
         ########################
         ####### check ts data
-        ts=dat[dat["col"]==0xFC]
         arg=np.argwhere(ts["timestamp"][1:] < ts["timestamp"][:-1])
         print 'event_builder.build_h5() - Check ts precise timestamp: increase only',len(arg)==0
         for i, a in enumerate(arg):
@@ -168,13 +179,12 @@ def build_h5(fraw,fhit,fout,mode="frame128",debug=0x0):
         ########################
         ####### check tlu number
 
-        tlu=dat[dat["col"]==0xFF]
-        arg=np.argwhere(tlu["cnt"][1:] - tlu["cnt"][:-1] & 0x7FFF !=1)
+        arg=np.argwhere(tlu["trigger_number"][1:] - tlu["trigger_number"][:-1] & 0x7FFF !=1)
         print 'event_builder.build_h5() - Check TLU number: increased by 1 only',len(arg)==0
         for i,a in enumerate(arg):
-            print i, "idx=%d"%a[0], "%d(ts=%d)"%(tlu["cnt"][a[0]],tlu["timestamp"][a[0]]),
-            print "%d(ts=%d)"%(tlu["cnt"][a[0]+1],tlu["timestamp"][a[0]+1]),
-            print "diff=0x%x"%(tlu["cnt"][a+1] - tlu["cnt"][a]),
+            print i, "idx=%d"%a[0], "%d(ts=%d)"%(tlu["trigger_number"][a[0]],tlu["timestamp"][a[0]]),
+            print "%d(ts=%d)"%(tlu["trigger_number"][a[0]+1],tlu["timestamp"][a[0]+1]),
+            print "diff=0x%x"%(tlu["trigger_number"][a+1] - tlu["trigger_number"][a]),
             print "diff_ts=0x%x"%(tlu["timestamp"][a+1] - tlu["timestamp"][a])
             if i ==10:
                 print "more...",len(a)
@@ -6,7 +6,7 @@ import yaml
 
 COL=112
 
-@numba.njit
+@numba.njit(cache=True)
 def _build_event(dat,tmp,buf,ev,flg_mode):
     i=0
     ts=dat[0]['timestamp']
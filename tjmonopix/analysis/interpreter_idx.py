@@ -1,610 +1,233 @@
 import sys,time,os
 import numpy as np
 import matplotlib.pyplot as plt
-from numba import njit
 import tables
 
+from tjmonopix.analysis import analysis_utils as au
+from tjmonopix.analysis import decoder
+from tjmonopix.analysis import raw_cache
+from tjmonopix.analysis import storage_layout
+
 hit_idx_dtype=np.dtype([("col","<u1"),("row","<u1"),("le","<u1"),("te","<u1"),("cnt","<u4"),
                     ("timestamp","<u8"),("scan_param_id","<u4")])
-                    
-@njit
-def _interpret_idx(raw,buf,start,col,row,le,te,noise,timestamp,rx_flg,
-               ts_timestamp,ts_pre,ts_flg,ts_cnt,
-               ts2_timestamp,ts2_pre,ts2_flg,ts2_cnt,
-               ts2t_timestamp,ts2t_flg,ts2t_cnt,
-               ts3_timestamp,ts3_pre,ts3_flg,ts3_cnt,
-               ts4_timestamp,ts4_pre,ts4_flg,ts4_cnt,debug):
-    TJ_MASK_LOWER = np.uint64(0x00000000FFFFFFF0)
-    TJ_MASK_UPPER = np.uint64(0x00FFFFFF00000000)
-
-    TS_MASK_DAT           =0x0000000000FFFFFF
-    TS_MASK1    =np.uint64(0xFFFFFFFFFF000000)
-    TS_MASK2    =np.uint64(0xFFFF000000FFFFFF)
-    TS_MASK3    =np.uint64(0x0000FFFFFFFFFFFF)
-
-    TS_MASK_TOT = np.uint64(0x0000000000FFFF00)
-    TS_DIV_MASK_DAT = np.uint64(0x00000000000000FF)
-    err=0
-    buf_i=0
-    for r_i,r in enumerate(raw):
-        ########################
-        ### MONOPIX_RX
-        ########################
-        if (r & 0xF0000000 == 0x30000000):
-            pass #TODO get count
-        elif (r & 0xF0000000 == 0x00000000):
-            col = 2 * (r & 0x3f) + (((r & 0x7FC0) >> 6) // 256)
-            row = ((r & 0x7FC0) >> 6) % 256
-            te = (r & 0x1F8000) >> 15
-            le = (r & 0x7E00000) >> 21
-            noise = (r & 0x8000000) >> 27
-           #if debug & 0x4 ==0x4:
-               #print r_i,hex(r),rx_flg,"ts=",hex(timestamp),col,row,noise
-
-            if rx_flg==0x0:
-              rx_flg=0x1
-            else:
-               err=err+1
-               buf[buf_i]["row"]=0xE1
-               buf[buf_i]["col"]=0
-               buf[buf_i]["le"]=rx_flg
-               buf[buf_i]["te"]=0
-               buf[buf_i]["timestamp"]= 0
-               buf[buf_i]["cnt"]=r
-               buf[buf_i]["scan_param_id"]=r_i+start
-               buf_i=buf_i+1
-               rx_flg=0
-           
-        elif (r & 0xF0000000 == 0x10000000):
-            timestamp = (timestamp & TJ_MASK_UPPER) | (
-                np.uint64(r)<<np.uint64(4) & TJ_MASK_LOWER)
-           #if debug & 0x4 ==0x4:
-               #print r_i,hex(r),rx_flg,"ts=",hex(timestamp),le,te
-               #pass
-               
-            if rx_flg==0x1:
-              rx_flg=0x2
-            else:
-               err=err+1
-               buf[buf_i]["row"]=0xE1
-               buf[buf_i]["col"]=1
-               buf[buf_i]["le"]=rx_flg
-               buf[buf_i]["te"]=0
-               buf[buf_i]["timestamp"]= 0
-               buf[buf_i]["cnt"]=r
-               buf[buf_i]["scan_param_id"]=r_i+start
-               buf_i=buf_i+1
-               rx_flg=0
-
-        elif (r & 0xF0000000 == 0x20000000):
-            timestamp = (timestamp & TJ_MASK_LOWER) | (
-                (np.uint64(r) << np.uint64(32)) & TJ_MASK_UPPER)
-           #if debug & 0x4 ==0x4:
-               #print r_i,hex(r),rx_flg,"ts=",hex(timestamp)
-               
-            if rx_flg == 0x2:
-               buf[buf_i]["row"]=row
-               buf[buf_i]["col"]=col
-               buf[buf_i]["le"]=le
-               buf[buf_i]["te"]=te
-               buf[buf_i]["timestamp"]= timestamp
-               buf[buf_i]["cnt"]=noise
-               buf[buf_i]["scan_param_id"]=r_i+start
-               buf_i=buf_i+1
-               rx_flg=0
-            else:
-               err=err+1
-               buf[buf_i]["row"]=0xE1
-               buf[buf_i]["col"]=2
-               buf[buf_i]["le"]=rx_flg
-               buf[buf_i]["te"]=0
-               buf[buf_i]["timestamp"]= 0
-               buf[buf_i]["cnt"]=r
-               buf[buf_i]["scan_param_id"]=r_i+start
-               buf_i=buf_i+1
-               rx_flg=0
-              
-        ########################
-        ### TIMESTMP
-        ########################
-        elif r & 0xFF000000 == 0x40000000: 
-            pass ## TODO get count
-        elif r & 0xFF000000 == 0x41000000: ## timestamp
-            ts_timestamp = (ts_timestamp & TS_MASK1) | np.uint64(r & TS_MASK_DAT)
-            ts_cnt=ts_cnt+1
-            #if debug & 0x4 ==0x4:
-                #print r_i,hex(r),"timestamp1",hex(ts_timestamp),ts_cnt
-
-            if ts_flg==2:
-               ts_flg=0
-               if debug & 0x1 == 0x1:
-                   ts_inter=(ts_timestamp-ts_pre)& 0xFFFFFFFF
-                   buf[buf_i]["col"]=0xFE
-                   buf[buf_i]["row"]= np.uint8(ts_inter)
-                   buf[buf_i]["le"]=np.uint8(ts_inter>>np.uint64(8))
-                   buf[buf_i]["te"]=np.uint8(ts_inter>>np.uint64(16))
-                   buf[buf_i]["timestamp"]=ts_timestamp
-                   buf[buf_i]["cnt"]=ts_cnt
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-            else:
-               if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEE
-                   buf[buf_i]["row"]=2
-                   buf[buf_i]["le"]=ts_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-               err=err+1
-               ts_flg=0
-        elif r & 0xFF000000 == 0x42000000: ## timestamp
-            ts_timestamp=(ts_timestamp & TS_MASK2) + (np.uint64(r & TS_MASK_DAT) << np.uint64(24))
-            #if debug & 0x4 ==0x4:
-                #print r_i,hex(r),"timestamp2",hex(ts_timestamp),
-
-            if ts_flg==0x1:
-              ts_flg=0x2
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEE
-                   buf[buf_i]["row"]=1
-                   buf[buf_i]["le"]=ts_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts_flg=0x0
-                err=err+1
-        elif r & 0xFF000000 == 0x43000000: ## timestamp
-            ts_pre=ts_timestamp
-            ts_timestamp=(ts_timestamp & TS_MASK3)+ (np.uint64(r & TS_MASK_DAT) << np.uint64(48))
-            #if debug & 0x4 ==0x4:
-               #print r_i,hex(r),"timestamp3",hex(ts_timestamp),
-
-            if ts_flg==0x0:
-               ts_flg=0x1
-            else:
-               if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEE
-                   buf[buf_i]["row"]=0
-                   buf[buf_i]["le"]=ts_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-               ts_flg=0x0  
-               err=err+1
-               
-        ########################
-        ### TIMESTMP160 INJ
-        ########################
-        elif r & 0xFF000000 == 0x50000000:
-            pass  # TODO get count
-        elif r & 0xFF000000 == 0x51000000:  # timestamp
-            ts3_timestamp = (ts3_timestamp & np.uint64(0xFFFFFFFFFF000000)) | np.uint64( r & TS_MASK_DAT )
-            ts3_cnt = ts3_cnt+1
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp),ts_cnt
-
-            if ts3_flg == 2:
-                ts3_flg = 0
-                if debug & 0x1 == 0x1:
-                    buf[buf_i]["col"] = 0xFC
-                    buf[buf_i]["row"] = 0
-                    buf[buf_i]["le"] = 0
-                    buf[buf_i]["te"] = 0
-                    buf[buf_i]["timestamp"] = ts3_timestamp
-                    buf[buf_i]["cnt"] = ts3_cnt
-                    buf[buf_i]["scan_param_id"]=r_i+start
-                    #if debug & 0x80 == 0x80:
-                    #    buf[buf_i]['idx']=r_i
-                    buf_i = buf_i+1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEC
-                   buf[buf_i]["row"]=2
-                   buf[buf_i]["le"]=ts3_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts3_flg = 0 
-                err=err+1
-        elif r & 0xFF000000 == 0x52000000:  # timestamp
-            ts3_timestamp = (ts3_timestamp & np.uint64(0xFFFF000000FFFFFF)) | \
-                (np.uint64(r & TS_MASK_DAT) << np.uint64(24))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp)
-
-            if ts3_flg == 0x1:
-                ts3_flg = 0x2
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEC
-                   buf[buf_i]["row"]=1
-                   buf[buf_i]["le"]=ts3_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts3_flg = 0 
-                err=err+1
-        elif r & 0xFF000000 == 0x53000000:  # timestamp
-            ts3_timestamp = (ts3_timestamp & np.uint64(0x0000FFFFFFFFFFFF)) | (np.uint64(r & np.uint64(0x000000000000FFFF)) << np.uint64(48))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"ts2_timestamp",hex(ts_timestamp)
-
-            if ts3_flg == 0x0:
-                ts3_flg = 0x1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEC
-                   buf[buf_i]["row"]=0
-                   buf[buf_i]["le"]=ts3_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts3_flg = 0 
-                err=err+1
-
-        ########################
-        ### TIMESTMP640 MON
-        ########################
-        elif r & 0xFF000000 == 0x60000000:
-            pass  # TODO get count
-        elif r & 0xFF000000 == 0x61000000:  # timestamp
-            ts2_timestamp = (ts2_timestamp & np.uint64(0xFFFFFFFFFF000000)) | np.uint64( r & TS_MASK_DAT )
-            ts2_cnt = ts2_cnt+1
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp),ts_cnt
-
-            if ts2_flg == 2:
-                ts2_flg = 0
-                if debug & 0x1 == 0x1:
-                    buf[buf_i]["col"] = 0xFD
-                    buf[buf_i]["row"] = 0
-                    buf[buf_i]["le"] = 0
-                    buf[buf_i]["te"] = 0
-                    buf[buf_i]["timestamp"] = ts2_timestamp
-                    buf[buf_i]["cnt"] = ts2_cnt
-                    buf[buf_i]["scan_param_id"]=r_i+start
-                    #if debug & 0x80 == 0x80:
-                    #    buf[buf_i]['idx']=r_i
-                    buf_i = buf_i+1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=2
-                   buf[buf_i]["le"]=ts2_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2_flg = 0   
-                err=err+1 
-        elif r & 0xFF000000 == 0x62000000:  # timestamp
-            ts2_timestamp = (ts2_timestamp & np.uint64(0xFFFF000000FFFFFF)) | \
-                (np.uint64(r & TS_MASK_DAT) << np.uint64(24))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp)
-
-            if ts2_flg == 0x1:
-                ts2_flg = 0x2
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=1
-                   buf[buf_i]["le"]=ts2_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2_flg = 0 
-                err=err+1   
-        elif r & 0xFF000000 == 0x63000000:  # timestamp
-            ts2_timestamp = (ts2_timestamp & np.uint64(0x0000FFFFFFFFFFFF)) | \
-                (np.uint64(r & TS_DIV_MASK_DAT) << np.uint64(48))
-            ts2_tot = (np.uint64(r & TS_MASK_TOT) >> np.uint64(8))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"ts2_timestamp",hex(ts_timestamp)
-
-            if ts2_flg == 0x0:
-                ts2_flg = 0x1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=0
-                   buf[buf_i]["le"]=ts2_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2_flg = 0  
-                err=err+1
-        elif r & 0xFF000000 == 0x65000000:  # timestamp
-            ts2t_timestamp = (ts2t_timestamp & np.uint64(0xFFFFFFFFFF000000)) | np.uint64( r & TS_MASK_DAT )
-            ts2t_cnt = ts2t_cnt+1
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp),ts_cnt
-
-            if ts2t_flg == 2:
-                ts2t_flg = 0
-                if debug & 0x1 == 0x1:
-                    buf[buf_i]["col"] = 0xFD
-                    buf[buf_i]["row"] = 1
-                    buf[buf_i]["le"] = 0
-                    buf[buf_i]["te"] = 0
-                    buf[buf_i]["timestamp"] = ts2t_timestamp
-                    buf[buf_i]["cnt"] = ts2t_cnt
-                    buf[buf_i]["scan_param_id"]=r_i+start
-                    #if debug & 0x80 == 0x80:
-                    #    buf[buf_i]['idx']=r_i
-                    buf_i = buf_i+1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=2+4
-                   buf[buf_i]["le"]=ts2t_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2t_flg = 0   
-                err=err+1 
-        elif r & 0xFF000000 == 0x66000000:  # timestamp
-            ts2t_timestamp = (ts2t_timestamp & np.uint64(0xFFFF000000FFFFFF)) | \
-                (np.uint64(r & TS_MASK_DAT) << np.uint64(24))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp)
-
-            if ts2t_flg == 0x1:
-                ts2t_flg = 0x2
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=1+4
-                   buf[buf_i]["le"]=ts2t_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2t_flg = 0 
-                err=err+1   
-        elif r & 0xFF000000 == 0x67000000:  # timestamp
-            ts2t_timestamp = (ts2t_timestamp & np.uint64(0x0000FFFFFFFFFFFF)) | \
-                (np.uint64(r & TS_DIV_MASK_DAT) << np.uint64(48))
-            if ts2t_flg == 0x0:
-                ts2t_flg = 0x1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xED
-                   buf[buf_i]["row"]=0+4
-                   buf[buf_i]["le"]=ts2t_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts2t_flg = 0  
-                err=err+1
-   
-        ########################
-        ### TIMESTMP160 TLU
-        ########################
-        elif r & 0xFF000000 == 0x70000000:
-            pass  # TODO get count
-        elif r & 0xFF000000 == 0x71000000:  # timestamp
-            ts4_timestamp = (ts4_timestamp & np.uint64(0xFFFFFFFFFF000000)) | np.uint64( r & TS_MASK_DAT )
-            ts4_cnt = ts4_cnt+1
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp),ts_cnt
-
-            if ts4_flg == 2:
-                ts4_flg = 0
-                if debug & 0x1 == 0x1:
-                    buf[buf_i]["col"] = 0xFB
-                    buf[buf_i]["row"] = 0
-                    buf[buf_i]["le"] = 0
-                    buf[buf_i]["te"] = 0
-                    buf[buf_i]["timestamp"] = ts4_timestamp
-                    buf[buf_i]["cnt"] = ts4_cnt
-                    buf[buf_i]["scan_param_id"]=r_i+start
-                    #if debug & 0x80 == 0x80:
-                    #    buf[buf_i]['idx']=r_i
-                    buf_i = buf_i+1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEB
-                   buf[buf_i]["row"]=2
-                   buf[buf_i]["le"]=ts4_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts4_flg = 0  
-                err=err+1
-        elif r & 0xFF000000 == 0x72000000:  # timestamp
-            ts4_timestamp = (ts4_timestamp & np.uint64(0xFFFF000000FFFFFF)) | \
-                (np.uint64(r & TS_MASK_DAT) << np.uint64(24))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"timestamp1",hex(ts_timestamp)
-
-            if ts4_flg == 0x1:
-                ts4_flg = 0x2
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEB
-                   buf[buf_i]["row"]=1
-                   buf[buf_i]["le"]=ts4_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts4_flg = 0 
-                err=err+1 
-        elif r & 0xFF000000 == 0x73000000:  # timestamp
-            ts4_timestamp = (ts4_timestamp & np.uint64(0x0000FFFFFFFFFFFF)) | (np.uint64(r & np.uint64(0x000000000000FFFF)) << np.uint64(48))
-            # if debug & 0x4 ==0x4:
-            #print r_i,hex(r),"ts2_timestamp",hex(ts_timestamp)
-
-            if ts4_flg == 0x0:
-                ts4_flg = 0x1
-            else:
-                if debug & 0x1 == 0x1:
-                   buf[buf_i]["col"]=0xEB
-                   buf[buf_i]["row"]=0
-                   buf[buf_i]["le"]=ts4_flg
-                   buf[buf_i]["te"]=0
-                   buf[buf_i]["timestamp"]=0
-                   buf[buf_i]["cnt"]=r
-                   buf[buf_i]["scan_param_id"]=r_i+start
-                   buf_i=buf_i+1
-                ts4_flg = 0 
-                err=err+1                         
-
-        ########################
-        ### TLU
-        ########################
-        elif (r & 0x80000000 == 0x80000000):
-            tlu = r & 0xFFFF
-            tlu_org =(r>>12) & 0x7FFF0  #16-4(160MHz)
-            if debug & 0x20 ==0x00:
-                tlu_timestamp= ts_pre & np.uint64(0xFFFFFFFFFFF80000) | np.uint64(tlu_org)
-                if tlu_org < (np.int32(ts_pre) & 0x7FFF0):
-                #if np.uint64(tlu_timestamp - ts_pre) & np.uint64(0x8000) == np.uint64(0x8000):
-                    tlu_timestamp = tlu_timestamp + np.uint64(0x80000)
-            else:
-                tlu_timestamp= ts2_pre & np.uint64(0xFFFFFFFFFFF80000) | np.uint64(tlu_org)
-                if tlu_org < (np.int32(ts2_pre) & 0x7FFF0):
-                    tlu_timestamp = tlu_timestamp + np.uint64(0x80000)
-            #if debug & 0x4 ==0x4:
-                #print r_i,hex(r),"ts=",hex(tlu_timestamp),"tlu",tlu,hex(tlu_tmp),tlu_tmp < trig_tmp
-
-            if debug & 0x2 == 0x2:
-                buf[buf_i]["col"]=0xFF
-                buf[buf_i]["row"]=0xFF
-                buf[buf_i]["le"]= 0xFF 
-                buf[buf_i]["te"]= 0xFF
-                buf[buf_i]["timestamp"]=tlu_timestamp
-                buf[buf_i]["cnt"]=tlu
-                buf[buf_i]["scan_param_id"]=r_i+start
-                buf_i=buf_i+1
-        else:
-            buf[buf_i]["col"]=0xE0
-            buf[buf_i]["row"]=0
-            buf[buf_i]["le"]=0
-            buf[buf_i]["te"]=0
-            buf[buf_i]["timestamp"]=0
-            buf[buf_i]["cnt"]=r
-            buf[buf_i]["scan_param_id"]=r_i+start
-            buf_i=buf_i+1
-            err=err+1   
-    return err,buf[:buf_i],r_i,col,row,le,te,noise,timestamp,rx_flg,\
-                      ts_timestamp,ts_pre,ts_flg,ts_cnt,\
-                      ts2_timestamp,ts2_pre,ts2_flg,ts2_cnt,ts2t_timestamp,ts2t_flg,ts2t_cnt,\
-                      ts3_timestamp,ts3_pre,ts3_flg,ts3_cnt,\
-                      ts4_timestamp,ts4_pre,ts4_flg,ts4_cnt
-
-                      
-@njit
-def _assign_scan_id(dat,meta):
-    m_i=0
-    d_i=0
-    while m_i<len(meta) and d_i< len(dat):
-        if meta[m_i]["index_start"] <= dat[d_i]["scan_param_id"] \
-           and meta[m_i]["index_stop"] > dat[d_i]["scan_param_id"]:
-                dat[d_i]["scan_param_id"]=meta[m_i]["scan_param_id"]
-                d_i=d_i+1
-        elif meta[m_i]["index_stop"] <= dat[d_i]["scan_param_id"]:
-            m_i=m_i+1
-        else: # meta[m_i]["index_start"] > data[d_i]["scan_param_id"]
-            #print "error", m_i,d_i,meta[m_i]["index_start"],dat[d_i]["scan_param_id"]
-            #break
-            return 1,dat,m_i,d_i
-    return 0,dat,m_i, d_i
-                      
-                      
-def interpret_idx_h5(fin,fout,debug=3, n=100000000):
-    buf=np.empty(n,dtype=hit_idx_dtype)
-    col=0xFF
-    row=0xFF
-    le=0xFF
-    te=0xFF
-    noise=0
-    timestamp=np.uint64(0x0)
-    rx_flg=0
-    
-    ts_timestamp=np.uint64(0x0)
-    ts_pre=ts_timestamp
-    ts_cnt=0x0
-    ts_flg=0
-    
-    ts2_timestamp=np.uint64(0x0)
-    ts2_pre=ts2_timestamp
-    ts2_cnt=0x0
-    ts2_flg=0
-    ts2t_timestamp=np.uint64(0x0)
-    ts2t_cnt=0x0
-    ts2t_flg=0
-    
-    ts3_timestamp=np.uint64(0x0)
-    ts3_pre=ts3_timestamp
-    ts3_cnt=0x0
-    ts3_flg=0
-    
-    ts4_timestamp=np.uint64(0x0)
-    ts4_pre=ts4_timestamp
-    ts4_cnt=0x0
-    ts4_flg=0
-    
+
+
+def get_decoder_config(debug):
+    """ Decoder configuration (see decoder.Decoder) for the debug flags of interpret_idx_h5: 3 data words per TJ hit,
+    an error discards only the partially decoded data of the same source, unknown words are errors.
+    debug 0x1: write timestamp records, 0x2: write TLU words, 0x4: write error records, 0x20: do not extend the TLU
+    timestamps. Errors are always counted in the RawDataCounters table.
+    """
+    options = decoder.UNKNOWN_IS_ERROR | decoder.IDX_RECORDS
+    if debug & 0x1 == 0x1:
+        options |= decoder.TIMESTAMP_RECORDS
+    if debug & 0x2 == 0x2:
+        options |= decoder.TLU_RECORDS
+    if debug & 0x4 == 0x4:
+        options |= decoder.ERROR_RECORDS
+    if debug & 0x20 == 0x0:
+        options |= decoder.EXTEND_TLU_TS
+    return {"tj_words": 3, "formats": decoder.ALL_FORMATS, "options": options}
+
+
+def _lock(lock_file):
+    """ Exclusive lock on lock_file, None if another process holds it. Release it with _unlock.
+    """
+    lock = open(lock_file, "w")
+    try:
+        import fcntl
+    except ImportError:  # No fcntl on Windows, run without lock
+        return lock
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The process which held the lock can have removed lock_file meanwhile, its lock is not ours then
+        if os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_file)):
+            return lock
+    except (IOError, OSError):
+        pass
+    lock.close()
+    return None
+
+
+def _unlock(lock, lock_file):
+    """ Remove lock_file and release the lock on it
+    """
+    try:
+        os.remove(lock_file)
+    except OSError:  # Files which are open cannot be removed on Windows
+        pass
+    lock.close()
+
+
+def _write_checkpoint(f_o, idx_decoder, hit_writer, debug, split_records, compact):
+    """ Store the checkpoint of the incremental interpretation and the decoder counters in the hit file f_o.
+    """
+    state = idx_decoder.get_state()
+    checkpoint = {"decoder": {"state": state["state"].tolist(), "counters": state["counters"].tolist(),
+                              "raw_index": state["raw_index"]},
+                  "nrows": dict((name, table.nrows) for name, table in hit_writer.tables.items()),
+                  "debug": debug, "split_records": split_records, "compact": compact}
+    au.write_counters(f_o, idx_decoder.get_counters())
+    f_o.root._v_attrs.interpreter_checkpoint = checkpoint
+    f_o.flush()
+
+
+def _interpret_idx_h5_incremental(fin, fout, debug, n, split_records, compact, layout):
+    """ Interpret the raw data words of fin written since the last call and append their hits to fout.
+
+    After every chunk the checkpoint (decoding state, see decoder.Decoder.get_state, and rows of the hit tables) is
+    stored as attribute of fout. Rows written after the last checkpoint, e.g. by an interrupted call, are removed
+    before continuing, so the result is the same as interpreting the whole file at once.
+    Only words covered by the meta data are interpreted, the readout that is being written is left for the next call.
+    Calls running at the same time are excluded by a lock file, the later call returns None.
+    To read fin while the scan writes it, HDF5 file locking has to be disabled (HDF5_USE_FILE_LOCKING=FALSE).
+    Returns the raw data index up to which fin is interpreted.
+    """
+    lock_file = fout + ".lock"
+    lock = _lock(lock_file)
+    if lock is None:
+        print("interpret_idx_h5: %s is being interpreted by another process" % fin)
+        return None
+    try:
+        checkpoint = None
+        if os.path.isfile(fout):
+            with tables.open_file(fout, "r") as f_o:
+                if "interpreter_checkpoint" in f_o.root._v_attrs:
+                    checkpoint = f_o.root._v_attrs.interpreter_checkpoint
+        if checkpoint is None:
+            checkpoint = {"decoder": None, "nrows": {}, "debug": debug, "split_records": split_records,
+                          "compact": compact}
+        elif (checkpoint["debug"] != debug or checkpoint["split_records"] != split_records or
+              checkpoint.get("compact", False) != compact):
+            raise ValueError("%s was interpreted with debug=%s, split_records=%s, compact=%s" % (
+                fout, checkpoint["debug"], checkpoint["split_records"], checkpoint.get("compact", False)))
+        idx_decoder = decoder.Decoder(**get_decoder_config(debug))
+        if checkpoint["decoder"] is not None:
+            idx_decoder.set_state(checkpoint["decoder"])
+
+        with tables.open_file(fout, "a" if idx_decoder.raw_index else "w") as f_o:
+            hit_writer = au.HitWriter(f_o, hit_idx_dtype, split_records=split_records, compact=compact,
+                                      **storage_layout.get_node_kwargs(layout, "hits"))
+            for name, table in hit_writer.tables.items():
+                if table.nrows > checkpoint["nrows"].get(name, 0):
+                    table.truncate(checkpoint["nrows"].get(name, 0))
+            start = idx_decoder.raw_index
+            with raw_cache.open_raw_data(fin) as (raw_data, meta):
+                end = min(len(raw_data), int(np.max(meta["index_stop"]))) if len(meta) else 0
+                t0 = time.time()
+                while start < end:
+                    stop = min(end, start + n)
+                    err = idx_decoder.get_error_count()
+                    hit_dat = idx_decoder.decode_array(raw_data[start:stop], hit_idx_dtype)
+                    err = idx_decoder.get_error_count() - err
+                    n_hit = len(hit_dat)
+                    n_unassigned = hit_writer.append(hit_dat, meta)
+                    if n_unassigned != 0:
+                        print("assing_scan has error data=%d, assigned=%d" % (n_hit, n_hit - n_unassigned))
+                    print("%d %d %.3f%% %.3fs %dhits %derrs" % (start, stop - start - 1, 100.0 * stop / end,
+                                                                time.time() - t0, n_hit, err))
+                    start = stop
+                    _write_checkpoint(f_o, idx_decoder, hit_writer, debug, split_records, compact)
+        return start
+    finally:
+        _unlock(lock, lock_file)
+
+
+def interpret_idx_h5(fin,fout,debug=3, n=100000000, n_processes=1, split_records=False, incremental=False,
+                     compact=False, layout=None):
+    """ Interpret raw data file fin to hit table in fout. fin can also be the .raw file of the analysis cache
+    (see raw_cache), the cache of fin is used if it exists.
+    n_processes > 1 (None: one per CPU core) decodes chunks of n words in parallel, with identical result.
+    split_records=True writes TJ hits, TLU words, HitOr, timestamps and errors to separate tables
+    (see analysis_utils.split_records), compact=True the TJ hits in the compact layout
+    (see analysis_utils.COMPACT_HITS_DTYPE). layout is the storage layout of the hit tables (see storage_layout).
+    incremental=True continues from the checkpoint of the last incremental call, e.g. to interpret a raw data file
+    while it is written (see _interpret_idx_h5_incremental).
+    """
+    if incremental:
+        return _interpret_idx_h5_incremental(fin, fout, debug, n, split_records, compact, layout)
+
+    idx_decoder=decoder.Decoder(**get_decoder_config(debug))
     with tables.open_file(fout, "w") as f_o:
-        description=np.zeros((1,),dtype=hit_idx_dtype).dtype
-        hit_table=f_o.create_table(f_o.root,name="Hits",description=description,title='hit_data')
-        with tables.open_file(fin) as f:
-            meta=f.root.meta_data[:]
-            end=len(f.root.raw_data)
-            start=0
-            t0=time.time()
-            hit_total=0
-            while start<end:
-                tmpend=min(end,start+n)
-                raw=f.root.raw_data[start:tmpend]
-                (err,hit_dat,r_i,col,row,le,te,noise,timestamp,rx_flg,
-                    ts_timestamp,ts_pre,ts_flg,ts_cnt,
-                    ts2_timestamp,ts2_pre,ts2_flg,ts2_cnt,ts2t_timestamp,ts2t_flg,ts2t_cnt,
-                    ts3_timestamp,ts3_pre,ts3_flg,ts3_cnt,
-                    ts4_timestamp,ts4_pre,ts4_flg,ts4_cnt
-                    ) = _interpret_idx(
-                    raw,buf,start,col,row,le,te,noise,timestamp,rx_flg,
-                    ts_timestamp,ts_pre,ts_flg,ts_cnt,
-                    ts2_timestamp,ts2_pre,ts2_flg,ts2_cnt,ts2t_timestamp,ts2t_flg,ts2t_cnt,
-                    ts3_timestamp,ts3_pre,ts3_flg,ts3_cnt,
-                    ts4_timestamp,ts4_pre,ts4_flg,ts4_cnt,debug)
-                n_hit=len(hit_dat)
-                hit_total=hit_total+n_hit
-                err,hit_dat,m_i,d_i = _assign_scan_id(hit_dat,meta)
-                meta=meta[m_i:]
-                if d_i!=n_hit:
-                    print "assing_scan has error data=%d, assigned=%d"%(n_hit,d_i)
-                print "%d %d %.3f%% %.3fs %dhits %derrs"%(start,r_i,100.0*(start+r_i+1)/end,time.time()-t0,len(hit_dat),err)
-                hit_table.append(hit_dat)
-                hit_table.flush()
-                start=start+r_i+1
+        hit_writer=au.HitWriter(f_o,hit_idx_dtype,split_records=split_records,compact=compact,
+                                **storage_layout.get_node_kwargs(layout,"hits"))
+        with raw_cache.open_raw_data(fin) as (raw_data,meta):
+            end=len(raw_data)
+        t0=time.time()
+        err=0
+        for start,stop,hit_dat in decoder.decode_h5_chunks(idx_decoder,fin,hit_idx_dtype,n,n_processes=n_processes):
+            n_hit=len(hit_dat)
+            n_unassigned = hit_writer.append(hit_dat,meta)
+            if n_unassigned!=0:
+                print("assing_scan has error data=%d, assigned=%d"%(n_hit,n_hit-n_unassigned))
+            print("%d %d %.3f%% %.3fs %dhits %derrs"%(start,stop-start-1,100.0*stop/end,time.time()-t0,n_hit,
+                                                      idx_decoder.get_error_count()-err))
+            err=idx_decoder.get_error_count()
+        au.write_counters(f_o,idx_decoder.get_counters())
+
+class LiveInterpreter(object):
+    """ Interpret the readouts of a scan while it is running and write the hits to fout, like interpret_idx_h5 with
+    the same options does for the raw data file afterwards. All readouts of the raw data file have to be appended,
+    in order. The readouts are collected and interpreted together when reaching batch_words words or when the first
+    one is older than max_age seconds. layout is the storage layout of the hit tables (see storage_layout).
+
+    fout has the checkpoint of interpret_idx_h5(incremental=True) after every batch, which continues from it after
+    the scan, e.g. with the readouts which were not interpreted after an error.
+    """
+
+    def __init__(self, fout, debug=3, split_records=False, compact=False, batch_words=2 ** 20, max_age=1.0,
+                 layout=None):
+        self.fout = fout
+        self.debug = debug
+        self.split_records = split_records
+        self.compact = compact
+        self.batch_words = batch_words
+        self.max_age = max_age
+        self._lock = _lock(fout + ".lock")
+        if self._lock is None:
+            raise RuntimeError("%s is being interpreted by another process" % fout)
+        self.decoder = decoder.Decoder(**get_decoder_config(debug))
+        self._f_o = tables.open_file(fout, "w")
+        self._hit_writer = au.HitWriter(self._f_o, hit_idx_dtype, split_records=split_records, compact=compact,
+                                        **storage_layout.get_node_kwargs(layout, "hits"))
+        self._raw_data = []
+        self._meta = np.zeros(0, dtype=raw_cache.IDX_DTYPE)  # Readouts of the batch
+        self._n_words = 0
+        self._batch_time = None
+
+    def append(self, raw_data, scan_param_id=0):
+        if self._batch_time is None:
+            self._batch_time = time.time()
+        meta = np.zeros(1, dtype=raw_cache.IDX_DTYPE)
+        meta["index_start"] = self.decoder.raw_index + self._n_words
+        meta["index_stop"] = meta["index_start"] + raw_data.shape[0]
+        meta["scan_param_id"] = scan_param_id
+        self._meta = np.concatenate((self._meta, meta))
+        self._raw_data.append(raw_data)
+        self._n_words += raw_data.shape[0]
+        if self._n_words >= self.batch_words or time.time() - self._batch_time >= self.max_age:
+            self.interpret()
+
+    def interpret(self):
+        """ Interpret the collected readouts and write their hits and the checkpoint.
+        """
+        if self._raw_data:
+            hit_dat = self.decoder.decode_array(np.concatenate(self._raw_data), hit_idx_dtype)
+            n_unassigned = self._hit_writer.append(hit_dat, self._meta)
+            if n_unassigned != 0:
+                print("assing_scan has error data=%d, assigned=%d" % (len(hit_dat), len(hit_dat) - n_unassigned))
+            self._raw_data = []
+            self._meta = self._meta[:0]  # Records have the raw data index of their last word, always in this batch
+            self._n_words = 0
+            self._batch_time = None
+            _write_checkpoint(self._f_o, self.decoder, self._hit_writer, self.debug, self.split_records,
+                              self.compact)
+
+    def close(self):
+        self.interpret()
+        self._f_o.close()
+        _unlock(self._lock, self.fout + ".lock")
+
 
 def list2img(dat,delete_noise=True):
     if delete_noise==True:
@@ -628,68 +251,25 @@ def without_noise(dat):
 
 class InterRawIdx():
     def __init__(self,chunk=100000000,debug=0):
-        self.reset()
-        self.buf=np.empty(chunk,dtype=hit_idx_dtype)
         self.n=chunk
         self.debug=0
+        self.decoder=decoder.Decoder(**get_decoder_config(3|0x4))
+
     def reset(self):
-        self.col=0xFF
-        self.row=0xFF
-        self.le=0xFF
-        self.te=0xFF
-        self.noise=0
-        self.timestamp=np.int64(0x0)
-        self.rx_flg=0
-        
-        self.ts_timestamp=np.uint64(0x0)
-        self.ts_pre=self.ts_timestamp
-        self.ts_cnt=0x0
-        self.ts_flg=0
-        
-        self.ts2_timestamp=np.uint64(0x0)
-        self.ts2_pre=self.ts2_timestamp
-        self.ts2_cnt=0x0
-        self.ts2_flg=0
-        self.ts2t_timestamp=np.uint64(0x0)
-        self.ts2t_cnt=0x0
-        self.ts2t_flg=0
-        
-        self.ts3_timestamp=np.uint64(0x0)
-        self.ts3_pre=self.ts3_timestamp
-        self.ts3_cnt=0x0
-        self.ts3_flg=0
-        
-        self.ts4_timestamp=np.uint64(0x0)
-        self.ts4_pre=self.ts4_timestamp
-        self.ts4_cnt=0x0
-        self.ts4_flg=0
+        self.decoder.reset()
 
     def run(self,raw,data_format=3):
-        start=0
-        end=len(raw)
-        ret=np.empty(0,dtype=hit_idx_dtype)
-        while start<end: ##TODO make chunk work
-            tmpend=min(end,start+self.n)
-            ( err,hit_dat,r_i,
-              self.col,self.row,self.le,self.te,self.noise,self.timestamp,self.rx_flg,
-              self.ts_timestamp,self.ts_pre,self.ts_flg,self.ts_cnt,
-              self.ts2_timestamp,self.ts2_pre,self.ts2_flg,self.ts2_cnt,
-              self.ts2t_timestamp,self.ts2t_flg,self.ts2t_cnt,
-              self.ts3_timestamp,self.ts3_pre,self.ts3_flg,self.ts3_cnt,
-              self.ts4_timestamp,self.ts4_pre,self.ts4_flg,self.ts4_cnt
-              ) = _interpret_idx(
-              raw[start:tmpend],self.buf,start,
-              self.col,self.row,self.le,self.te,self.noise,self.timestamp,self.rx_flg,
-              self.ts_timestamp,self.ts_pre,self.ts_flg,self.ts_cnt,
-              self.ts2_timestamp,self.ts2_pre,self.ts2_flg,self.ts2_cnt,
-              self.ts2t_timestamp,self.ts2t_flg,self.ts2t_cnt,
-              self.ts3_timestamp,self.ts3_pre,self.ts3_flg,self.ts3_cnt,
-              self.ts4_timestamp,self.ts4_pre,self.ts4_flg,self.ts4_cnt,data_format)
-            if err!=0:
-               self.reset()
-            ret=np.append(ret,hit_dat)
-            start=start+r_i+1
-        return ret
+        config=get_decoder_config(data_format|0x4)  # With error records
+        if self.decoder.get_config()!=config:
+            self.decoder=decoder.Decoder(**config)
+        self.decoder.raw_index=0  # scan_param_id is the index in raw
+        ret=[np.empty(0,dtype=hit_idx_dtype)]
+        for start in range(0,len(raw),self.n):
+            err=self.decoder.get_error_count()
+            ret.append(self.decoder.decode_array(raw[start:start+self.n],hit_idx_dtype))
+            if self.decoder.get_error_count()!=err:
+                self.reset()  # Data partially decoded at the end of a chunk with errors is discarded
+        return np.concatenate(ret)
         
     def mk_list(self,raw,delete_noise=True):
         dat=self.run(raw)
@@ -706,27 +286,27 @@ class InterRawIdx():
         return list2cnt(dat,delete_noise=True)
         
 def raw2list(raw,delete_noise=True):
-    inter=InterRaw()
+    inter=InterRawIdx()
     dat=inter.run(raw)
     if delete_noise==True:
         dat=without_noise(dat)
     return dat
 
 def raw2img(raw,delete_noise=True):
-    inter=InterRaw()
-    return list2img(inter.run(raw),noise=noise)
+    inter=InterRawIdx()
+    return list2img(inter.run(raw),delete_noise=delete_noise)
 
 def raw2cnt(raw,delete_noise=True):
-    inter=InterRaw()
+    inter=InterRawIdx()
     return list2cnt(inter.run(raw),delete_noise=delete_noise)
 
 if __name__ == "__main__":
     import sys
     fin=sys.argv[1]
     fout=fin[:-8]+"_hit.h5"
-    interpret_idx_h5(fin,fout,debug=3)
+    interpret_idx_h5(fin,fout,debug=3,incremental="--incremental" in sys.argv[2:])
     # debug 
     # 
     # 0x20 correct tlu_timestamp based on timestamp2 0x00 based on timestamp
-    print fout
+    print(fout)
                
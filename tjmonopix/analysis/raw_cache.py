@@ -0,0 +1,247 @@
+''' Analysis cache of a raw data file: the raw data words as flat little-endian uint32 file (.raw) and the meta data
+    as flat file of IDX_DTYPE rows (.idx), next to the raw data file. Both are read with np.memmap, which avoids the
+    decompression of the blosc compressed raw data for every analysis pass over the same run.
+
+    The cache is created from the raw data file with create_raw_cache or at acquisition time with RawCacheWriter.
+    The interpreters read the raw data with open_raw_data and accept the .raw file in place of the raw data file.
+    An existing complete cache of a raw data file is used automatically.
+
+    The raw data of a scan written in segments (see raw_data_writer.SegmentedRawDataWriter) is read with open_raw_data
+    from the closed segments listed in the manifest of the scan file, as one stream with global raw data indices.
+'''
+
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import tables as tb
+import yaml
+
+RAW_EXT = '.raw'
+IDX_EXT = '.idx'
+MANIFEST_EXT = '_segments.yaml'
+
+IDX_DTYPE = np.dtype([('index_start', '<u8'), ('index_stop', '<u8'), ('timestamp_start', '<f8'),
+                      ('timestamp_stop', '<f8'), ('scan_param_id', '<u4'), ('error', '<u4')])
+
+
+def get_cache_files(raw_data_file):
+    ''' Paths of the .raw and .idx file of a raw data file (or of its .raw file)
+    '''
+    base = os.path.splitext(raw_data_file)[0]
+    return base + RAW_EXT, base + IDX_EXT
+
+
+def get_raw_data_file(raw_data_file):
+    ''' Path of the raw data file (.h5) of a .raw file, e.g. to read the scan attributes
+    '''
+    if raw_data_file.endswith(RAW_EXT):
+        return raw_data_file[:-len(RAW_EXT)] + '.h5'
+    return raw_data_file
+
+
+def get_segment_file(raw_data_file, segment):
+    ''' Path of a segment of a scan file written in segments
+    '''
+    return os.path.splitext(raw_data_file)[0] + '_%04d.h5' % segment
+
+
+def get_manifest_file(raw_data_file):
+    ''' Path of the manifest of a scan file written in segments
+    '''
+    return os.path.splitext(raw_data_file)[0] + MANIFEST_EXT
+
+
+def read_manifest(raw_data_file):
+    ''' Manifest of a scan file written in segments: complete (False while the scan is running) and the segments
+        with file, index_start, index_stop, n_readouts, scan_param_id_start/stop, timestamp_start/stop and closed.
+        None if the raw data is not written in segments.
+    '''
+    manifest_file = get_manifest_file(raw_data_file)
+    if raw_data_file.endswith(RAW_EXT) or not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file) as in_file:
+        return yaml.safe_load(in_file)
+
+
+def get_segment_files(raw_data_file):
+    ''' Paths of the closed segments of a scan file written in segments, in order
+    '''
+    manifest = read_manifest(raw_data_file)
+    if manifest is None:
+        return []
+    directory = os.path.dirname(os.path.abspath(raw_data_file))
+    return [os.path.join(directory, segment['file']) for segment in manifest['segments'] if segment['closed']]
+
+
+class SegmentedRawData(object):
+    ''' Raw data words of several segments as one array, read with slices like the raw_data EArray
+    '''
+
+    def __init__(self, segments):
+        self._segments = segments
+        self._offsets = np.cumsum([0] + [segment.shape[0] for segment in segments])
+        self.shape = (int(self._offsets[-1]), )
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            index = key + self.shape[0] if key < 0 else key
+            if not 0 <= index < self.shape[0]:
+                raise IndexError('Index %d out of range' % key)
+            segment = np.searchsorted(self._offsets, index, side='right') - 1
+            return self._segments[segment][index - self._offsets[segment]]
+        start, stop, step = key.indices(self.shape[0])
+        if step != 1:
+            raise ValueError('Only slices with step 1 are supported')
+        parts = []
+        for segment, offset, next_offset in zip(self._segments, self._offsets[:-1], self._offsets[1:]):
+            if start < next_offset and stop > offset:
+                parts.append(np.asarray(segment[max(start, offset) - offset:min(stop, next_offset) - offset]))
+        if not parts:
+            return np.zeros(0, dtype=np.uint32)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def _to_idx(meta_data):
+    idx = np.zeros(meta_data.shape[0], dtype=IDX_DTYPE)
+    for name in IDX_DTYPE.names:
+        if name in meta_data.dtype.names:
+            idx[name] = meta_data[name]
+    return idx
+
+
+def _read_meta_data(in_file):
+    if 'meta_data' not in in_file.root:  # e.g. raw data written by tests
+        return np.zeros(0, dtype=IDX_DTYPE)
+    return in_file.root.meta_data[:]
+
+
+def _memmap(file_name, dtype):
+    n_rows = os.path.getsize(file_name) // dtype.itemsize  # Without a row that is being written
+    if n_rows == 0:  # Empty files cannot be mapped
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file_name, dtype=dtype, mode='r', shape=(n_rows, ))
+
+
+class RawCacheWriter(object):
+    ''' Writes the analysis cache of a raw data file readout by readout, e.g. in ScanBase._handle_data
+    '''
+
+    def __init__(self, raw_data_file):
+        raw_file, idx_file = get_cache_files(raw_data_file)
+        self.raw_file = open(raw_file, 'wb')
+        self.idx_file = open(idx_file, 'wb')
+        self.n_words = 0
+
+    def append(self, raw_data, timestamp_start=0., timestamp_stop=0., scan_param_id=0, error=0):
+        idx = np.zeros(1, dtype=IDX_DTYPE)
+        idx['index_start'] = self.n_words
+        self.n_words += raw_data.shape[0]
+        idx['index_stop'] = self.n_words
+        idx['timestamp_start'] = timestamp_start
+        idx['timestamp_stop'] = timestamp_stop
+        idx['scan_param_id'] = scan_param_id
+        idx['error'] = error
+        raw_data.astype('<u4').tofile(self.raw_file)
+        self.raw_file.flush()  # Readers never see meta data without its raw data
+        idx.tofile(self.idx_file)
+
+    def flush(self):
+        self.raw_file.flush()
+        self.idx_file.flush()
+
+    def close(self):
+        self.raw_file.close()
+        self.idx_file.close()
+
+
+def create_raw_cache(raw_data_file, chunk_size=10000000):
+    ''' Write the analysis cache of a raw data file. Returns the path of the .raw file.
+    '''
+    raw_file, idx_file = get_cache_files(raw_data_file)
+    with open_raw_data(raw_data_file, use_cache=False) as (raw_data, meta_data):
+        with open(raw_file + '.tmp', 'wb') as out_file:
+            for start in range(0, raw_data.shape[0], chunk_size):
+                raw_data[start:start + chunk_size].astype('<u4').tofile(out_file)
+        with open(idx_file + '.tmp', 'wb') as out_file:
+            _to_idx(meta_data).tofile(out_file)
+    # Renamed when complete, an interrupted call leaves no incomplete cache
+    os.rename(idx_file + '.tmp', idx_file)
+    os.rename(raw_file + '.tmp', raw_file)
+    return raw_file
+
+
+def _get_size(raw_data_file):
+    ''' Number of raw data words and meta data rows of a raw data file, of its closed segments if written in segments
+    '''
+    if read_manifest(raw_data_file) is not None:
+        sizes = [_get_size(segment_file) for segment_file in get_segment_files(raw_data_file)]
+        return sum(size[0] for size in sizes), sum(size[1] for size in sizes)
+    with tb.open_file(raw_data_file) as in_file:
+        n_meta_data = in_file.root.meta_data.nrows if 'meta_data' in in_file.root else 0
+        return in_file.root.raw_data.shape[0], n_meta_data
+
+
+def has_raw_cache(raw_data_file):
+    ''' True if the analysis cache of the raw data file exists and is complete
+    '''
+    raw_file, idx_file = get_cache_files(raw_data_file)
+    if not os.path.isfile(raw_file) or not os.path.isfile(idx_file):
+        return False
+    n_words, n_meta_data = _get_size(raw_data_file)
+    return os.path.getsize(raw_file) == 4 * n_words and os.path.getsize(idx_file) == IDX_DTYPE.itemsize * n_meta_data
+
+
+@contextmanager
+def _open_segments(raw_data_file, use_cache):
+    ''' Raw data (SegmentedRawData) and meta data (IDX_DTYPE rows) of the closed segments of a scan file
+    '''
+    in_files = []
+    try:
+        segments, meta_data = [], []
+        n_words = 0
+        for segment_file in get_segment_files(raw_data_file):
+            if use_cache and has_raw_cache(segment_file):
+                raw_file, idx_file = get_cache_files(segment_file)
+                segment = _memmap(raw_file, np.dtype('<u4'))
+                idx = np.array(_memmap(idx_file, IDX_DTYPE))
+            else:
+                in_file = tb.open_file(segment_file)
+                in_files.append(in_file)
+                segment = in_file.root.raw_data
+                idx = _to_idx(_read_meta_data(in_file))
+            # Segment indices start from 0
+            idx['index_start'] += n_words
+            idx['index_stop'] += n_words
+            n_words += int(segment.shape[0])
+            segments.append(segment)
+            meta_data.append(idx)
+        yield SegmentedRawData(segments), np.concatenate(meta_data) if meta_data else np.zeros(0, dtype=IDX_DTYPE)
+    finally:
+        for in_file in in_files:
+            in_file.close()
+
+
+@contextmanager
+def open_raw_data(raw_data_file, use_cache=True):
+    ''' Yields the raw data words (np.memmap of the .raw file or the raw_data EArray of the raw data file, both read
+        with slices) and the meta data rows (at least index_start, index_stop and scan_param_id) of a raw data file
+        or .raw file. The analysis cache of a raw data file is used if it is complete and use_cache is True.
+        For a scan file written in segments the closed segments are read (SegmentedRawData, IDX_DTYPE meta data).
+    '''
+    if raw_data_file.endswith(RAW_EXT) or (use_cache and has_raw_cache(raw_data_file)):
+        raw_file, idx_file = get_cache_files(raw_data_file)
+        idx = _memmap(idx_file, IDX_DTYPE)
+        raw_data = _memmap(raw_file, np.dtype('<u4'))
+        # A cache written at acquisition time can have raw data words without meta data yet
+        yield raw_data, np.array(idx)
+        return
+    if read_manifest(raw_data_file) is not None:
+        with _open_segments(raw_data_file, use_cache) as (raw_data, meta_data):
+            yield raw_data, meta_data
+        return
+    with tb.open_file(raw_data_file) as in_file:
+        yield in_file.root.raw_data, _read_meta_data(in_file)
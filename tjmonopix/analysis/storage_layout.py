@@ -0,0 +1,67 @@
+''' HDF5 storage layout of the raw_data EArray, the meta_data table and the hit tables, e.g. from the scan
+    configuration:
+
+        layout = {'raw_data': {'complib': 'blosc:zstd', 'complevel': 3, 'shuffle': 'bit', 'chunkshape': 2 ** 16},
+                  'hits': {'complib': 'blosc:lz4', 'expectedrows': 10 ** 8}}
+
+    Every node has the options
+        complib: compression library, see tables.filters.all_complibs, e.g. zlib, blosc (blosc:blosclz), blosc:lz4
+                 or blosc:zstd. None: no compression
+        complevel: compression level 0 - 9
+        shuffle: 'byte' (byte shuffle), 'bit' (bit shuffle, blosc only) or None
+        chunkshape: rows per HDF5 chunk, None: chosen by PyTables from expectedrows
+        expectedrows: expected number of rows, used by PyTables to choose the chunkshape
+    Options which are not given are taken from DEFAULT_LAYOUT. benchmarks/storage_layout.py measures the write and
+    read speed and the file size of layouts.
+'''
+
+import tables as tb
+
+NODES = ('raw_data', 'meta_data', 'hits')
+SHUFFLE_MODES = (None, 'byte', 'bit')
+
+DEFAULT_LAYOUT = {
+    'raw_data': {'complib': 'blosc', 'complevel': 5, 'shuffle': 'byte', 'chunkshape': None, 'expectedrows': None},
+    'meta_data': {'complib': 'zlib', 'complevel': 5, 'shuffle': 'byte', 'chunkshape': None, 'expectedrows': None},
+    'hits': {'complib': None, 'complevel': 0, 'shuffle': None, 'chunkshape': None, 'expectedrows': 10000}
+}
+
+
+def get_layout_options(layout, node):
+    ''' Options of node ('raw_data', 'meta_data' or 'hits') in layout, completed with DEFAULT_LAYOUT
+    '''
+    if node not in NODES:
+        raise ValueError('Unknown node %s, use one of %s' % (node, ', '.join(NODES)))
+    layout = layout or {}
+    for name in layout:
+        if name not in NODES:
+            raise ValueError('Unknown node %s in layout, use one of %s' % (name, ', '.join(NODES)))
+    options = dict(DEFAULT_LAYOUT[node])
+    for name, value in layout.get(node, {}).items():
+        if name not in options:
+            raise ValueError('Unknown layout option %s of %s' % (name, node))
+        options[name] = value
+    if options['complib'] is not None and options['complib'] not in tb.filters.all_complibs:
+        raise ValueError('Unknown complib %s, use one of %s' % (options['complib'],
+                                                                ', '.join(tb.filters.all_complibs)))
+    if options['shuffle'] not in SHUFFLE_MODES:
+        raise ValueError('Unknown shuffle %s, use one of %s' % (options['shuffle'], SHUFFLE_MODES))
+    return options
+
+
+def get_node_kwargs(layout, node):
+    ''' Arguments filters, chunkshape and expectedrows of create_earray / create_table for node in layout
+    '''
+    options = get_layout_options(layout, node)
+    filters = None
+    if options['complib'] is not None and options['complevel']:
+        filters = tb.Filters(complib=options['complib'], complevel=options['complevel'],
+                             shuffle=options['shuffle'] == 'byte', bitshuffle=options['shuffle'] == 'bit',
+                             fletcher32=False)
+    chunkshape = options['chunkshape']
+    if chunkshape is not None:
+        chunkshape = (int(chunkshape), )
+    expectedrows = options['expectedrows']
+    if expectedrows is not None:
+        expectedrows = int(expectedrows)
+    return {'filters': filters, 'chunkshape': chunkshape, 'expectedrows': expectedrows}
@@ -5,35 +5,30 @@ import tables as tb
 from numba import njit
 import logging
 
+from tjmonopix.analysis import analysis_utils as au
+
 def get_timewalk_hist(hit_file, show_plots=False):
 
     # One hit consists of 136 bit of data. Choose chunk size according to available RAM
     chunk_size = 100000000
 
-    tdc_data = np.array([], dtype=[('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<u8')])
-    tlu_data = np.array([], dtype=[('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<u8')])
-    tj_data = np.array([], dtype=[('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<u8')])
-
     # TODO: Get all pixels where HIT OR is enabled
     mon_pixels = np.array([[1, 50, 102]])
 
     with tb.open_file(hit_file, 'r') as in_file:
-        start = 0
-        end = start + chunk_size
-        while True:
-            hit_data = in_file.root.Hits[start:end]
-            if len(hit_data) == 0:
-                break
-            else:
-                print len(tdc_data)
-                print len(hit_data[hit_data['col'] == 253])
-
-                tlu_data = np.concatenate([tlu_data, hit_data[hit_data['col'] == 252]])
-                tdc_data = np.concatenate([tdc_data, hit_data[hit_data['col'] == 253]])
-                tj_data = np.concatenate([tj_data, hit_data[np.logical_and(hit_data['col'] < 112, hit_data['cnt'] == 0)]])
-
-                start = end
-                end = start + chunk_size
+        records = au.read_records(in_file, {'Hits': ['col', 'row', 'le', 'te', 'cnt', 'timestamp'],
+                                            'HitOr': ['cnt', 'timestamp'],
+                                            'Timestamps': ['source', 'cnt', 'timestamp']},
+                                  chunk_size=chunk_size)
+
+    timestamp_dtype = [('cnt', '<u4'), ('timestamp', '<u8')]
+    tlu_data = records['Timestamps'][records['Timestamps']['source'] == 252]
+    tlu_data = tlu_data[['cnt', 'timestamp']].astype(timestamp_dtype)
+    tdc_data = records['HitOr'].astype(timestamp_dtype)
+    tj_data = records['Hits'][np.logical_and(records['Hits']['col'] < 112, records['Hits']['cnt'] == 0)]
+    tj_data = tj_data.astype([('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', 'u1'),
+                              ('timestamp', '<u8')])
+    records = None
 
     print("TJ: {} hits | TDC: {} hits | TLU: {} hits".format(len(tj_data), len(tdc_data), len(tlu_data)))
     # plt.hist(tdc_data['cnt'])
@@ -9,7 +9,7 @@ import yaml
 data_out_type=[("tlu_id","i2"),("tlu_timestamp","u8"),("ts_timestamp","u8")]
 hits_type=[('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<u8')]
 
-@njit
+@njit(cache=True)
 def _sync_tlu_timestamp(tlu,ts,data_out,offset):
     tlu_i=0
     ts_i=0
@@ -0,0 +1,73 @@
+''' Decoder benchmark: raw data words per second decoded by analysis.decoder.Decoder in the configurations of the
+    interpreters, for clean TJ data and for TJ data mixed with timestamps, TLU words and broken words.
+
+    python -m tjmonopix.benchmarks.decoder
+'''
+
+import time
+
+import numpy as np
+
+from tjmonopix.analysis import decoder
+from tjmonopix.analysis import interpreter
+
+# Decoder configurations of the interpreters: (name, Decoder arguments). interpreter_idx: get_decoder_config(0x3)
+CONFIGS = [('interpreter', interpreter.RAW_DATA_CONFIG),
+           ('interpreter_idx', {'tj_words': 3, 'formats': decoder.ALL_FORMATS,
+                                'options': decoder.UNKNOWN_IS_ERROR | decoder.IDX_RECORDS | decoder.EXTEND_TLU_TS |
+                                decoder.ERROR_RECORDS | decoder.TIMESTAMP_RECORDS | decoder.TLU_RECORDS}),
+           ('online', {'tj_words': 4, 'formats': decoder.TJ_DATA, 'options': 0})]
+
+
+def get_raw_data(n_words, tj_words=4, mixed=False, seed=0):
+    ''' Synthetic raw data: TJ data blocks, with mixed=True also HitOr, external and TLU timestamps, TLU words and
+        1 permille of words with a flipped header bit.
+    '''
+    rng = np.random.RandomState(seed)
+    n_blocks = n_words // tj_words
+    raw_data = np.empty((n_blocks, tj_words), dtype=np.uint32)
+    for k in range(tj_words):
+        raw_data[:, k] = (k << 28) | rng.randint(0, 1 << 28, n_blocks)
+    raw_data = raw_data.ravel()
+    if mixed:
+        n_other = n_blocks // 4
+        other = np.empty((n_other, 3), dtype=np.uint32)
+        headers = rng.choice([0x60, 0x40, 0x70], n_other)
+        for ts_id in (1, 2, 3):
+            other[:, 3 - ts_id] = ((headers + ts_id) << 24) | rng.randint(0, 1 << 24, n_other)
+        other[::5] = (0x80000000 | rng.randint(0, 1 << 31, (n_other + 4) // 5))[:, np.newaxis]
+        positions = np.sort(rng.randint(0, n_blocks, n_other)) * tj_words
+        raw_data = np.insert(raw_data, np.repeat(positions, 3), other.ravel())
+        broken = rng.randint(0, raw_data.shape[0], raw_data.shape[0] // 1000)
+        raw_data[broken] ^= np.uint32(1) << rng.randint(24, 32, broken.shape[0]).astype(np.uint32)
+    return raw_data[:n_words]
+
+
+def run(n_words=10000000, chunk_size=1000000, n_repeat=3):
+    ''' Returns for each decoder configuration and data set the decoded raw data words per second (best of n_repeat)
+    '''
+    results = {}
+    for name, config in CONFIGS:
+        for mixed in (False, True):
+            raw_data = get_raw_data(n_words, config['tj_words'], mixed)
+            hit_data = np.zeros(chunk_size, dtype=decoder.RECORD_DTYPE)
+            decoder.Decoder(**config).decode(raw_data[:10], hit_data)  # compile
+            times = []
+            for _ in range(n_repeat):
+                hit_decoder = decoder.Decoder(**config)
+                start_time = time.time()
+                for start in range(0, n_words, chunk_size):
+                    hit_decoder.decode(raw_data[start:start + chunk_size], hit_data)
+                times.append(time.time() - start_time)
+            results['%s_%s' % (name, 'mixed' if mixed else 'clean')] = n_words / min(times)
+    return results
+
+
+def main():
+    results = run()
+    for name in sorted(results):
+        print('%-24s %8.1f Mwords/s' % (name, results[name] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
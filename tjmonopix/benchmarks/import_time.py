@@ -0,0 +1,75 @@
+''' Import time benchmark: time to import the main modules in a fresh Python process. Also checks that importing has
+    no side effects, i.e. creates no files in the output_data directory and installs no logging handlers.
+
+    python -m tjmonopix.benchmarks.import_time
+'''
+
+import json
+import subprocess
+import sys
+
+MODULES = ['tjmonopix.constants',
+           'tjmonopix.analysis.interpreter',
+           'tjmonopix.analysis.analysis',
+           'tjmonopix.tjmonopix',
+           'tjmonopix.scan_base']
+
+# Executed in a fresh process with the module name as argument, prints the results as JSON
+IMPORT_CODE = '''
+import importlib, json, logging, os, sys, time
+from tjmonopix.constants import DATDIR
+def list_files():
+    return set(os.listdir(DATDIR)) if os.path.isdir(DATDIR) else set()
+files = list_files()
+start_time = time.time()
+try:
+    importlib.import_module(sys.argv[1])
+except Exception as e:  # missing dependencies, e.g. no basil installed
+    print(json.dumps({"error": "%s: %s" % (type(e).__name__, e)}))
+    sys.exit()
+import_time = time.time() - start_time
+print(json.dumps({"import": import_time,
+                  "new_files": sorted(list_files() - files),
+                  "root_handlers": len(logging.root.handlers),
+                  "tjmonopix_handlers": len(logging.getLogger("TJMONOPIX").handlers)}))
+'''
+
+
+def _run_import(module):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE, module])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(modules=None, n_repeat=3):
+    ''' Returns for each module the minimum import time in seconds and the side effects of the import,
+        or the import error if the module cannot be imported in this environment.
+    '''
+    results = {}
+    for module in modules or MODULES:
+        runs = [_run_import(module) for _ in range(n_repeat)]
+        if 'error' in runs[0]:
+            results[module] = runs[0]
+            continue
+        result = runs[0]
+        result['import'] = min(r['import'] for r in runs)
+        results[module] = result
+    return results
+
+
+def main():
+    results = run()
+    for module in MODULES:
+        result = results[module]
+        if 'error' in result:
+            print('%-32s unavailable (%s)' % (module, result['error']))
+            continue
+        side_effects = []
+        if result['new_files']:
+            side_effects.append('created %s' % ', '.join(result['new_files']))
+        if result['root_handlers'] or result['tjmonopix_handlers']:
+            side_effects.append('installed logging handlers')
+        print('%-32s %6.3f s %s' % (module, result['import'], '; '.join(side_effects) or 'no side effects'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+''' Interpreter throughput benchmark: raw data words per second, pixel hits per second and peak memory of every raw
+    data decoding path and event builder, on synthetic raw data (see raw_data_generator). Every path runs in a fresh
+    process, after running it once on a small raw data file to compile the numba kernels. Paths that cannot run in
+    this environment (missing dependencies, Python 2 only modules) are reported with their error.
+
+    The results can be stored as JSON and compared to the results of another commit:
+        python -m tjmonopix.benchmarks.interpreter --output results.json
+        python -m tjmonopix.benchmarks.interpreter --compare results.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tables as tb
+
+from tjmonopix.benchmarks import raw_data_generator
+
+# Executed in a fresh process with path name, raw data file and warmup raw data file as arguments, prints the
+# results as JSON
+PATH_CODE = '''
+import json, sys
+from tjmonopix.benchmarks import interpreter
+print(json.dumps(interpreter._run_path(*sys.argv[1:])))
+'''
+
+
+def _get_peak_memory():
+    ''' Peak resident memory of this process in MB
+    '''
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory / (1024. * 1024.) if sys.platform == 'darwin' else peak_memory / 1024.  # bytes on macOS
+
+
+def _count_hits(hits):
+    return int(np.count_nonzero(hits['col'] < 0xE0))
+
+
+def _interpreter(raw_data_file, work_dir):
+    from tjmonopix.analysis import interpreter
+    with tb.open_file(raw_data_file) as in_file:
+        raw_data = in_file.root.raw_data[:]
+        meta_data = in_file.root.meta_data[:]
+    start_time = time.time()
+    hit_data, _ = interpreter.Interpreter().interpret_data(raw_data, meta_data)
+    return _count_hits(hit_data), time.time() - start_time
+
+
+def _decode_h5_chunks(raw_data_file, work_dir, n_processes=1):
+    from tjmonopix.analysis import decoder
+    from tjmonopix.analysis import interpreter
+    start_time = time.time()
+    data_interpreter = interpreter.RawDataInterpreter(chunk_size=1000000)
+    n_hits = 0
+    for _, _, hits in decoder.decode_h5_chunks(data_interpreter, raw_data_file, decoder.RECORD_DTYPE, 1000000,
+                                               n_processes=n_processes):
+        n_hits += _count_hits(hits)
+    return n_hits, time.time() - start_time
+
+
+def _decode_h5_chunks_parallel(raw_data_file, work_dir):
+    return _decode_h5_chunks(raw_data_file, work_dir, n_processes=None)
+
+
+def _raw_cache(raw_data_file, work_dir):
+    from tjmonopix.analysis import raw_cache
+    raw_file = raw_cache.get_cache_files(raw_data_file)[0]
+    if not os.path.isfile(raw_file):
+        raw_cache.create_raw_cache(raw_data_file)
+    return _decode_h5_chunks(raw_file, work_dir)
+
+
+def _online(raw_data_file, work_dir):
+    ''' Decoding of the online monitor converter, one readout at a time
+    '''
+    from tjmonopix.analysis import decoder
+    with tb.open_file(raw_data_file) as in_file:
+        raw_data = in_file.root.raw_data[:]
+        meta_data = in_file.root.meta_data[:]
+    start_time = time.time()
+    hit_decoder = decoder.Decoder(tj_words=4, formats=decoder.TJ_DATA, options=0)
+    n_hits = 0
+    for readout in meta_data:
+        n_hits += hit_decoder.decode_array(raw_data[readout['index_start']:readout['index_stop']]).shape[0]
+    return n_hits, time.time() - start_time
+
+
+def _analysis(raw_data_file, work_dir):
+    from tjmonopix.analysis import analysis
+    start_time = time.time()
+    with analysis.Analysis(raw_data_file=raw_data_file) as a:
+        a.analyze_data()
+        with tb.open_file(a.analyzed_data_file) as in_file:
+            n_hits = _count_hits(in_file.root.Hits[:])
+    return n_hits, time.time() - start_time
+
+
+def _interpret_idx(raw_data_file, work_dir, debug=0x0):
+    from tjmonopix.analysis import interpreter_idx
+    hit_file = os.path.join(work_dir, os.path.basename(raw_data_file)[:-3] + '_hit.h5')
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull:  # progress output
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            interpreter_idx.interpret_idx_h5(raw_data_file, hit_file, debug=debug)
+        finally:
+            sys.stdout = stdout
+    with tb.open_file(hit_file) as in_file:
+        n_hits = _count_hits(in_file.root.Hits[:])
+    return n_hits, time.time() - start_time
+
+
+def _interpreter_idx(raw_data_file, work_dir):
+    return _interpret_idx(raw_data_file, work_dir)
+
+
+def _event_builder(raw_data_file, work_dir):
+    ''' event_builder.EventBuilder, on the hits, TLU words and TLU timestamps of the interpreter
+    '''
+    from tjmonopix.analysis import event_builder
+    from tjmonopix.analysis import interpreter
+    with tb.open_file(raw_data_file) as in_file:
+        hit_data, _ = interpreter.Interpreter().interpret_data(in_file.root.raw_data[:], in_file.root.meta_data[:])
+    hits = hit_data[hit_data['col'] < 0xE0]
+    hits = hits[np.argsort(hits['timestamp'], kind='mergesort')]
+    start_time = time.time()
+    builder = event_builder.EventBuilder(raw_data_file)
+    builder.build_events(hits, hit_data[hit_data['col'] == 0xFB], hit_data[hit_data['col'] == 0xFF])
+    return hits.shape[0], time.time() - start_time
+
+
+def _event_builder_token(raw_data_file, work_dir):
+    from tjmonopix.analysis import event_builder_token
+    n_hits, _ = _interpret_idx(raw_data_file, work_dir, debug=0x3)
+    hit_file = os.path.join(work_dir, os.path.basename(raw_data_file)[:-3] + '_hit.h5')
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            event_builder_token.build_h5(hit_file, hit_file[:-7] + '_ev.h5')
+        finally:
+            sys.stdout = stdout
+    return n_hits, time.time() - start_time
+
+
+def _event_builder_tlu(raw_data_file, work_dir):
+    from tjmonopix.analysis import event_builder_tlu
+    n_hits, _ = _interpret_idx(raw_data_file, work_dir, debug=0x3)
+    hit_file = os.path.join(work_dir, os.path.basename(raw_data_file)[:-3] + '_hit.h5')
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            event_builder_tlu.build_h5(raw_data_file, hit_file, hit_file[:-7] + '_ev.h5')
+        finally:
+            sys.stdout = stdout
+    return n_hits, time.time() - start_time
+
+
+# Decoding paths and event builders: name, function(raw_data_file, work_dir) returning the number of pixel hits and
+# the time of the measured part
+PATHS = [('interpreter', _interpreter),
+         ('decode_h5_chunks', _decode_h5_chunks),
+         ('decode_h5_chunks_parallel', _decode_h5_chunks_parallel),
+         ('raw_cache', _raw_cache),
+         ('online', _online),
+         ('analysis', _analysis),
+         ('interpreter_idx', _interpreter_idx),
+         ('event_builder', _event_builder),
+         ('event_builder_token', _event_builder_token),
+         ('event_builder_tlu', _event_builder_tlu)]
+
+
+def _run_path(name, raw_data_file, warmup_file):
+    func = dict(PATHS)[name]
+    work_dir = os.path.dirname(raw_data_file)
+    try:
+        func(warmup_file, work_dir)
+        memory_before = _get_peak_memory()
+        n_hits, run_time = func(raw_data_file, work_dir)
+    except Exception as e:  # missing dependencies, e.g. no pixel_clusterizer installed
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+    with tb.open_file(raw_data_file) as in_file:
+        n_words = in_file.root.raw_data.shape[0]
+    return {'time': run_time,
+            'words_per_s': n_words / run_time,
+            'hits_per_s': n_hits / run_time,
+            'peak_memory': _get_peak_memory(),
+            'peak_memory_before': memory_before}
+
+
+def _run_path_process(name, raw_data_file, warmup_file):
+    with open(os.devnull, 'w') as devnull:  # no progress bar output
+        output = subprocess.check_output([sys.executable, '-c', PATH_CODE, name, raw_data_file, warmup_file],
+                                         stderr=devnull)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def _get_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def run(paths=None, **config):
+    ''' Returns the configuration of the synthetic raw data (see raw_data_generator.DEFAULT_CONFIG) and for each
+        path words/s, hits/s and peak memory in MB (or the error if the path cannot run in this environment).
+    '''
+    config = dict(raw_data_generator.DEFAULT_CONFIG, **config)
+    work_dir = tempfile.mkdtemp()
+    try:
+        raw_data_file = os.path.join(work_dir, 'raw_data.h5')
+        raw_data_generator.write_raw_data_file(raw_data_file, raw_data_generator.generate_raw_data(**config),
+                                               config['readout_size'])
+        warmup_file = os.path.join(work_dir, 'warmup.h5')
+        raw_data_generator.write_raw_data_file(warmup_file, raw_data_generator.generate_raw_data(
+            **dict(config, n_events=1000)), config['readout_size'])
+        results = {}
+        for name, _ in PATHS:
+            if paths is None or name in paths:
+                results[name] = _run_path_process(name, raw_data_file, warmup_file)
+    finally:
+        shutil.rmtree(work_dir)
+    return {'commit': _get_commit(),
+            'python': platform.python_version(),
+            'config': config,
+            'paths': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Interpreter throughput benchmark')
+    parser.add_argument('--output', help='Store the results as JSON file')
+    parser.add_argument('--compare', help='Compare to the results of a JSON file')
+    parser.add_argument('--paths', nargs='+', help='Paths to run (default: all)')
+    parser.add_argument('--n_events', type=int, default=raw_data_generator.DEFAULT_CONFIG['n_events'])
+    parser.add_argument('--bit_error_rate', type=float, default=raw_data_generator.DEFAULT_CONFIG['bit_error_rate'])
+    args = parser.parse_args()
+
+    results = run(paths=args.paths, n_events=args.n_events, bit_error_rate=args.bit_error_rate)
+    reference = {}
+    if args.compare:
+        with open(args.compare) as in_file:
+            reference = json.load(in_file)['paths']
+    for name, _ in PATHS:
+        if name not in results['paths']:
+            continue
+        result = results['paths'][name]
+        if 'error' in result:
+            print('%-26s unavailable (%s)' % (name, result['error']))
+            continue
+        line = '%-26s %8.1f Mwords/s %8.2f Mhits/s %8.0f MB' % (name, result['words_per_s'] / 1e6,
+                                                               result['hits_per_s'] / 1e6, result['peak_memory'])
+        if 'words_per_s' in reference.get(name, {}):
+            line += '  %+6.1f%% words/s' % (100. * (result['words_per_s'] / reference[name]['words_per_s'] - 1))
+        print(line)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            json.dump(results, out_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+''' Deterministic synthetic raw data of TJ-MonoPix in the format of the current firmware (4 data words per TJ hit, see
+    analysis.decoder), e.g. for benchmarks. The same parameters and seed always give the same raw data.
+
+    Events (particle hits) arrive with exponentially distributed intervals. Every event is a cluster of pixel hits,
+    optionally preceded by an injection timestamp, a TLU timestamp with its TLU word and a HitOr timestamp.
+    External timestamps are inserted at a fixed interval. Bit errors flip random bits of the data words.
+'''
+
+import numpy as np
+import tables as tb
+import yaml
+
+# Timestamps are in 640 MHz clock cycles, the TJ data timestamp in 40 MHz clock cycles
+CLOCK_640MHZ = 640e6
+
+DEFAULT_CONFIG = {'n_events': 1000000,
+                  'hit_rate': 1e6,  # Pixel hits per second
+                  'cluster_size': 2.,  # Mean number of pixel hits per event
+                  'tlu_fraction': 0.5,  # Fraction of events with TLU timestamp and TLU word
+                  'hitor_fraction': 0.2,  # Fraction of events with HitOr timestamp
+                  'inj_fraction': 0.,  # Fraction of events with injection timestamp
+                  'ext_ts_interval': 10000,  # Events between external timestamps, 0: none
+                  'noise_fraction': 0.01,  # Fraction of pixel hits with noise flag
+                  'bit_error_rate': 0.,  # Probability of a bit flip per data word
+                  'tlu_delay': 21 * 16,  # Delay of TLU word to TLU timestamp, (WAIT_CYCLES + 1) * 16
+                  'readout_size': 10000,  # Data words per meta data row
+                  'seed': 0}
+
+# Scan configuration stored in the meta data attributes of generated raw data files, as read by the event builders
+STATUS = {'tlu': {'TRIGGER_HANDSHAKE_ACCEPT_WAIT_CYCLES': 20}}
+
+
+def _timestamp_words(header, timestamp, id3_data=None):
+    ''' Timestamp module words ID 3, 2, 1 (bits 63-48, 47-24, 23-0 of timestamp), shape (n, 3).
+        id3_data replaces the upper bits of the ID 3 words (HitOr: ToT in bits 23-8).
+    '''
+    timestamp = timestamp.astype(np.uint64)
+    words = np.empty((timestamp.shape[0], 3), dtype=np.uint32)
+    id3 = (timestamp >> np.uint64(48)) & np.uint64(0xFFFF)
+    if id3_data is not None:
+        id3 = (id3 & np.uint64(0xFF)) | (id3_data.astype(np.uint64) << np.uint64(8))
+    words[:, 0] = ((header + 3) << 24) | id3
+    words[:, 1] = ((header + 2) << 24) | ((timestamp >> np.uint64(24)) & np.uint64(0xFFFFFF))
+    words[:, 2] = ((header + 1) << 24) | (timestamp & np.uint64(0xFFFFFF))
+    return words
+
+
+def _tj_words(col, row, le, te, noise, timestamp):
+    ''' TJ data words 0 - 3 of pixel hits, shape (n, 4). timestamp in 40 MHz clock cycles.
+    '''
+    words = np.empty((col.shape[0], 4), dtype=np.uint32)
+    row9 = row.astype(np.uint32) + 256 * (col.astype(np.uint32) % 2)  # col is 2 * double column + row bit 8
+    words[:, 0] = ((col.astype(np.uint32) // 2) | (row9 << 6) | (te.astype(np.uint32) << 15) |
+                   (le.astype(np.uint32) << 21) | (noise.astype(np.uint32) << 27))
+    words[:, 1] = 0x10000000 | (timestamp & 0xFFFFFFF).astype(np.uint32)
+    words[:, 2] = 0x20000000 | ((timestamp >> 28) & 0xFFFFFF).astype(np.uint32)
+    words[:, 3] = 0x30000000
+    return words
+
+
+def generate_events(rng, event_ts, config, first_event=0, first_trigger_number=0):
+    ''' Raw data words (uint32) of events at the timestamps event_ts (640 MHz clock cycles, increasing) for the
+        configuration (see DEFAULT_CONFIG, n_events, hit_rate, bit_error_rate and readout_size are not used).
+        first_event and first_trigger_number continue the external timestamps and TLU trigger numbers of earlier
+        events, e.g. when the events are generated in pieces (see tjmonopix.simulated_daq).
+    '''
+    n_events = event_ts.shape[0]
+    has_inj = rng.random_sample(n_events) < config['inj_fraction']
+    has_tlu = rng.random_sample(n_events) < config['tlu_fraction']
+    has_hitor = rng.random_sample(n_events) < config['hitor_fraction']
+    has_ext = np.zeros(n_events, dtype=bool)
+    if config['ext_ts_interval']:
+        has_ext[(first_event + np.arange(n_events)) % config['ext_ts_interval'] == 0] = True
+
+    # Pixel hits of the clusters, neighbouring pixels around a random seed pixel
+    n_hits = 1 + rng.poisson(config['cluster_size'] - 1, n_events)
+    hit_event = np.repeat(np.arange(n_events), n_hits)
+    hit_number = np.arange(hit_event.shape[0]) - np.repeat(np.cumsum(n_hits) - n_hits, n_hits)
+    col = np.clip(np.repeat(rng.randint(0, 112, n_events), n_hits) + hit_number % 2, 0, 111)
+    row = np.clip(np.repeat(rng.randint(0, 224, n_events), n_hits) + hit_number // 2, 0, 223)
+    le = (event_ts[hit_event] >> 4) & 0x3F
+    te = (le + 1 + rng.geometric(0.1, hit_event.shape[0])) & 0x3F
+    noise = rng.random_sample(hit_event.shape[0]) < config['noise_fraction']
+    tj_words = _tj_words(col, row, le, te, noise, (event_ts[hit_event] >> 4) + rng.randint(0, 3, hit_event.shape[0]))
+
+    # Words of an event: external, injection, TLU timestamp, TLU word, HitOr timestamp, TJ data
+    n_words = 3 * has_ext + 3 * has_inj + 4 * has_tlu + 3 * has_hitor + 4 * n_hits
+    event_start = np.cumsum(n_words) - n_words
+    raw_data = np.empty(n_words.sum(), dtype=np.uint32)
+    offset = np.zeros(n_events, dtype=np.int64)
+
+    def put(has, words):
+        start = event_start[has] + offset[has]
+        for k in range(words.shape[1]):
+            raw_data[start + k] = words[:, k]
+        offset[has] += words.shape[1]
+
+    put(has_ext, _timestamp_words(0x40, event_ts[has_ext] - 1000))
+    put(has_inj, _timestamp_words(0x50, event_ts[has_inj] - 200))
+    put(has_tlu, _timestamp_words(0x70, event_ts[has_tlu]))
+    trigger_number = (first_trigger_number + np.arange(np.count_nonzero(has_tlu))) & 0xFFFF
+    tlu_word = (0x80000000 | ((((event_ts[has_tlu] + config['tlu_delay']) >> 4) & 0x7FFF) << 16) |
+                trigger_number).astype(np.uint32)
+    put(has_tlu, tlu_word[:, np.newaxis])
+    put(has_hitor, _timestamp_words(0x60, event_ts[has_hitor], rng.randint(1, 0x1000, np.count_nonzero(has_hitor))))
+    hit_start = event_start[hit_event] + offset[hit_event] + 4 * hit_number
+    for k in range(4):
+        raw_data[hit_start + k] = tj_words[:, k]
+    return raw_data
+
+
+def generate_raw_data(**config):
+    ''' Generate raw data words (uint32) for the configuration (see DEFAULT_CONFIG).
+    '''
+    config = dict(DEFAULT_CONFIG, **config)
+    rng = np.random.RandomState(config['seed'])
+    n_events = config['n_events']
+    event_rate = config['hit_rate'] / config['cluster_size']
+
+    # Event timestamps in 640 MHz clock cycles
+    intervals = rng.exponential(CLOCK_640MHZ / event_rate, n_events).astype(np.int64) + 1
+    event_ts = np.cumsum(intervals) + 0x100000000
+    raw_data = generate_events(rng, event_ts, config)
+
+    if config['bit_error_rate']:
+        n_errors = rng.binomial(raw_data.shape[0] * 32, config['bit_error_rate'])
+        bits = rng.randint(0, raw_data.shape[0] * 32, n_errors)
+        np.bitwise_xor.at(raw_data, bits // 32, (np.uint32(1) << (bits % 32).astype(np.uint32)))
+    return raw_data
+
+
+def write_raw_data_file(raw_data_file, raw_data, readout_size=DEFAULT_CONFIG['readout_size'], scan_id='source_scan'):
+    ''' Write raw data words with meta data (one row per readout_size words) and scan attributes like a scan does.
+    '''
+    meta_dtype = [('index_start', '<u8'), ('index_stop', '<u8'), ('data_length', '<u4'), ('timestamp_start', '<f8'),
+                  ('timestamp_stop', '<f8'), ('scan_param_id', '<u2'), ('error', '<u4')]
+    index_start = np.arange(0, raw_data.shape[0], readout_size)
+    meta_data = np.zeros(index_start.shape[0], dtype=meta_dtype)
+    meta_data['index_start'] = index_start
+    meta_data['index_stop'] = np.minimum(index_start + readout_size, raw_data.shape[0])
+    meta_data['data_length'] = meta_data['index_stop'] - meta_data['index_start']
+    with tb.open_file(raw_data_file, 'w') as out_file:
+        out_file.create_earray(out_file.root, name='raw_data', obj=raw_data, title='Raw data',
+                               filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
+        meta_data_table = out_file.create_table(out_file.root, name='meta_data', obj=meta_data, title='meta_data',
+                                                filters=tb.Filters(complib='zlib', complevel=5, fletcher32=False))
+        meta_data_table.attrs.scan_id = scan_id
+        meta_data_table.attrs.status = yaml.dump(STATUS)
+        kwargs = out_file.create_vlarray(out_file.root, name='kwargs', atom=tb.VLStringAtom(), title='kwargs')
+        kwargs.append(b'kwargs')
+        kwargs.append(yaml.dump({}).encode())
@@ -0,0 +1,97 @@
+''' Throughput and soak test of the readout with the simulated readout system (see simulated_daq): FifoReadout polls
+    the simulated SRAM FIFO while data is made at the hit rate, the readouts are written to a raw data file with
+    RawDataWriter like ScanBase does. Reports for every hit rate the data rate read, the pixel hits lost because the
+    host fell behind (LOST_COUNT of data_rx) and the largest latencies and queue of the readout telemetry. Long
+    durations test the readout for leaks and stalls.
+
+        python -m tjmonopix.benchmarks.simulated_readout --hit_rates 1e5 1e6 4e6 --duration 10
+        python -m tjmonopix.benchmarks.simulated_readout --hit_rates 1e6 --duration 3600 --polling adaptive
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tables as tb
+
+from fifo_readout import FifoReadout, POLLING_MODES
+from tjmonopix import simulated_daq
+from tjmonopix.raw_data_writer import RawDataWriter, create_raw_data
+
+HIT_RATES = (1e4, 1e5, 1e6, 4e6)
+
+
+def _run_readout(work_dir, hit_rate, duration, readout_interval, polling, config):
+    dut = {}
+    simulation = simulated_daq.ChipSimulation(dut, hit_rate=hit_rate, **config)
+    dut.update(simulation.modules)
+    readout = FifoReadout(dut, polling=polling)
+    readout.readout_interval = readout_interval
+    read_hits = [0]
+    with tb.open_file(os.path.join(work_dir, 'raw_data.h5'), 'w') as h5_file:
+        writer = RawDataWriter(*create_raw_data(h5_file))
+
+        def callback(data_tuple):
+            writer.append(data_tuple[0], data_tuple[1], data_tuple[2], 0, data_tuple[3])
+            read_hits[0] += np.count_nonzero(data_tuple[0] & 0xF0000000 == 0)
+
+        start_time = time.time()
+        readout.start(callback=callback)
+        dut['data_rx'].set_en(True)
+        time.sleep(duration)
+        dut['data_rx'].set_en(False)
+        readout.stop()
+        elapsed = time.time() - start_time
+        writer.close()
+    telemetry = readout.get_telemetry()
+    lost_hits = simulation.lost_hits
+    return {'words_per_s': readout.get_record_count() / elapsed,
+            'hits_per_s': read_hits[0] / elapsed,
+            'lost_hits': lost_hits,
+            'lost_fraction': float(lost_hits) / max(1, lost_hits + read_hits[0]),
+            'max_poll_latency': telemetry['max_poll_latency'].max() if telemetry.shape[0] else 0.,
+            'max_worker_latency': telemetry['max_worker_latency'].max() if telemetry.shape[0] else 0.,
+            'max_queue_words': telemetry['queue_words'].max() if telemetry.shape[0] else 0}
+
+
+def run(hit_rates=HIT_RATES, duration=5., readout_interval=0.003, polling='fixed', **config):
+    ''' Returns for each hit rate (pixel hits/s) the words and pixel hits read per second, the lost pixel hits and
+        their fraction, the largest poll and worker latency (s) and the largest data queue (words) of the readout.
+        config is the configuration of the simulation, see simulated_daq.SIMULATION_CONFIG.
+    '''
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for hit_rate in hit_rates:
+            results[hit_rate] = _run_readout(work_dir, hit_rate, duration, readout_interval, polling, config)
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Readout throughput and soak test with the simulated readout system')
+    parser.add_argument('--hit_rates', type=float, nargs='+', default=HIT_RATES, help='Pixel hits per second')
+    parser.add_argument('--duration', type=float, default=5., help='Seconds per hit rate')
+    parser.add_argument('--readout_interval', type=float, default=0.003)
+    parser.add_argument('--polling', choices=POLLING_MODES, default='fixed')
+    parser.add_argument('--cluster_size', type=float, default=simulated_daq.SIMULATION_CONFIG['cluster_size'])
+    args = parser.parse_args()
+
+    results = run(args.hit_rates, duration=args.duration, readout_interval=args.readout_interval,
+                  polling=args.polling, cluster_size=args.cluster_size)
+    print('%10s %12s %12s %10s %10s %12s %12s %12s' % ('hits/s', 'Mwords/s', 'read hits/s', 'lost', 'lost %',
+                                                       'max poll s', 'max work s', 'max queue'))
+    for hit_rate in args.hit_rates:
+        result = results[hit_rate]
+        print('%10.0f %12.3f %12.0f %10d %10.3f %12.4f %12.4f %12d' % (
+            hit_rate, result['words_per_s'] / 1e6, result['hits_per_s'], result['lost_hits'],
+            100 * result['lost_fraction'], result['max_poll_latency'], result['max_worker_latency'],
+            result['max_queue_words']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+''' Startup time benchmark: time from a fresh Python process to the first interpreted raw data, once with an empty
+    numba cache (everything is compiled) and once with the cache filled by the first run.
+
+    python -m tjmonopix.benchmarks.startup
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Executed in a fresh process, prints the elapsed times as JSON
+STARTUP_CODE = '''
+import json, time
+start_time = time.time()
+import numpy as np
+from tjmonopix.analysis import interpreter
+import_time = time.time()
+raw_data = np.array([119565277, 533409971, 654311425, 805306368, 3258017254], dtype=np.uint32)
+meta_data = np.array([(0, 5, 0)], dtype=[("index_start", "<u4"), ("index_stop", "<u4"), ("scan_param_id", "<u4")])
+interpreter.Interpreter().interpret_data(raw_data, meta_data)
+print(json.dumps({"import": import_time - start_time, "first_interpretation": time.time() - import_time}))
+'''
+
+
+def _run_startup(env):
+    with open(os.devnull, 'w') as devnull:  # no progress bar output
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_CODE], env=env, stderr=devnull)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(n_repeat=3):
+    ''' Returns import and first interpretation time in seconds for the empty (cold) and filled (cached) numba cache.
+    '''
+    cache_dir = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+        cold = _run_startup(env)
+        cached = [_run_startup(env) for _ in range(n_repeat)]
+    finally:
+        shutil.rmtree(cache_dir)
+    return {'cold': cold,
+            'cached': {key: min(result[key] for result in cached) for key in cold}}
+
+
+def main():
+    results = run()
+    for name in ('cold', 'cached'):
+        print('%-6s import %6.2f s, first interpretation %6.2f s' % (name, results[name]['import'],
+                                                                     results[name]['first_interpretation']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+''' Storage layout benchmark: replays synthetic raw data (see raw_data_generator) readout by readout into a raw data
+    file with RawDataWriter, for several storage layouts of the raw_data EArray (see analysis.storage_layout), and
+    reads it back in chunks like the interpreters do (raw_cache.open_raw_data without cache). Measures write speed,
+    CPU time per MB written, file size and read speed.
+
+        python -m tjmonopix.benchmarks.storage_layout
+        python -m tjmonopix.benchmarks.storage_layout --complib blosc:zstd --complevel 3 --shuffle bit --chunkshape 65536
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import tables as tb
+
+from tjmonopix.analysis import raw_cache
+from tjmonopix.benchmarks import raw_data_generator
+from tjmonopix.raw_data_writer import RawDataWriter, create_raw_data
+
+# Raw data layouts compared by default: (name, layout)
+LAYOUTS = [('blosc (default)', {}),
+           ('blosc:lz4', {'raw_data': {'complib': 'blosc:lz4'}}),
+           ('blosc:lz4 bitshuffle', {'raw_data': {'complib': 'blosc:lz4', 'shuffle': 'bit'}}),
+           ('blosc:zstd', {'raw_data': {'complib': 'blosc:zstd', 'complevel': 3}}),
+           ('blosc:zstd bitshuffle', {'raw_data': {'complib': 'blosc:zstd', 'complevel': 3, 'shuffle': 'bit'}}),
+           ('blosc:blosclz chunk 1M', {'raw_data': {'complib': 'blosc:blosclz', 'chunkshape': 2 ** 20}}),
+           ('zlib', {'raw_data': {'complib': 'zlib', 'complevel': 5}}),
+           ('uncompressed', {'raw_data': {'complib': None}})]
+
+MB = 1e6
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]  # User and system time of this process, including the blosc threads
+
+
+def _write(raw_data_file, raw_data, readout_size, layout):
+    start_time, start_cpu_time = time.time(), _cpu_time()
+    with tb.open_file(raw_data_file, 'w') as h5_file:
+        writer = RawDataWriter(*create_raw_data(h5_file, layout))
+        for start in range(0, raw_data.shape[0], readout_size):
+            writer.append(raw_data[start:start + readout_size])
+        writer.close()
+    return time.time() - start_time, _cpu_time() - start_cpu_time
+
+
+def _read(raw_data_file, chunk_size):
+    start_time = time.time()
+    with raw_cache.open_raw_data(raw_data_file, use_cache=False) as (raw_data, _):
+        for start in range(0, raw_data.shape[0], chunk_size):
+            raw_data[start:start + chunk_size]
+    return time.time() - start_time
+
+
+def run(layouts=LAYOUTS, readout_size=10000, read_chunk_size=1000000, n_repeat=3, **config):
+    ''' Returns for each layout the write speed (MB/s), CPU time per MB written (s/MB), file size (MB), compression
+        ratio and read speed (MB/s), best of n_repeat
+    '''
+    raw_data = raw_data_generator.generate_raw_data(**config)
+    size = raw_data.nbytes / MB
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, layout in layouts:
+            raw_data_file = os.path.join(work_dir, 'raw_data.h5')
+            write_times, read_times = [], []
+            for _ in range(n_repeat):
+                write_times.append(_write(raw_data_file, raw_data, readout_size, layout))
+                read_times.append(_read(raw_data_file, read_chunk_size))
+            write_time, cpu_time = min(write_times)
+            file_size = os.path.getsize(raw_data_file) / MB
+            results[name] = {'write_mb_per_s': size / write_time,
+                             'cpu_s_per_mb': cpu_time / size,
+                             'file_size_mb': file_size,
+                             'compression_ratio': size / file_size,
+                             'read_mb_per_s': size / min(read_times)}
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Storage layout benchmark of the raw data file')
+    parser.add_argument('--n_events', type=int, default=raw_data_generator.DEFAULT_CONFIG['n_events'])
+    parser.add_argument('--readout_size', type=int, default=10000, help='Data words per readout')
+    parser.add_argument('--read_chunk_size', type=int, default=1000000, help='Data words per read')
+    parser.add_argument('--complib', help='Benchmark only this layout, see analysis.storage_layout')
+    parser.add_argument('--complevel', type=int, default=5)
+    parser.add_argument('--shuffle', choices=('byte', 'bit', 'none'), default='byte')
+    parser.add_argument('--chunkshape', type=int)
+    parser.add_argument('--expectedrows', type=int)
+    args = parser.parse_args()
+
+    layouts = LAYOUTS
+    if args.complib:
+        options = {'complib': None if args.complib == 'none' else args.complib, 'complevel': args.complevel,
+                   'shuffle': None if args.shuffle == 'none' else args.shuffle, 'chunkshape': args.chunkshape,
+                   'expectedrows': args.expectedrows}
+        layouts = [(args.complib, {'raw_data': options})]
+    results = run(layouts, readout_size=args.readout_size, read_chunk_size=args.read_chunk_size,
+                  n_events=args.n_events)
+    print('%-24s %10s %10s %10s %8s %10s' % ('layout', 'write MB/s', 'CPU s/MB', 'size MB', 'ratio', 'read MB/s'))
+    for name, _ in layouts:
+        result = results[name]
+        print('%-24s %10.1f %10.4f %10.2f %8.2f %10.1f' % (
+            name, result['write_mb_per_s'], result['cpu_s_per_mb'], result['file_size_mb'],
+            result['compression_ratio'], result['read_mb_per_s']))
+
+
+if __name__ == '__main__':
+    main()
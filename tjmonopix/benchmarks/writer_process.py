@@ -0,0 +1,83 @@
+''' Readout headroom of the writer process: time the readout process spends per readout in ScanBase._handle_data
+    when writing the raw data file itself (RawDataWriter) and when handing the readouts to the writer process
+    (WriterProcess.append), on synthetic raw data (see raw_data_generator). The highest data rate the readout
+    process can take is the number of words divided by that time.
+
+        python -m tjmonopix.benchmarks.writer_process --readout_size 10000
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import tables as tb
+
+from tjmonopix.benchmarks import raw_data_generator
+from tjmonopix.raw_data_writer import RawDataWriter, create_raw_data
+from tjmonopix.writer_process import WriterProcess
+
+
+def _readouts(raw_data, readout_size):
+    return [raw_data[start:start + readout_size] for start in range(0, raw_data.shape[0], readout_size)]
+
+
+def _in_process(readouts, work_dir):
+    with tb.open_file(os.path.join(work_dir, 'in_process.h5'), 'w') as h5_file:
+        writer = RawDataWriter(*create_raw_data(h5_file))
+        start_time = time.time()
+        for readout in readouts:
+            writer.append(readout, 0., 0., 0, 0)
+        readout_time = time.time() - start_time
+        writer.close()
+    return readout_time, time.time() - start_time
+
+
+def _writer_process(readouts, work_dir):
+    writer = WriterProcess(os.path.join(work_dir, 'writer_process.h5'))
+    writer.start()
+    start_time = time.time()
+    for readout in readouts:
+        writer.append(readout, 0., 0., 0, 0)
+    readout_time = time.time() - start_time
+    writer.close()
+    return readout_time, time.time() - start_time
+
+
+def run(readout_size=10000, **config):
+    ''' Returns for both ways of writing: time spent in the readout process, total time until the file is written and
+        the highest data rate of the readout process in words/s
+    '''
+    raw_data = raw_data_generator.generate_raw_data(**config)
+    readouts = _readouts(raw_data, readout_size)
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name, func in (('in_process', _in_process), ('writer_process', _writer_process)):
+            readout_time, total_time = func(readouts, work_dir)
+            results[name] = {'readout_time': readout_time,
+                             'total_time': total_time,
+                             'max_words_per_s': raw_data.shape[0] / readout_time}
+    finally:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writer process readout headroom benchmark')
+    parser.add_argument('--n_events', type=int, default=raw_data_generator.DEFAULT_CONFIG['n_events'])
+    parser.add_argument('--readout_size', type=int, default=10000, help='Data words per readout')
+    args = parser.parse_args()
+
+    results = run(readout_size=args.readout_size, n_events=args.n_events)
+    for name in ('in_process', 'writer_process'):
+        result = results[name]
+        print('%-15s readout process %6.3f s, written after %6.3f s, max. %8.1f Mwords/s' % (
+            name, result['readout_time'], result['total_time'], result['max_words_per_s'] / 1e6))
+    print('Readout headroom: %.1fx' % (results['writer_process']['max_words_per_s'] /
+                                       results['in_process']['max_words_per_s']))
+
+
+if __name__ == '__main__':
+    main()
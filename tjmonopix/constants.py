@@ -0,0 +1,11 @@
+''' Chip and DAQ constants. Importable without hardware dependencies and without side effects.
+'''
+
+import os
+
+# Size of the pixel matrix of one flavor
+ROW = 224
+COL = 112
+
+# Default directory for log and configuration files
+DATDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output_data")
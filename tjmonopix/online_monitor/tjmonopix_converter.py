@@ -3,7 +3,7 @@ from zmq.utils import jsonapi
 import numpy as np
 
 from online_monitor.utils import utils
-from tjmonopix.analysis.interpreter import get_row, get_col, get_tot, is_tjmono_data0
+from tjmonopix.analysis import decoder
 
 
 class TJMonopixConverter(Transceiver):
@@ -11,6 +11,8 @@ class TJMonopixConverter(Transceiver):
     def setup_interpretation(self):
         self.n_hits = 0
         self.n_events = 0
+        # Hits split across readouts are completed with the next readout
+        self.hit_decoder = decoder.Decoder(tj_words=4, formats=decoder.TJ_DATA, options=decoder.RESYNC_TJ_DATA)
 
     def deserialize_data(self, data):
         try:
@@ -35,11 +37,11 @@ class TJMonopixConverter(Transceiver):
             data[0][1]['meta_data'].update({'n_hits': self.n_hits, 'n_events': self.n_events})
             return [data[0][1]]
 
-        selection = is_tjmono_data0(data[0][1])
-        hits = np.zeros(shape=np.count_nonzero(selection), dtype=[('col', 'u1'), ('row', '<u2'), ('tot', 'u1')])
-        hits["col"] = get_col(data[0][1][selection])
-        hits["row"] = get_row(data[0][1][selection])
-        hits["tot"] = get_tot(data[0][1][selection])
+        tj_hits = self.hit_decoder.decode_array(data[0][1])
+        hits = np.zeros(shape=tj_hits.shape[0], dtype=[('col', 'u1'), ('row', '<u2'), ('tot', 'u1')])
+        hits["col"] = tj_hits["col"]
+        hits["row"] = tj_hits["row"]
+        hits["tot"] = (tj_hits["te"] - tj_hits["le"]) & 0x3F
         self.n_hits = hits.shape[0]
 
 #         print hits
@@ -8,7 +8,7 @@ from online_monitor.converter.transceiver import Transceiver
 from online_monitor.utils import utils
 
 
-@njit
+@njit(cache=True)
 def fill_occupancy_hist(occ, tot, hits, pix):
     for hit_i in range(hits.shape[0]):
         occ[hits[hit_i]['col'], hits[hit_i]['row']] += 1
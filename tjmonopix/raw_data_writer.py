@@ -0,0 +1,251 @@
+''' Write-behind persistence of the readouts of a scan: the raw data words and meta data rows of many readouts are
+    collected in memory and written to the raw_data EArray and the meta_data table in one append each. A batch is
+    written when it reaches batch_words, when its first readout is older than max_age seconds or when the scan
+    parameter changes. The HDF5 file is flushed to disk at most every flush_interval seconds (0: with every batch).
+
+    Long runs can be written in segments of limited size or duration with SegmentedRawDataWriter.
+'''
+
+import os
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+
+from tjmonopix.analysis import raw_cache
+from tjmonopix.analysis import storage_layout
+
+
+class MetaTable(tb.IsDescription):
+    index_start = tb.UInt64Col(pos=0)  # 32 bit indices overflow after 4G words
+    index_stop = tb.UInt64Col(pos=1)
+    data_length = tb.UInt32Col(pos=2)
+    timestamp_start = tb.Float64Col(pos=3)
+    timestamp_stop = tb.Float64Col(pos=4)
+    scan_param_id = tb.UInt16Col(pos=5)
+    error = tb.UInt32Col(pos=6)
+
+
+def create_raw_data(h5_file, layout=None, where=None):
+    ''' Create the raw_data EArray and meta_data table of a raw data file in the group where (default: root) with
+        the storage layout (see analysis.storage_layout)
+    '''
+    if where is None:
+        where = h5_file.root
+    raw_data_earray = h5_file.create_earray(
+        where,
+        name="raw_data",
+        atom=tb.UIntAtom(),
+        shape=(0,),
+        title="Raw data",
+        **storage_layout.get_node_kwargs(layout, 'raw_data'))
+    meta_data_table = h5_file.create_table(
+        where,
+        name='meta_data',
+        description=MetaTable,
+        title='meta_data',
+        **storage_layout.get_node_kwargs(layout, 'meta_data'))
+    return raw_data_earray, meta_data_table
+
+
+def get_board_group(board):
+    ''' Group of the raw data of a board in the scan file of a multi-board scan, None (root) for the first board
+    '''
+    return 'board_%d' % board if board else None
+
+
+def get_board_file(scan_file, board):
+    return os.path.splitext(scan_file)[0] + '_board%d.h5' % board
+
+
+def extract_board(scan_file, board):
+    ''' Write the raw data of a board of a multi-board scan (raw_data, meta_data and readout_stats of its group, the
+        other nodes of the scan file) to a raw data file of its own, e.g. for the interpreters and event builders.
+        Returns the path of the raw data file (see get_board_file).
+    '''
+    board_file = get_board_file(scan_file, board)
+    with tb.open_file(scan_file) as in_file:
+        group = in_file.get_node(in_file.root, get_board_group(board)) if board else in_file.root
+        with tb.open_file(board_file, mode='w') as out_file:
+            for node in group:
+                if not node._v_name.startswith('board_'):
+                    node._f_copy(newparent=out_file.root, recursive=True)
+            for node in in_file.root:
+                if not node._v_name.startswith('board_') and node._v_name not in out_file.root:
+                    node._f_copy(newparent=out_file.root, recursive=True)
+    return board_file
+
+
+class RawDataWriter(object):
+    ''' Batched writer of readouts to the raw_data EArray and meta_data table of a raw data file
+    '''
+
+    def __init__(self, raw_data_earray, meta_data_table, batch_words=2 ** 20, max_age=1.0, flush_interval=1.0):
+        self.raw_data_earray = raw_data_earray
+        self.meta_data_table = meta_data_table
+        self.batch_words = batch_words
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.n_words = raw_data_earray.nrows  # Words written and pending
+        self._raw_data = []
+        self._pending_words = 0
+        self._meta_data = np.zeros(64, dtype=meta_data_table.dtype)
+        self._n_meta_data = 0
+        self._batch_time = None
+        self._flush_time = time.time()
+
+    def append(self, raw_data, timestamp_start=0., timestamp_stop=0., scan_param_id=0, error=0):
+        if self._n_meta_data and scan_param_id != self._meta_data[self._n_meta_data - 1]['scan_param_id']:
+            self.write()
+        if self._n_meta_data == self._meta_data.shape[0]:
+            self._meta_data = np.resize(self._meta_data, 2 * self._meta_data.shape[0])
+        meta = self._meta_data[self._n_meta_data]
+        meta['index_start'] = self.n_words
+        self.n_words += raw_data.shape[0]
+        meta['index_stop'] = self.n_words
+        meta['data_length'] = raw_data.shape[0]
+        meta['timestamp_start'] = timestamp_start
+        meta['timestamp_stop'] = timestamp_stop
+        meta['scan_param_id'] = scan_param_id
+        meta['error'] = error
+        self._n_meta_data += 1
+        self._raw_data.append(raw_data)
+        self._pending_words += raw_data.shape[0]
+        now = time.time()
+        if self._batch_time is None:
+            self._batch_time = now
+        if self._pending_words >= self.batch_words or now - self._batch_time >= self.max_age:
+            self.write()
+
+    def write(self):
+        ''' Write the pending readouts, flush the file if the last flush is older than flush_interval
+        '''
+        if self._n_meta_data:
+            if self._pending_words:
+                self.raw_data_earray.append(np.concatenate(self._raw_data))
+            self.meta_data_table.append(self._meta_data[:self._n_meta_data])
+            self._raw_data = []
+            self._pending_words = 0
+            self._n_meta_data = 0
+            self._batch_time = None
+        if time.time() - self._flush_time >= self.flush_interval:
+            self._flush()
+
+    def flush(self):
+        ''' Write the pending readouts and flush the file
+        '''
+        self.write()
+        self._flush()
+
+    def _flush(self):
+        self.raw_data_earray.flush()
+        self.meta_data_table.flush()
+        self._flush_time = time.time()
+
+    def close(self):
+        self.flush()
+
+
+class SegmentedRawDataWriter(object):
+    ''' Writes the readouts of a scan to numbered segment files next to the scan file (<run>_0000.h5, <run>_0001.h5,
+        ..., see raw_cache.get_segment_file), each with its own raw_data and meta_data (indices starting from 0) and
+        copies of the other nodes and the meta_data attributes of the scan file. A new segment is started before a
+        readout that would exceed segment_words words, when the segment is older than segment_time seconds or, with
+        segment_scan_param, when the scan parameter changes (0, False: never).
+
+        The segments are listed in the manifest next to the scan file (see raw_cache.read_manifest), which is updated
+        whenever a segment is opened or closed. Closed segments can be analysed while the scan continues,
+        raw_cache.open_raw_data reads the closed segments of the scan file as one raw data stream.
+        layout is the storage layout of the segments (see analysis.storage_layout), the other arguments are passed to
+        the RawDataWriter of each segment.
+    '''
+
+    def __init__(self, h5_file, segment_words=0, segment_time=0, segment_scan_param=False, layout=None, **kwargs):
+        self.h5_file = h5_file
+        self.layout = layout
+        self.segment_words = segment_words
+        self.segment_time = segment_time
+        self.segment_scan_param = segment_scan_param
+        self.writer_kwargs = kwargs
+        self.n_words = 0  # Words of all segments
+        self.segments = []
+        self._segment_file = None
+        self._writer = None
+        self._segment_start_time = None
+        self._write_manifest(complete=False)
+
+    def append(self, raw_data, timestamp_start=0., timestamp_stop=0., scan_param_id=0, error=0):
+        if self._writer is not None and self.segments[-1]['n_readouts'] and (
+                (self.segment_words and self._writer.n_words + raw_data.shape[0] > self.segment_words) or
+                (self.segment_time and time.time() - self._segment_start_time >= self.segment_time) or
+                (self.segment_scan_param and scan_param_id != self.segments[-1]['scan_param_id_stop'])):
+            self._close_segment()
+        if self._writer is None:
+            self._open_segment(timestamp_start, scan_param_id)
+        self._writer.append(raw_data, timestamp_start, timestamp_stop, scan_param_id, error)
+        self.n_words += raw_data.shape[0]
+        segment = self.segments[-1]
+        segment['index_stop'] = self.n_words
+        segment['n_readouts'] += 1
+        segment['scan_param_id_stop'] = int(scan_param_id)
+        segment['timestamp_stop'] = float(timestamp_stop)
+
+    def write(self):
+        if self._writer is not None:
+            self._writer.write()
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._close_segment()
+        self._write_manifest(complete=True)
+
+    def _open_segment(self, timestamp_start, scan_param_id):
+        segment_file = raw_cache.get_segment_file(self.h5_file.filename, len(self.segments))
+        self._segment_file = tb.open_file(segment_file, mode='w')
+        self._writer = RawDataWriter(*create_raw_data(self._segment_file, self.layout), **self.writer_kwargs)
+        self._writer.meta_data_table.attrs.segment = len(self.segments)
+        self._writer.meta_data_table.attrs.index_offset = self.n_words  # Raw data index of the first word in the scan
+        self._copy_configuration()
+        self._segment_start_time = time.time()
+        self.segments.append({'file': os.path.basename(segment_file),
+                              'index_start': self.n_words,
+                              'index_stop': self.n_words,
+                              'n_readouts': 0,
+                              'scan_param_id_start': int(scan_param_id),
+                              'scan_param_id_stop': int(scan_param_id),
+                              'timestamp_start': float(timestamp_start),
+                              'timestamp_stop': float(timestamp_start),
+                              'closed': False})
+        self._write_manifest(complete=False)
+
+    def _close_segment(self):
+        self._writer.close()
+        self._copy_configuration()  # Attributes set during the segment, e.g. the status at the end of the scan
+        self._segment_file.close()
+        self._segment_file = None
+        self._writer = None
+        self.segments[-1]['closed'] = True
+        self._write_manifest(complete=False)
+
+    def _copy_configuration(self):
+        ''' Copy the nodes but raw_data and meta_data, and the meta_data attributes of the scan file into the segment
+        '''
+        for node in self.h5_file.root:
+            if node._v_name not in ('raw_data', 'meta_data') and node._v_name not in self._segment_file.root:
+                node._f_copy(newparent=self._segment_file.root, recursive=True)
+        attrs = self.h5_file.root.meta_data.attrs
+        for name in attrs._v_attrnamesuser:
+            self._writer.meta_data_table.attrs[name] = attrs[name]
+
+    def _write_manifest(self, complete):
+        manifest_file = raw_cache.get_manifest_file(self.h5_file.filename)
+        with open(manifest_file + '.tmp', 'w') as out_file:
+            yaml.safe_dump({'complete': complete, 'segments': self.segments}, out_file, default_flow_style=False)
+        if os.path.isfile(manifest_file):  # os.rename does not replace files on Windows
+            os.remove(manifest_file)
+        os.rename(manifest_file + '.tmp', manifest_file)
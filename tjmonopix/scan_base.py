@@ -7,29 +7,27 @@ import online_monitor.sender
 
 from contextlib import contextmanager
 from tjmonopix import TJMonoPix
-from fifo_readout import FifoReadout
+from tjmonopix.analysis import raw_cache
+from tjmonopix.raw_data_writer import RawDataWriter, SegmentedRawDataWriter, create_raw_data, get_board_group
+from tjmonopix.writer_process import WriterProcess, merge_raw_data
+from fifo_readout import FifoReadout, MultiFifoReadout
 
 class ScanBase(object):
     """
     Basic run meta class
+
+    dut can also be a list of boards (TJMonoPix instances or configurations), which are read out together (see
+    fifo_readout.MultiFifoReadout) into the scan file: the first board into raw_data and meta_data, the others into
+    the group board_<n> (see raw_data_writer.extract_board). self.dut is the first board.
     """
 
-    def __init__(self, dut=None, filename=None, send_addr="tcp://127.0.0.1:5500"):
+    def __init__(self, dut=None, filename=None, send_addr="tcp://127.0.0.1:5500", write_raw_cache=False,
+                 flush_interval=1.0, writer_process=False, live_interpretation=False, segment_words=0, segment_time=0,
+                 segment_scan_param=False, layout=None, rx_tj_words=None):
         # If DUT instance is not passed as argument, initialize it
-        if isinstance(dut, TJMonoPix):
-            self.dut = dut
-        elif dut:
-            self.dut = TJMonoPix(conf=dut)
-            # Initialize self.dut and power up
-            self.dut.init()
-            self.dut.write_conf()
-            self.dut.set_vreset_dacunits(35, 1)  # 1V. Set V_reset_p, this is the baseline of the front end input (one hot encoding)
-            self.dut.set_icasn_dacunits(0, 1)  # 4.375nA approx. 1.084V at -3V backbias, 600mV at 0V backbias
-            self.dut.set_ireset_dacunits(2, 1, 1)  # 270pA, HIGH LEAKAGE MODE, NORMAL SCALING, 0 = LOW LEAKAGE MODE, SCALING*0.01
-            self.dut.set_ithr_dacunits(5, 1)  # 680pA
-            self.dut.set_idb_dacunits(15, 1)  # 500nA
-            self.dut.set_ibias_dacunits(50, 1)  # 500nA. Current of the front end that provides amplification
-            self.dut.write_conf()
+        self.duts = [self._init_dut(conf) for conf in (dut if isinstance(dut, (list, tuple)) else [dut]) if conf]
+        if self.duts:
+            self.dut = self.duts[0]
 
         if filename is None:
             self.working_dir = os.path.join(os.getcwd(), "output_data")
@@ -40,6 +38,34 @@ class ScanBase(object):
         if not os.path.exists(self.working_dir):
             os.makedirs(self.working_dir)
         self.output_filename = os.path.join(self.working_dir, self.run_name)
+        # Also write the analysis cache (.raw, .idx, see analysis.raw_cache) of the raw data
+        self.write_raw_cache = write_raw_cache
+        self.raw_cache_writer = None
+        # Readouts are written in batches, the file is flushed at most every flush_interval seconds
+        self.flush_interval = flush_interval
+        self.raw_data_writer = None
+        self.board_writers = []
+        # Write the raw data, analysis cache and online monitor data in a separate process (see writer_process)
+        self.use_writer_process = writer_process
+        self.writer_process = None
+        # Interpret the readouts during the scan into the hit file (see get_hit_file)
+        self.live_interpretation = live_interpretation
+        self.live_interpreter = None
+        # Write the raw data in segments of at most segment_words words or segment_time seconds, or one per scan
+        # parameter (see raw_data_writer.SegmentedRawDataWriter)
+        self.segment_words = segment_words
+        self.segment_time = segment_time
+        self.segment_scan_param = segment_scan_param
+        if writer_process and (segment_words or segment_time or segment_scan_param):
+            raise ValueError('Raw data segments are not supported with the writer process')
+        if len(self.duts) > 1 and (writer_process or segment_words or segment_time or segment_scan_param):
+            raise ValueError('The writer process and raw data segments are not supported with several boards')
+
+        # HDF5 storage layout of the raw data and hit files (see analysis.storage_layout)
+        self.layout = layout
+        # Count RX decoder errors in the readout telemetry by decoding the TJ hits of rx_tj_words words (4 for the
+        # current firmware, see fifo_readout.FifoReadout), off by default
+        self.rx_tj_words = rx_tj_words
 
         # Online Monitor
         self.socket = send_addr
@@ -57,31 +83,42 @@ class ScanBase(object):
         self.logger.addHandler(fh)
         logging.info("Initializing {:s}".format(self.__class__.__name__))
 
+    @staticmethod
+    def _init_dut(dut):
+        if isinstance(dut, TJMonoPix):
+            return dut
+        dut = TJMonoPix(conf=dut)
+        # Initialize dut and power up
+        dut.init()
+        dut.write_conf()
+        dut.set_vreset_dacunits(35, 1)  # 1V. Set V_reset_p, this is the baseline of the front end input (one hot encoding)
+        dut.set_icasn_dacunits(0, 1)  # 4.375nA approx. 1.084V at -3V backbias, 600mV at 0V backbias
+        dut.set_ireset_dacunits(2, 1, 1)  # 270pA, HIGH LEAKAGE MODE, NORMAL SCALING, 0 = LOW LEAKAGE MODE, SCALING*0.01
+        dut.set_ithr_dacunits(5, 1)  # 680pA
+        dut.set_idb_dacunits(15, 1)  # 500nA
+        dut.set_ibias_dacunits(50, 1)  # 500nA. Current of the front end that provides amplification
+        dut.write_conf()
+        return dut
+
     def start(self, **kwargs):
 
         # create and open data file
         self.h5_file = tb.open_file(self.output_filename + '.h5', mode="w", title="")
-        self.raw_data_earray = self.h5_file.create_earray(
-            self.h5_file.root,
-            name="raw_data",
-            atom=tb.UIntAtom(),
-            shape=(0,),
-            title="Raw data",
-            filters=tb.Filters(complib="blosc", complevel=5, fletcher32=False))
-        self.meta_data_table = self.h5_file.create_table(
-            self.h5_file.root,
-            name='meta_data',
-            description=MetaTable,
-            title='meta_data',
-            filters=tb.Filters(complib='zlib', complevel=5, fletcher32=False))
-        self.meta_data_table.attrs.kwargs = kwargs
-        self.meta_data_table.attrs.scan_id = self.scan_id
-        status = self.dut.get_power_status()
-        self.logger.info('Power status: {:s}'.format(str(status)))
-        self.logger.info('Temperature: {:4.1f} C'.format(self.dut.get_temperature()))
-        self.meta_data_table.attrs.power_before = status
-        self.meta_data_table.attrs.status_before = yaml.dump(self.dut.get_configuration())
-        self.meta_data_table.attrs.SET_before = self.dut.SET
+        self.raw_data_earray, self.meta_data_table = create_raw_data(self.h5_file, self.layout)
+        # raw_data EArray and meta_data table of each board
+        self.raw_data_nodes = [(self.raw_data_earray, self.meta_data_table)]
+        for board in range(1, len(self.duts)):
+            group = self.h5_file.create_group(self.h5_file.root, get_board_group(board))
+            self.raw_data_nodes.append(create_raw_data(self.h5_file, self.layout, where=group))
+        for dut, (_, meta_data_table) in zip(self.duts, self.raw_data_nodes):
+            meta_data_table.attrs.kwargs = kwargs
+            meta_data_table.attrs.scan_id = self.scan_id
+            status = dut.get_power_status()
+            self.logger.info('Power status: {:s}'.format(str(status)))
+            self.logger.info('Temperature: {:4.1f} C'.format(dut.get_temperature()))
+            meta_data_table.attrs.power_before = status
+            meta_data_table.attrs.status_before = yaml.dump(dut.get_configuration())
+            meta_data_table.attrs.SET_before = dut.SET
         self.kwargs = self.h5_file.create_vlarray(
             self.h5_file.root,
             name='kwargs',
@@ -90,9 +127,38 @@ class ScanBase(object):
             filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
         self.kwargs.append("kwargs")
         self.kwargs.append(yaml.dump(kwargs))
+        if self.segment_words or self.segment_time or self.segment_scan_param:
+            # The raw_data and meta_data of the scan file stay empty, meta_data keeps the attributes
+            self.raw_data_writer = SegmentedRawDataWriter(self.h5_file, segment_words=self.segment_words,
+                                                          segment_time=self.segment_time,
+                                                          segment_scan_param=self.segment_scan_param,
+                                                          layout=self.layout,
+                                                          flush_interval=self.flush_interval)
+        else:
+            self.raw_data_writer = RawDataWriter(self.raw_data_earray, self.meta_data_table,
+                                                 flush_interval=self.flush_interval)
+        # Writers of the other boards
+        self.board_writers = [RawDataWriter(raw_data_earray, meta_data_table, flush_interval=self.flush_interval)
+                              for raw_data_earray, meta_data_table in self.raw_data_nodes[1:]]
+        hit_file = self.get_hit_file(self.output_filename + '.h5') if self.live_interpretation else None
+        if self.use_writer_process:
+            self.writer_process = WriterProcess(
+                self.output_filename + '_raw_data.h5',
+                raw_cache_file=self.output_filename + '.h5' if self.write_raw_cache else None,
+                send_addr=self.socket if self.socket else None,
+                flush_interval=self.flush_interval,
+                hit_file=hit_file,
+                layout=self.layout)
+            self.writer_process.start()
+        else:
+            if self.write_raw_cache:
+                self.raw_cache_writer = raw_cache.RawCacheWriter(self.output_filename + '.h5')
+            if hit_file is not None:
+                import tjmonopix.analysis.interpreter_idx as interpreter_idx
+                self.live_interpreter = interpreter_idx.LiveInterpreter(hit_file, layout=self.layout)
 
         # Setup socket for Online Monitor
-        if self.socket == "":
+        if self.socket == "" or self.writer_process is not None:
             self.socket = None
         else:
             try:
@@ -106,21 +172,41 @@ class ScanBase(object):
         time.sleep(2)
         print("sleeping")
 
-        self.fifo_readout = FifoReadout(self.dut)
+        if len(self.duts) > 1:
+            self.fifo_readout = MultiFifoReadout(self.duts, rx_tj_words=self.rx_tj_words)
+            readouts = self.fifo_readout.readouts
+        else:
+            self.fifo_readout = FifoReadout(self.dut, rx_tj_words=self.rx_tj_words)
+            readouts = [self.fifo_readout]
         self.scan(**kwargs)
         self.fifo_readout.print_readout_status()
+        # Readout statistics of the scan (see fifo_readout.ReadoutTelemetry)
+        for (_, meta_data_table), readout in zip(self.raw_data_nodes, readouts):
+            self.h5_file.create_table(meta_data_table._v_parent, name='readout_stats', obj=readout.get_telemetry(),
+                                      title='readout_stats', filters=tb.Filters(complib='zlib', complevel=5))
 
         # Log and save power status and configuration
-        status = self.dut.get_power_status()
-        self.logger.info('Power status: {:s}'.format(str(status)))
-        self.logger.info('Temperature: {:4.1f} C'.format(self.dut.get_temperature()))
+        for dut, (_, meta_data_table) in zip(self.duts, self.raw_data_nodes):
+            status = dut.get_power_status()
+            self.logger.info('Power status: {:s}'.format(str(status)))
+            self.logger.info('Temperature: {:4.1f} C'.format(dut.get_temperature()))
 
-        self.meta_data_table.attrs.power = yaml.dump(status)
-        self.meta_data_table.attrs.status = yaml.dump(self.dut.get_configuration())
-        self.meta_data_table.attrs.SET = yaml.dump(self.dut.SET)
+            meta_data_table.attrs.power = yaml.dump(status)
+            meta_data_table.attrs.status = yaml.dump(dut.get_configuration())
+            meta_data_table.attrs.SET = yaml.dump(dut.SET)
 
         # Close data file
+        self.raw_data_writer.close()
+        for board_writer in self.board_writers:
+            board_writer.close()
         self.h5_file.close()
+        self._close_writer_process()
+        if self.raw_cache_writer is not None:
+            self.raw_cache_writer.close()
+            self.raw_cache_writer = None
+        if self.live_interpreter is not None:
+            self.live_interpreter.close()
+            self.live_interpreter = None
 
         # Close socket from Online Monitor
         if self.socket is not None:
@@ -132,14 +218,39 @@ class ScanBase(object):
 
     def stop(self):
         try:
+            self.raw_data_writer.close()
+            for board_writer in self.board_writers:
+                board_writer.close()
             self.h5_file.close()
         except Exception:
             self.logger.warn("Could not close h5 file manually")
+        self._close_writer_process()
+        if self.raw_cache_writer is not None:
+            self.raw_cache_writer.close()
+            self.raw_cache_writer = None
+        if self.live_interpreter is not None:
+            self.live_interpreter.close()
+            self.live_interpreter = None
+
+    @classmethod
+    def get_hit_file(cls, raw_data_file):
+        ''' Hit file of the raw data file written by analyze, and by the live interpretation
+        '''
+        return raw_data_file[:-3] + '_hit.h5'
+
+    def _close_writer_process(self):
+        if self.writer_process is not None:
+            self.writer_process.close()
+            merge_raw_data(self.writer_process.raw_data_file, self.output_filename + '.h5')
+            self.writer_process = None
 
     @contextmanager
     def readout(self, *args, **kwargs):
         timeout = kwargs.pop('timeout', 10.0)
         self.fifo_readout.readout_interval = kwargs.pop('readout_interval', 0.003)
+        self.fifo_readout.max_queued_words = kwargs.pop('max_queued_words', self.fifo_readout.max_queued_words)
+        self.fifo_readout.queue_policy = kwargs.pop('queue_policy', self.fifo_readout.queue_policy)
+        self.fifo_readout.polling = kwargs.pop('polling', self.fifo_readout.polling)
 
         self._start_readout(*args, **kwargs)
         yield
@@ -162,24 +273,34 @@ class ScanBase(object):
 
     def _stop_readout(self, timeout):
         self.fifo_readout.stop(timeout=timeout)
+        if self.writer_process is not None:
+            self.writer_process.flush()
+        else:
+            self.raw_data_writer.flush()
+            for board_writer in self.board_writers:
+                board_writer.flush()
+            if self.live_interpreter is not None:
+                self.live_interpreter.interpret()
 
-    def _handle_data(self, data_tuple):
-        total_words = self.raw_data_earray.nrows
-        len_raw_data = data_tuple[0].shape[0]
+    def _handle_data(self, data_tuple, board=0):
+        # The analysis cache, live interpretation and online monitor get the data of the first board
+        if board:
+            self.board_writers[board - 1].append(data_tuple[0], data_tuple[1], data_tuple[2], self.scan_param_id,
+                                                 data_tuple[3])
+            return
 
-        self.raw_data_earray.append(data_tuple[0])
-        self.raw_data_earray.flush()
+        if self.writer_process is not None:
+            self.writer_process.append(data_tuple[0], data_tuple[1], data_tuple[2], self.scan_param_id, data_tuple[3])
+            return
 
-        self.meta_data_table.row['timestamp_start'] = data_tuple[1]
-        self.meta_data_table.row['timestamp_stop'] = data_tuple[2]
-        self.meta_data_table.row['error'] = data_tuple[3]
-        self.meta_data_table.row['data_length'] = len_raw_data
-        self.meta_data_table.row['index_start'] = total_words
-        total_words += len_raw_data
-        self.meta_data_table.row['index_stop'] = total_words
-        self.meta_data_table.row['scan_param_id'] = self.scan_param_id
-        self.meta_data_table.row.append()
-        self.meta_data_table.flush()
+        self.raw_data_writer.append(data_tuple[0], data_tuple[1], data_tuple[2], self.scan_param_id, data_tuple[3])
+
+        if self.raw_cache_writer is not None:
+            self.raw_cache_writer.append(data_tuple[0], data_tuple[1], data_tuple[2], self.scan_param_id,
+                                         data_tuple[3])
+
+        if self.live_interpreter is not None:
+            self.live_interpreter.append(data_tuple[0], self.scan_param_id)
 
         if self.socket is not None:
             try:
@@ -198,13 +319,3 @@ class ScanBase(object):
             self.logger.error(msg)
         else:
             self.logger.error("Aborting run...")
-
-
-class MetaTable(tb.IsDescription):
-    index_start = tb.UInt32Col(pos=0)
-    index_stop = tb.UInt32Col(pos=1)
-    data_length = tb.UInt32Col(pos=2)
-    timestamp_start = tb.Float64Col(pos=3)
-    timestamp_stop = tb.Float64Col(pos=4)
-    scan_param_id = tb.UInt16Col(pos=5)
-    error = tb.UInt32Col(pos=6)
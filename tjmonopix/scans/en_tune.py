@@ -65,7 +65,7 @@ class EnTune(scan_base.ScanBase):
                 th=th-th_step[th_step_i]
                 th_step_i=th_step_i+1
                 continue
-            data = np.concatenate([buf.popleft()[0] for i in range(len(buf))])
+            data = buf.drain()
             img=interpreter.raw2img(data)
             
             ##########################
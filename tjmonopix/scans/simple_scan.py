@@ -10,6 +10,10 @@ from tjmonopix.analysis import plotting
 class SimpleScan(ScanBase):
     scan_id = "simple"
 
+    @classmethod
+    def get_hit_file(cls, raw_data_file):
+        return raw_data_file[:-3] + "_interpreted.h5"
+
     def scan(self, **kwargs):
         with_tj = kwargs.pop('with_tj', True)
         with_tlu = kwargs.pop('with_tlu', True)
@@ -82,9 +86,10 @@ class SimpleScan(ScanBase):
     def analyze(self, data_file=None, cluster_hits=False):
         if data_file is None:
             data_file = self.output_filename + '.h5'
-        out_file = data_file[:-3] + "_interpreted.h5"
+        out_file = self.get_hit_file(data_file)
 
-        interpreter_idx.interpret_idx_h5(data_file, out_file)
+        # Continues the live interpretation of the scan, if any
+        interpreter_idx.interpret_idx_h5(data_file, out_file, incremental=True)
         return out_file
 
     @classmethod
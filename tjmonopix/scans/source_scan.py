@@ -6,6 +6,10 @@ from tjmonopix.scan_base import ScanBase
 class SourceScan(ScanBase):
     scan_id = "source_scan"
 
+    @classmethod
+    def get_hit_file(cls, raw_data_file):
+        return raw_data_file[:-7] + "hit.h5"
+
     def scan(self, **kwargs):
         with_tj = kwargs.pop('with_tj', True)
         with_tlu = kwargs.pop('with_tlu', True)
@@ -18,25 +22,27 @@ class SourceScan(ScanBase):
         cnt = 0
         scanned = 0
 
-        # Stop readout and clean FIFO
-        self.dut.stop_all()
-        self.dut['fifo'].reset()
+        tlu_delay = kwargs.pop('tlu_delay', 8)
+        # All boards of the scan (see ScanBase), read out together
+        for dut in self.duts:
+            # Stop readout and clean FIFO
+            dut.stop_all()
+            dut['fifo'].reset()
 
-        # Start readout
-        if with_tj:
-            self.dut.set_monoread(start_freeze=start_freeze)
-        for _ in range(5):  # Reset FIFO to clean up
-            time.sleep(0.05)
-            self.dut['fifo'].reset()
-        if with_mon:
-            self.dut.set_timestamp("mon")
-        if with_tlu:
-            tlu_delay = kwargs.pop('tlu_delay', 8)
-            self.dut.set_tlu(tlu_delay)
-        if with_rx1:
-            self.dut.set_timestamp("rx1")
+            # Start readout
+            if with_tj:
+                dut.set_monoread(start_freeze=start_freeze)
+            for _ in range(5):  # Reset FIFO to clean up
+                time.sleep(0.05)
+                dut['fifo'].reset()
+            if with_mon:
+                dut.set_timestamp("mon")
+            if with_tlu:
+                dut.set_tlu(tlu_delay)
+            if with_rx1:
+                dut.set_timestamp("rx1")
 
-        self.dut.reset_ibias()
+            dut.reset_ibias()
 
         # Start FIFO readout
         with self.readout(scan_param_id=0, fill_buffer=False, clear_buffer=True, readout_interval=0.2, timeout=0):
@@ -62,18 +68,19 @@ class SourceScan(ScanBase):
             time.sleep(max(0, scan_timeout - scanned))
 
         # Stop FIFO readout
-        self.dut.stop_all()
-        if with_rx1:
-            self.meta_data_table.attrs.timestamp_status = yaml.dump(
-                self.dut["timestamp_rx1"].get_configuration())
-        if with_tlu:
-            self.meta_data_table.attrs.tlu_status = yaml.dump(
-                self.dut["tlu"].get_configuration())
-            self.meta_data_table.attrs.timestamp_status = yaml.dump(
-                self.dut["timestamp_tlu"].get_configuration())
-        if with_mon:
-            self.meta_data_table.attrs.timestamp_status = yaml.dump(
-                self.dut["timestamp_mon"].get_configuration())
+        for dut, (_, meta_data_table) in zip(self.duts, self.raw_data_nodes):
+            dut.stop_all()
+            if with_rx1:
+                meta_data_table.attrs.timestamp_status = yaml.dump(
+                    dut["timestamp_rx1"].get_configuration())
+            if with_tlu:
+                meta_data_table.attrs.tlu_status = yaml.dump(
+                    dut["tlu"].get_configuration())
+                meta_data_table.attrs.timestamp_status = yaml.dump(
+                    dut["timestamp_tlu"].get_configuration())
+            if with_mon:
+                meta_data_table.attrs.timestamp_status = yaml.dump(
+                    dut["timestamp_mon"].get_configuration())
                 
     @classmethod
     def analyze(self, data_file=None, event_build="none", clusterize=False):
@@ -82,9 +89,10 @@ class SourceScan(ScanBase):
         else:
             fraw = data_file + '.h5'
         print fraw
-        analyzed_data_file=fraw[:-7]+"hit.h5"
-        import tjmonopix.analysis.interpreter_old as interpreter
-        interpreter.interpret_h5(fraw,analyzed_data_file)
+        analyzed_data_file=self.get_hit_file(fraw)
+        import tjmonopix.analysis.interpreter_idx as interpreter
+        # Continues the live interpretation of the scan, if any
+        interpreter.interpret_idx_h5(fraw,analyzed_data_file,incremental=True)
         
         if event_build=="token":
             fhit=analyzed_data_file
@@ -0,0 +1,353 @@
+''' Simulated readout system of TJ-MonoPix for FakeTJMonoPix: the firmware modules used by the scans and FifoReadout
+    (fifo, data_rx, inj, tlu, timestamp_*) without hardware and without basil, producing raw data in the format of the
+    current firmware (see benchmarks.raw_data_generator). Used to run scans and to soak- and throughput-test the DAQ
+    (FifoReadout, raw data writing, interpretation), e.g.
+
+        dut = FakeTJMonoPix(simulation={'hit_rate': 2e6, 'cluster_size': 3.})
+
+    Data is made when it is read (get_data, FIFO_SIZE) for the time since the last read:
+        Source: events with Poisson statistics at hit_rate / cluster_size (clusters, TLU, HitOr and external
+            timestamps as in raw_data_generator) while data_rx or the TLU is enabled
+        Noise: single pixel hits, the rate of a pixel is noise_bandwidth * exp(-threshold^2 / (2 noise^2)) (Rice
+            formula) plus hot_pixel_rate for hot_pixels random pixels
+        Injection: inj.start() injects VH - VL (DAC units) REPEAT times into the pixels selected by COL_PULSE_SEL and
+            INJ_ROW, a pixel fires with the probability of its S-curve (threshold and noise per pixel, Gaussian
+            dispersion), ToT grows with the charge above threshold
+    Pixel hits above max_hit_rate and data which does not fit into the SRAM FIFO of fifo_words are lost and counted
+    in LOST_COUNT of data_rx (8 bit, saturating like the firmware counter), as when the host falls behind.
+'''
+
+import time
+
+import numpy as np
+from scipy.special import erf
+
+from tjmonopix.benchmarks.raw_data_generator import CLOCK_640MHZ, DEFAULT_CONFIG, _timestamp_words, _tj_words, \
+    generate_events
+
+SIMULATION_CONFIG = {'hit_rate': 1e3,  # Source pixel hits per second
+                     'cluster_size': 2.,  # Mean number of pixel hits per event
+                     'tlu_fraction': 1.,  # Fraction of events with TLU trigger while the TLU is enabled
+                     'hitor_fraction': 0.2,  # Fraction of events with HitOr timestamp while timestamp_mon is enabled
+                     'ext_ts_interval': 10000,  # Events between timestamps of timestamp_rx1 while it is enabled
+                     'noise_fraction': 0.,  # Fraction of source pixel hits with noise flag
+                     'tlu_delay': DEFAULT_CONFIG['tlu_delay'],
+                     'threshold': 25.,  # Mean pixel threshold in injection DAC units (VH - VL)
+                     'threshold_sigma': 2.,  # Threshold dispersion
+                     'noise': 1.,  # Mean pixel noise in injection DAC units
+                     'noise_sigma': 0.1,  # Noise dispersion
+                     'noise_bandwidth': 1e6,  # Noise hits per second of a pixel at zero threshold
+                     'hot_pixels': 0,  # Number of hot pixels
+                     'hot_pixel_rate': 100.,  # Noise hits per second of a hot pixel
+                     'tot_slope': 0.5,  # ToT (40 MHz clock cycles) per DAC unit above threshold
+                     'max_hit_rate': 4e6,  # Pixel hits per second chip and data_rx can take, more are lost
+                     'fifo_words': 2 ** 19,  # SRAM FIFO size, 2 MB
+                     'pulser_clock': 40e6,  # Clock of DELAY and WIDTH of inj
+                     'temperature': 25.,  # NTC temperature in C
+                     'seed': 0}
+
+N_PIXEL_COLS = 448  # Columns of all four flavors, pixel maps are indexed [flavor * 112 + col, row]
+N_PIXEL_ROWS = 224
+
+
+def _bits(value, size):
+    ''' Bits of a register field as bool array of size: bitarray, sequence or FakeTJMonoPix.ConfDict (bits not set
+        have the value of 'all')
+    '''
+    bits = np.zeros(size, dtype=bool)
+    if isinstance(value, dict):
+        bits[:] = bool(value.get('all', 0))
+        for key, bit in value.items():
+            if isinstance(key, int) and 0 <= key < size:
+                bits[key] = bool(bit)
+    elif value is not None:
+        value = np.array(value.tolist() if hasattr(value, 'tolist') else list(value), dtype=bool)
+        bits[:min(size, value.shape[0])] = value[:size]
+    return bits
+
+
+def _one_hot(value, size=128):
+    ''' Value of a one-hot encoded DAC (SET_VH, SET_VL), -1 if no bit is set
+    '''
+    index = np.flatnonzero(_bits(value, size))
+    return int(index[0]) if index.shape[0] else -1
+
+
+class SimulatedModule(dict):
+    ''' Registers of a firmware module, read and written as items or as attributes (upper case names) like basil
+        modules. Registers never written read 0.
+    '''
+
+    def __missing__(self, key):
+        return 0
+
+    def __getattr__(self, name):
+        if name.isupper():
+            return self[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name.isupper():
+            self[name] = value
+        else:
+            super(SimulatedModule, self).__setattr__(name, value)
+
+    def reset(self):
+        self['LOST_COUNT'] = 0
+
+    def set_en(self, value):
+        self['EN'] = int(value)
+
+    def get_en(self):
+        return self['EN']
+
+    def get_configuration(self):
+        return dict(self)
+
+
+class SimulatedDataRx(SimulatedModule):
+    def get_lost_count(self):
+        return self['LOST_COUNT']
+
+
+class SimulatedFifo(SimulatedModule):
+    ''' SRAM FIFO, FIFO_SIZE is the fill level in bytes, reading RESET empties it
+    '''
+
+    def __init__(self, simulation):
+        super(SimulatedFifo, self).__init__()
+        self._simulation = simulation
+
+    def __getitem__(self, name):
+        if name == 'FIFO_SIZE':
+            return 4 * self._simulation.get_fill_level()
+        if name == 'RESET':
+            self.reset()
+            return 0
+        return super(SimulatedFifo, self).__getitem__(name)
+
+    def reset(self):
+        self._simulation.reset_fifo()
+
+    def get_data(self):
+        return self._simulation.read_fifo()
+
+
+class SimulatedPulser(SimulatedModule):
+    ''' Injection pulser (pulse_gen640), start() injects REPEAT pulses of DELAY + WIDTH clock cycles
+    '''
+
+    def __init__(self, simulation):
+        super(SimulatedPulser, self).__init__()
+        self._simulation = simulation
+        self._ready_time = 0.
+
+    def start(self):
+        self._ready_time = self._simulation.inject()
+
+    def set_delay(self, value):
+        self['DELAY'] = value
+
+    def get_delay(self):
+        return self['DELAY']
+
+    def set_width(self, value):
+        self['WIDTH'] = value
+
+    def get_width(self):
+        return self['WIDTH']
+
+    def set_repeat(self, value):
+        self['REPEAT'] = value
+
+    def get_repeat(self):
+        return self['REPEAT']
+
+    def set_phase(self, value):
+        self['PHASE_DES'] = (0xFFFF << (value % 16)) & 0xFFFF
+
+    def get_phase(self):
+        for i in range(16):
+            if ((0xFFFF0000 | self['PHASE_DES']) >> i) & 0xFFFF == 0xFFFF:
+                break
+        return i
+
+    def is_done(self):
+        return self.is_ready
+
+    @property
+    def is_ready(self):
+        return int(self._simulation.clock() >= self._ready_time)
+
+
+class ChipSimulation(object):
+    ''' Simulation of the chip and the readout modules of dut (see SIMULATION_CONFIG for config). dut gives the chip
+        configuration (dut['CONF_SR'], dut.fl_n), modules are the simulated firmware modules to be registered in dut.
+        clock returns the time in seconds.
+    '''
+
+    def __init__(self, dut, clock=time.time, **config):
+        for name in config:
+            if name not in SIMULATION_CONFIG:
+                raise ValueError('Unknown simulation parameter %s' % name)
+        self.config = dict(SIMULATION_CONFIG, **config)
+        self.dut = dut
+        self.clock = clock
+        self.rng = np.random.RandomState(self.config['seed'])
+        shape = (N_PIXEL_COLS, N_PIXEL_ROWS)
+        self.threshold = self.rng.normal(self.config['threshold'], self.config['threshold_sigma'], shape)
+        self.noise = np.abs(self.rng.normal(self.config['noise'], self.config['noise_sigma'], shape))
+        self.noise_rate = self.config['noise_bandwidth'] * np.exp(-0.5 * (self.threshold / self.noise) ** 2)
+        hot_pixels = self.rng.choice(self.noise_rate.size, self.config['hot_pixels'], replace=False)
+        self.noise_rate.flat[hot_pixels] += self.config['hot_pixel_rate']
+        self.modules = {'fifo': SimulatedFifo(self),
+                        'data_rx': SimulatedDataRx(),
+                        'inj': SimulatedPulser(self),
+                        'tlu': SimulatedModule(),
+                        'timestamp_rx1': SimulatedModule(),
+                        'timestamp_inj': SimulatedModule(),
+                        'timestamp_mon': SimulatedModule(),
+                        'timestamp_tlu': SimulatedModule()}
+        self._start_time = self.clock()
+        self._last_update = self._start_time
+        self._fifo = []
+        self._fill_level = 0
+        self._n_events = 0
+        self._n_triggers = 0
+        self.lost_hits = 0  # LOST_COUNT of data_rx saturates, this does not
+
+    def get_timestamp(self, now):
+        ''' Timestamp (640 MHz clock cycles) of the time now, as the timestamps of generate_events start
+        '''
+        return int((now - self._start_time) * CLOCK_640MHZ) + 0x100000000
+
+    def get_fill_level(self):
+        self.update()
+        return self._fill_level
+
+    def read_fifo(self):
+        self.update()
+        if not self._fifo:
+            return np.zeros(0, dtype=np.uint32)
+        data = np.concatenate(self._fifo)
+        self._fifo = []
+        self._fill_level = 0
+        return data
+
+    def reset_fifo(self):
+        self.update()
+        self._fifo = []
+        self._fill_level = 0
+
+    def _flavor_offset(self):
+        return getattr(self.dut, 'fl_n', 0) * 112
+
+    def _lose_hits(self, n_hits):
+        if n_hits > 0:
+            self.lost_hits += int(n_hits)
+            data_rx = self.modules['data_rx']
+            data_rx['LOST_COUNT'] = min(0xFF, data_rx['LOST_COUNT'] + int(n_hits))
+
+    def _push(self, words):
+        ''' Write words into the SRAM FIFO, the pixel hits which do not fit are lost
+        '''
+        free = self.config['fifo_words'] - self._fill_level
+        if words.shape[0] > free:
+            self._lose_hits(np.count_nonzero((words[free:] & 0xF0000000) == 0))
+            words = words[:free]
+        if words.shape[0]:
+            self._fifo.append(words)
+            self._fill_level += words.shape[0]
+
+    def update(self):
+        ''' Make the source and noise data since the last update
+        '''
+        now = self.clock()
+        duration = now - self._last_update
+        if duration <= 0:
+            return
+        ts_start, ts_stop = self.get_timestamp(self._last_update), self.get_timestamp(now)
+        self._last_update = now
+        with_tj = bool(self.modules['data_rx']['EN'])
+        with_tlu = bool(self.modules['tlu']['TRIGGER_ENABLE'])
+        if not (with_tj or with_tlu):
+            return
+        config = self.config
+        event_config = {'cluster_size': config['cluster_size'],
+                        'tlu_fraction': config['tlu_fraction'] if with_tlu else 0.,
+                        'hitor_fraction': config['hitor_fraction'] if self.modules['timestamp_mon']['ENABLE'] else 0.,
+                        'inj_fraction': 0.,
+                        'ext_ts_interval': config['ext_ts_interval'] if self.modules['timestamp_rx1']['ENABLE'] else 0,
+                        'noise_fraction': config['noise_fraction'],
+                        'tlu_delay': config['tlu_delay']}
+
+        # Events beyond the bandwidth of the chip and data_rx and beyond the free space of the FIFO are not made
+        n_events = self.rng.poisson(config['hit_rate'] / config['cluster_size'] * duration)
+        event_words = max(1., 4 * config['cluster_size'] * with_tj + 4 * event_config['tlu_fraction'] +
+                          3 * event_config['hitor_fraction'])
+        max_events = int((config['fifo_words'] - self._fill_level) / event_words) + 1
+        if with_tj:
+            max_events = min(max_events, int(config['max_hit_rate'] / config['cluster_size'] * duration) + 1)
+        if n_events > max_events:
+            if with_tj:
+                self._lose_hits(round((n_events - max_events) * config['cluster_size']))
+            n_events = max_events
+        if n_events:
+            event_ts = np.sort(self.rng.randint(ts_start, ts_stop + 1, n_events).astype(np.int64))
+            words = generate_events(self.rng, event_ts, event_config, first_event=self._n_events,
+                                    first_trigger_number=self._n_triggers)
+            self._n_events += n_events
+            self._n_triggers += np.count_nonzero(words & 0x80000000)
+            if not with_tj:
+                words = words[(words & 0xC0000000) != 0]
+            self._push(words)
+
+        if with_tj:
+            noise_rate = self.noise_rate[self._flavor_offset():self._flavor_offset() + 112]
+            n_noise = self.rng.poisson(noise_rate.sum() * duration)
+            if n_noise:
+                pixel = self.rng.choice(noise_rate.size, n_noise, p=(noise_rate / noise_rate.sum()).ravel())
+                noise_ts = np.sort(self.rng.randint(ts_start, ts_stop + 1, n_noise).astype(np.int64))
+                le = (noise_ts >> 4) & 0x3F
+                te = (le + 1 + self.rng.geometric(0.3, n_noise)) & 0x3F
+                self._push(_tj_words(pixel // N_PIXEL_ROWS, pixel % N_PIXEL_ROWS, le, te,
+                                     np.zeros(n_noise, dtype=bool), noise_ts >> 4).ravel())
+
+    def inject(self):
+        ''' Inject REPEAT pulses of VH - VL into the selected pixels, returns the time when the pulser is done
+        '''
+        self.update()
+        pulser = self.modules['inj']
+        now = self.clock()
+        repeat = max(1, int(pulser['REPEAT']))
+        period = max(1, int(pulser['DELAY']) + int(pulser['WIDTH'])) * CLOCK_640MHZ / self.config['pulser_clock']
+        inj_ts = (self.get_timestamp(now) + int(pulser['DELAY']) * CLOCK_640MHZ / self.config['pulser_clock'] +
+                  np.arange(repeat) * period).astype(np.int64)
+
+        chunks = [[] for _ in range(repeat)]
+        if self.modules['timestamp_inj']['ENABLE']:
+            for k, words in enumerate(_timestamp_words(0x50, inj_ts)):
+                chunks[k].append(words)
+        conf_sr = self.dut['CONF_SR']
+        offset = self._flavor_offset()
+        cols = np.flatnonzero(_bits(conf_sr['COL_PULSE_SEL'], N_PIXEL_COLS)[offset:offset + 112])
+        rows = np.flatnonzero(_bits(conf_sr['INJ_ROW'], N_PIXEL_ROWS))
+        charge = _one_hot(conf_sr['SET_VH']) - _one_hot(conf_sr['SET_VL'])
+        if self.modules['data_rx']['EN'] and cols.shape[0] and rows.shape[0]:
+            col, row = [pixels.ravel() for pixels in np.meshgrid(cols, rows, indexing='ij')]
+            threshold, noise = self.threshold[offset + col, row], self.noise[offset + col, row]
+            probability = 0.5 * (1. + erf((charge - threshold) / (np.sqrt(2.) * noise)))
+            injection, pixel = np.nonzero(self.rng.random_sample((repeat, col.shape[0])) < probability)
+            tot = np.clip(np.rint(self.config['tot_slope'] * (charge - threshold[pixel] +
+                                                              self.rng.normal(0., noise[pixel]))), 1, 63)
+            hit_ts = inj_ts[injection] + self.rng.randint(0, 32, injection.shape[0])
+            le = (hit_ts >> 4) & 0x3F
+            words = _tj_words(col[pixel], row[pixel], le, (le + tot.astype(np.int64)) & 0x3F,
+                              np.zeros(pixel.shape[0], dtype=bool), hit_ts >> 4)
+            for k, start, stop in zip(range(repeat), np.searchsorted(injection, np.arange(repeat)),
+                                      np.searchsorted(injection, np.arange(repeat), side='right')):
+                chunks[k].append(words[start:stop].ravel())
+        words = [words for chunk in chunks for words in chunk]
+        if words:
+            self._push(np.concatenate(words).astype(np.uint32))
+        return now + repeat * period / CLOCK_640MHZ
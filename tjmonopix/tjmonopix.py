@@ -5,41 +5,63 @@
 # ------------------------------------------------------------
 #
 
+from __future__ import absolute_import
+
 import yaml
 import logging
 import os
 import time
 import numpy as np
-import pkg_resources
 from collections import defaultdict
 
 from bitarray import bitarray
 from basil.dut import Dut
 
-ROW = 224
-COL = 112
+from tjmonopix.constants import ROW, COL, DATDIR
 
-# Directory for log file. Create if it does not exist
-DATDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output_data")
-if not os.path.exists(DATDIR):
-    os.makedirs(DATDIR)
+logger = logging.getLogger('TJMONOPIX')
+_logging_is_set_up = False
 
-VERSION = pkg_resources.get_distribution("tjmonopix-daq").version
 
-''' Set up main logger '''
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-logging.getLogger('basil.HL.RegisterHardwareLayer').setLevel(logging.WARNING)
+def setup_logging():
+    """ Set up main logger, writing also to a log file in DATDIR. Done once, when the first TJMonoPix is created.
+    """
+    global _logging_is_set_up
+    if _logging_is_set_up:
+        return
+    _logging_is_set_up = True
 
-logging.basicConfig(
-    format="%(asctime)s [%(levelname)-5.5s] (%(threadName)-10s) %(message)s")
-logger = logging.getLogger('TJMONOPIX')
-logger.setLevel(logging.INFO)
+    # Directory for log file. Create if it does not exist
+    if not os.path.exists(DATDIR):
+        os.makedirs(DATDIR)
+
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    logging.getLogger('basil.HL.RegisterHardwareLayer').setLevel(logging.WARNING)
+
+    logging.basicConfig(
+        format="%(asctime)s [%(levelname)-5.5s] (%(threadName)-10s) %(message)s")
+    logger.setLevel(logging.INFO)
+
+    fileHandler = logging.FileHandler(os.path.join(DATDIR, time.strftime("%Y%m%d-%H%M%S.log")))
+    logFormatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s] (%(threadName)-10s) %(message)s")
+    fileHandler.setFormatter(logFormatter)
+    logger.addHandler(fileHandler)
+
+
+def get_version():
+    """ Version of the installed tjmonopix-daq package
+    """
+    import pkg_resources  # slow import, only needed here
+    return pkg_resources.get_distribution("tjmonopix-daq").version
 
-fileHandler = logging.FileHandler(os.path.join(DATDIR, time.strftime("%Y%m%d-%H%M%S.log")))
-logFormatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s] (%(threadName)-10s) %(message)s")
-fileHandler.setFormatter(logFormatter)
-logger.addHandler(fileHandler)
+
+def _hit_data_decoder():
+    """ Decoder of the TJ data (3 data words per hit) for interpret_data_timestamp. Imported on use, the analysis
+    modules are slow to import.
+    """
+    from tjmonopix.analysis import decoder
+    return decoder.Decoder(tj_words=3, formats=decoder.TJ_DATA, options=decoder.RESYNC_TJ_DATA)
 
 
 class TJMonoPix(Dut):
@@ -51,12 +73,13 @@ class TJMonoPix(Dut):
     }
 
     def __init__(self, conf=None,no_power_reset=False):
+        setup_logging()
         if not conf:
             proj_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             conf = os.path.join(proj_dir, 'tjmonopix' + os.sep + 'tjmonopix.yaml')
 
-        self.ROW = 224
-        self.COL = 112
+        self.ROW = ROW
+        self.COL = COL
 
         logger.debug("Loading configuration file from {}".format(conf))
 
@@ -74,6 +97,8 @@ class TJMonoPix(Dut):
 
         super(TJMonoPix, self).__init__(conf)
         self.conf_flg = 1
+        self._hit_data_decoder = _hit_data_decoder()  # Keeps the incomplete hit at the end of the last readout
+        self.discarded_words = 0
         self.SET = {'VDDA': None, 'VDDP': None, 'VDDA_DAC': None, 'VDDD': None,
                     'VPCSWSF': None, 'VPC': None, 'BiasSF': None, 'INJ_LO': None, 'INJ_HI': None,
                     'DACMON_ICASN': None, 'fl': None}
@@ -312,41 +337,24 @@ class TJMonoPix(Dut):
         return ret
 
     def interpret_data_timestamp(self, raw_data):
+        """ Interpret the TJ data (3 data words per hit) of raw_data.
+        Broken hit data is discarded. An incomplete hit at the end of raw_data is kept and completed with the data of
+        the next call.
+        """
         hit_dtype = np.dtype([
             ("col", "<u1"), ("row", "<u2"), ("le", "<u1"), ("te", "<u1"),
             ("noise", "<u1"), ("timestamp", "<u8")])
-        hit_data_sel = ((raw_data & 0xF0000000) < 0x30000000)
-        hit_data = raw_data[hit_data_sel]
-        l = len(hit_data)
-        errors = (hit_data & 0xF0000000) != ((np.arange(len(hit_data), dtype=np.int32) % 3) << 28)
-        while np.any(errors):
-            i = np.argwhere(errors)[0]
-            if i%3 == 0:
-                to_delete = [i]
-            elif i%3 == 1:
-                to_delete = [i-1]
-                if hit_data[i] & 0xF0000000 == 0x20000000:
-                    to_delete.append(i)
-            else:
-                to_delete = [i-1, i-2]
-                if hit_data[i] & 0xF0000000 == 0x10000000:
-                    to_delete.append(i)
-            hit_data = np.delete(hit_data, to_delete)
-            errors = (hit_data & 0xF0000000) != ((np.arange(len(hit_data), dtype=np.int32) % 3) << 28)
-        if len(hit_data) % 3 != 0:
-            hit_data = hit_data[:-(len(hit_data)%3)]
-        if len(hit_data) != l:
-            print("WARNING Discarded %d raw words (invalid hit data)" % (l-len(hit_data)))
-
-        res = np.empty(len(hit_data)//3, hit_dtype)
-        res['col'] = ((hit_data[::3] & 0x3F) << 1) | ((hit_data[::3] & 0x4000) >> 14)
-        res['row'] = (hit_data[::3] & 0x3FC0) >> 6
-        res['te'] = (hit_data[::3] & 0x1F8000) >> 15
-        res['le'] = (hit_data[::3] & 0x7E00000) >> 21
-        res['noise'] = (hit_data[::3] & 0x8000000) >> 27
-        res['timestamp'] = (
-            ((hit_data[1::3].astype(np.uint64) << 4) & np.uint64(0x00000000FFFFFFF0))
-            | ((hit_data[2::3].astype(np.uint64) << 32) & np.uint64(0x00FFFFFF00000000)))
+        discarded = self._hit_data_decoder.get_discarded_count()
+        hits = self._hit_data_decoder.decode_array(raw_data)
+        n_discarded = self._hit_data_decoder.get_discarded_count() - discarded
+        if n_discarded:
+            self.discarded_words += n_discarded
+            print("WARNING Discarded %d raw words (invalid hit data)" % n_discarded)
+
+        res = np.empty(len(hits), hit_dtype)
+        for name in ("col", "row", "le", "te", "timestamp"):
+            res[name] = hits[name]
+        res['noise'] = hits['cnt']
         return res
 
     def mask(self, flavor, col, row):
@@ -1081,7 +1089,9 @@ class TJMonoPix(Dut):
 
 
 class FakeTJMonoPix(TJMonoPix):
-    """A minimal simulation of a monopix to test scripts before going to lab."""
+    """A minimal simulation of a monopix to test scripts before going to lab. The readout modules (fifo, data_rx, inj,
+    tlu, timestamp_*) are simulated by simulated_daq.ChipSimulation, simulation is its configuration (see
+    simulated_daq.SIMULATION_CONFIG), e.g. {'hit_rate': 1e6} for a source at 1 MHz pixel hits."""
     class ConfDict(defaultdict):
         def __init__(self, *args, **kwargs):
             super(FakeTJMonoPix.ConfDict, self).__init__(FakeTJMonoPix.ConfDict)
@@ -1105,27 +1115,10 @@ class FakeTJMonoPix(TJMonoPix):
             pass
 
         def setall(self, value):
+            for key in [key for key in self if isinstance(key, int)]:
+                del self[key]
             self["all"] = int(value)
 
-        def get_data(self):
-            # Make up some data
-            n = int(min(1000000, 1000 * (time.time() - self.last_reset)))
-            self.last_reset = time.time()
-            col = np.random.randint(112, size=n)
-            row = np.random.randint(224, size=n)
-            le = np.random.randint(64, size=n)
-            te = np.random.randint(64, size=n)
-            timestamp = int(time.time()) + np.arange(n, dtype=np.uint64)
-            res = np.empty(3*n, np.int32)
-            res[::3] = (col >> 1) | ((col & 1) << 14) | (row << 6) | (te << 15) | (le << 21)
-            res[1::3] = 0x10000000 | (timestamp & 0xFFFFFFF)
-            res[2::3] = 0x20000000 | ((timestamp & 0xFFFFFF0000000) >> 28)
-            # Flip some bits randomly to simulate readout errors
-            for b in [28, 29]:
-                i = np.random.randint(3*n, size=3*n//1000)
-                res[i] ^= (1<<b)
-            return res
-
         @property
         def is_ready(self):
             return True
@@ -1140,6 +1133,11 @@ class FakeTJMonoPix(TJMonoPix):
                         return self[attr[4:]][0]
                     except Exception:
                         return self[attr[4:]]
+            elif attr.isupper():
+                # Register
+                if attr not in self:
+                    raise AttributeError(attr)
+                return self[attr]
             else:
                 def method(*args, **kwargs):
                     print("DEBUG %s called" % attr)
@@ -1169,27 +1167,35 @@ class FakeTJMonoPix(TJMonoPix):
                 for vi, i in enumerate(range(start, stop, abs(step) * (-1 if start > stop else 1))):
                     super(FakeTJMonoPix.ConfDict, self).__setitem__(i, int(value[vi]))
             elif isinstance(key, int):
+                if isinstance(value, bitarray):
+                    value = value[0]
                 super(FakeTJMonoPix.ConfDict, self).__setitem__(key, int(value))
             else:
                 super(FakeTJMonoPix.ConfDict, self).__setitem__(key, value)
 
-    def __init__(self, conf=None, no_power_reset=False):
+    def __init__(self, conf=None, no_power_reset=False, simulation=None):
         # No call to super().__init__ !
+        from tjmonopix import simulated_daq
+        setup_logging()
         self.SET = {'VDDA': None, 'VDDP': None, 'VDDA_DAC': None, 'VDDD': None,
                     'VPCSWSF': None, 'VPC': None, 'BiasSF': None, 'INJ_LO': None, 'INJ_HI': None,
                     'DACMON_ICASN': None, 'fl': None}
         self.SET["conf"] = conf
         self.SET["no_power_reset"] = no_power_reset
-        self.ROW = 224
-        self.COL = 112
+        self.ROW = ROW
+        self.COL = COL
         self.debug = 0
         self.conf_flg = 1
+        self._hit_data_decoder = _hit_data_decoder()
+        self.discarded_words = 0
         self._conf = FakeTJMonoPix.ConfDict()
         self._conf["name"] = "FakeTJMonoPix"
         self._conf["version"] = 0
         self.name = "FakeTJMonoPix"
         self.version = 0
         self._registers = FakeTJMonoPix.ConfDict()
+        self.simulation = simulated_daq.ChipSimulation(self, **(simulation or {}))
+        self._registers.update(self.simulation.modules)
         self._initialized = False
         self.conf_path = None
         self.parent = None
@@ -1215,9 +1221,14 @@ class FakeTJMonoPix(TJMonoPix):
     def write_conf(self):
         pass
 
+    def get_temperature(self, n=10):
+        return self.simulation.config['temperature']
+
     def get_configuration(self):
         res = dict(self._conf)
         res.update(self._registers)
+        for name, module in self.simulation.modules.items():
+            res[name] = module.get_configuration()
         return res
 
     def __getitem__(self, key):
@@ -0,0 +1,135 @@
+''' Compile the numba kernels with the data types used by scans, analysis and online monitor and store them in the
+    numba cache (see numba documentation for the cache location, e.g. NUMBA_CACHE_DIR). Later processes load the
+    kernels from disk instead of compiling them again.
+
+    Run once after installation or update:
+        tjmonopix-warmup
+'''
+
+from __future__ import absolute_import
+
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger('warmup')
+
+# Meta data as written by raw_data_writer.MetaTable
+META_DTYPE = [('index_start', '<u8'), ('index_stop', '<u8'), ('data_length', '<u4'), ('timestamp_start', '<f8'),
+              ('timestamp_stop', '<f8'), ('scan_param_id', '<u2'), ('error', '<u4')]
+
+# Hit data of analysis.Analysis, without and with clustering
+ANALYSIS_HIT_DTYPE = [('col', 'u1'), ('row', '<u2'), ('le', 'u1'), ('te', 'u1'), ('cnt', '<u4'), ('timestamp', '<i8'),
+                      ('scan_param_id', '<i4')]
+ANALYSIS_CLUSTER_HIT_DTYPE = ANALYSIS_HIT_DTYPE + [('tot', 'u1'), ('event_number', '<i8')]
+
+# Event builder output, as in event_builder_token.build_h5 and event_builder_tlu.build_h5
+EVENT_TOKEN_HIT_DTYPE = [('event_number', '<i8'), ('timestamp', '<u8'), ('frame', '<u1'), ('col', '<u1'),
+                         ('row', '<u1'), ('tot', '<u1'), ('flg', '<u1')]
+EVENT_TLU_HIT_DTYPE = [('event_number', '<i8'), ('timestamp', '<u8'), ('token_timestamp', '<u8'),
+                       ('le_timestamp', '<u8'), ('frame', '<u1'), ('col', '<u1'), ('row', '<u1'), ('tot', '<u1'),
+                       ('flg', '<u1')]
+FIXED_TLU_DTYPE = [('event_number', '<i8'), ('trigger_number', '<u4'), ('tlu_timestamp', '<u8'),
+                   ('ts_timestamp', '<u8')]
+
+# One TJ data block and one TLU word
+RAW_DATA = np.array([119565277, 533409971, 654311425, 805306368, 3258017254], dtype=np.uint32)
+
+
+def warmup_interpreter():
+    from tjmonopix.analysis import interpreter
+    from tjmonopix.analysis import analysis_utils as au
+
+    meta_data = np.zeros(1, dtype=META_DTYPE)
+    meta_data['index_stop'] = RAW_DATA.shape[0]
+    for hit_dtype in (interpreter.Interpreter.hit_dtype, ANALYSIS_HIT_DTYPE, ANALYSIS_CLUSTER_HIT_DTYPE):
+        data_interpreter = interpreter.RawDataInterpreter(RAW_DATA.shape[0])
+        hit_data = data_interpreter.interpret(RAW_DATA, meta_data, np.zeros(RAW_DATA.shape[0], dtype=hit_dtype))
+        au.occ_hist2d(hit_data)
+        if hit_dtype != interpreter.Interpreter.hit_dtype:
+            au.scurve_hist3d(hit_data, np.arange(0, 2, 1))
+            au.tot_ave3d(hit_data, np.arange(0, 2, 1))
+
+
+def warmup_interpreter_idx():
+    from tjmonopix.analysis import decoder
+    from tjmonopix.analysis import interpreter_idx
+    from tjmonopix.analysis import analysis_utils as au
+
+    meta_data = np.zeros(1, dtype=META_DTYPE)
+    meta_data['index_stop'] = RAW_DATA.shape[0]
+    idx_decoder = decoder.Decoder(**interpreter_idx.get_decoder_config(0x3))
+    hit_data = idx_decoder.decode_array(RAW_DATA, interpreter_idx.hit_idx_dtype)
+    au.assign_scan_param_id(hit_data, meta_data)
+
+
+def warmup_event_builder():
+    from tjmonopix.analysis import interpreter_idx
+    from tjmonopix.analysis import analysis_utils as au
+    from tjmonopix.analysis import event_builder_token
+    from tjmonopix.analysis import event_builder_tlu
+
+    # Records of the interpreted files: one mixed Hits table, or one table per record type (see au.read_records)
+    hits = np.zeros(1, dtype=interpreter_idx.hit_idx_dtype)
+    records = au.split_records(hits, np.zeros(1, dtype=np.int64))
+    tmp = np.zeros(1, dtype=np.int64)
+    for dat in (hits, records['Hits']):
+        event_builder_token._build_event(dat[dat['col'] < 112], tmp, np.empty(1, dtype=EVENT_TOKEN_HIT_DTYPE), 0,
+                                         0x80)
+
+    tlu = au._select_fields(records['TLU'], ['raw_index', 'trigger_number', 'timestamp'])
+    ts = au._select_fields(records['Timestamps'], ['raw_index', 'source', 'timestamp'])
+    _, _, _, fixed_tlu = event_builder_tlu._sync_tlu_timestamp(tlu, ts[ts['source'] == 0xFC],
+                                                               np.empty(1, dtype=FIXED_TLU_DTYPE))
+    dat = records['Hits'][records['Hits']['col'] < 112]
+    _, buf = event_builder_tlu._build_event_token(dat, tmp, np.empty(1, dtype=EVENT_TLU_HIT_DTYPE), 0, 0x80)
+    event_builder_tlu._sync_tlu_token(buf, fixed_tlu)
+
+
+def warmup_tjmonopix():
+    from tjmonopix import tjmonopix
+
+    tjmonopix._hit_data_decoder().decode_array(RAW_DATA)
+
+
+def warmup_online_monitor():
+    from tjmonopix.online_monitor import tjmonopix_histogrammer
+
+    hits = np.recarray(1, dtype=[('col', 'u2'), ('row', 'u2'), ('tot', 'u1')])
+    hits[0] = (1, 1, 1)
+    tjmonopix_histogrammer.fill_occupancy_hist(np.zeros(shape=(112, 224), dtype=np.int32),
+                                               np.zeros(64, dtype=np.int32), hits, [0xFFFF, 0xFFFF])
+
+
+WARMUPS = [('interpreter', warmup_interpreter),
+           ('interpreter_idx', warmup_interpreter_idx),
+           ('event_builder', warmup_event_builder),
+           ('tjmonopix', warmup_tjmonopix),
+           ('online_monitor', warmup_online_monitor)]
+
+
+def warmup():
+    ''' Compile and cache all kernels. Kernels of optional parts that cannot be imported are skipped.
+        Returns the names of the skipped parts.
+    '''
+    skipped = []
+    for name, func in WARMUPS:
+        start_time = time.time()
+        try:
+            func()
+        except Exception as e:
+            logger.warning('Skipped %s: %s', name, e)
+            skipped.append(name)
+        else:
+            logger.info('Compiled %s in %.1f s', name, time.time() - start_time)
+    return skipped
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s - [%(name)-8s] - %(levelname)-7s %(message)s", level=logging.INFO)
+    warmup()
+
+
+if __name__ == '__main__':
+    main()
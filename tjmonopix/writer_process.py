@@ -0,0 +1,183 @@
+''' Writer process of a scan: the readouts are copied into a ring buffer in shared memory, a separate process appends
+    them to the raw data file (compression, meta data rows), writes the analysis cache, interprets them and sends
+    them to the online monitor. Only the ring buffer positions and meta data of the readouts go through a queue, the reading process
+    waits if the ring buffer is full (backpressure). This keeps compression and sending out of the readout process
+    and its GIL.
+
+    The writer process owns its own raw data file while the scan file stays open in the scan process, merge_raw_data
+    combines both at the end of the scan. See benchmarks/writer_process.py for the readout time saved.
+'''
+
+import ctypes
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+import tables as tb
+
+from tjmonopix.analysis import raw_cache
+from tjmonopix.raw_data_writer import RawDataWriter, create_raw_data
+
+
+class RingBuffer(object):
+    ''' Ring buffer of raw data words in shared memory for one writing and one reading process. The positions count
+        the words put and released since the start, the reading process releases words when done with them.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._buffer = multiprocessing.RawArray(ctypes.c_uint32, size)
+        self._put_position = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self._release_position = multiprocessing.RawValue(ctypes.c_uint64, 0)
+        self._released = multiprocessing.Condition()
+
+    @property
+    def words(self):
+        return np.frombuffer(self._buffer, dtype=np.uint32)
+
+    def get_fill_level(self):
+        return self._put_position.value - self._release_position.value
+
+    def put(self, raw_data, timeout=None):
+        ''' Copy words into the ring buffer and return their position. Waits for free space, returns None if there is
+            none after timeout seconds.
+        '''
+        n_words = raw_data.shape[0]
+        if n_words > self.size:
+            raise ValueError('Readout of %d words does not fit into ring buffer of %d words' % (n_words, self.size))
+        with self._released:
+            while self.get_fill_level() + n_words > self.size:
+                if not self._released.wait(timeout) and self.get_fill_level() + n_words > self.size:
+                    return None
+        position = self._put_position.value
+        start = position % self.size
+        first = min(n_words, self.size - start)
+        words = self.words
+        words[start:start + first] = raw_data[:first]
+        words[:n_words - first] = raw_data[first:]
+        self._put_position.value = position + n_words
+        return position
+
+    def get(self, position, n_words):
+        ''' Copy of the words at a position returned by put
+        '''
+        start = position % self.size
+        words = self.words
+        if start + n_words <= self.size:
+            return words[start:start + n_words].copy()
+        return np.concatenate((words[start:], words[:start + n_words - self.size]))
+
+    def release(self, n_words):
+        with self._released:
+            self._release_position.value += n_words
+            self._released.notify_all()
+
+
+class WriterProcess(multiprocessing.Process):
+    ''' Writes the readouts given to append to raw_data_file in a separate process. raw_cache_file is the raw data
+        file to write the analysis cache for (see analysis.raw_cache), send_addr the address of the online monitor,
+        hit_file the file to interpret the readouts into (see interpreter_idx.LiveInterpreter), layout the storage
+        layout of the raw data and hit file (see analysis.storage_layout).
+    '''
+
+    def __init__(self, raw_data_file, ring_size=2 ** 26, raw_cache_file=None, send_addr=None, flush_interval=1.0,
+                 hit_file=None, layout=None):
+        super(WriterProcess, self).__init__(name='WriterProcess')
+        self.daemon = True
+        self.raw_data_file = raw_data_file
+        self.raw_cache_file = raw_cache_file
+        self.send_addr = send_addr
+        self.flush_interval = flush_interval
+        self.hit_file = hit_file
+        self.layout = layout
+        self.ring_buffer = RingBuffer(ring_size)
+        self._readouts = multiprocessing.Queue()
+
+    def append(self, raw_data, timestamp_start=0., timestamp_stop=0., scan_param_id=0, error=0):
+        while True:
+            position = self.ring_buffer.put(raw_data, timeout=1.)
+            if position is not None:
+                break
+            if not self.is_alive():
+                raise RuntimeError('Writer process stopped with exit code %s' % self.exitcode)
+        self._readouts.put((position, raw_data.shape[0], timestamp_start, timestamp_stop, scan_param_id, error))
+
+    def flush(self):
+        self._readouts.put('flush')
+
+    def close(self):
+        ''' Write all readouts and wait for the writer process to finish
+        '''
+        self._readouts.put(None)
+        self.join()
+        if self.exitcode:
+            raise RuntimeError('Writer process stopped with exit code %s' % self.exitcode)
+
+    def run(self):
+        socket = None
+        if self.send_addr:
+            import online_monitor.sender
+            try:
+                socket = online_monitor.sender.init(self.send_addr)
+            except Exception:
+                logging.warning('WriterProcess: online_monitor.sender.init failed addr={:s}'.format(self.send_addr))
+        raw_cache_writer = None
+        if self.raw_cache_file is not None:
+            raw_cache_writer = raw_cache.RawCacheWriter(self.raw_cache_file)
+        live_interpreter = None
+        if self.hit_file is not None:
+            from tjmonopix.analysis import interpreter_idx
+            live_interpreter = interpreter_idx.LiveInterpreter(self.hit_file, layout=self.layout)
+        with tb.open_file(self.raw_data_file, mode='w') as h5_file:
+            raw_data_writer = RawDataWriter(*create_raw_data(h5_file, self.layout), flush_interval=self.flush_interval)
+            while True:
+                readout = self._readouts.get()
+                if readout is None:
+                    break
+                if readout == 'flush':
+                    raw_data_writer.flush()
+                    if raw_cache_writer is not None:
+                        raw_cache_writer.flush()
+                    if live_interpreter is not None:
+                        live_interpreter.interpret()
+                    continue
+                position, n_words, timestamp_start, timestamp_stop, scan_param_id, error = readout
+                raw_data = self.ring_buffer.get(position, n_words)
+                self.ring_buffer.release(n_words)
+                raw_data_writer.append(raw_data, timestamp_start, timestamp_stop, scan_param_id, error)
+                if raw_cache_writer is not None:
+                    raw_cache_writer.append(raw_data, timestamp_start, timestamp_stop, scan_param_id, error)
+                if live_interpreter is not None:
+                    live_interpreter.append(raw_data, scan_param_id)
+                if socket is not None:
+                    try:
+                        online_monitor.sender.send_data(socket, (raw_data, timestamp_start, timestamp_stop, error))
+                    except Exception:
+                        logging.warning('WriterProcess: online_monitor.sender.send_data failed')
+                        socket = None
+            raw_data_writer.close()
+        if raw_cache_writer is not None:
+            raw_cache_writer.close()
+        if live_interpreter is not None:
+            live_interpreter.close()
+        if socket is not None:
+            try:
+                online_monitor.sender.close(socket)
+            except Exception:
+                pass
+
+
+def merge_raw_data(raw_data_file, scan_file):
+    ''' Copy all nodes but raw_data and meta_data, and the meta_data attributes of the scan file into the raw data
+        file written by the writer process, then replace the scan file with it
+    '''
+    with tb.open_file(scan_file) as in_file:
+        with tb.open_file(raw_data_file, mode='a') as out_file:
+            for node in in_file.root:
+                if node._v_name not in ('raw_data', 'meta_data'):
+                    node._f_copy(newparent=out_file.root, recursive=True)
+            for name in in_file.root.meta_data.attrs._v_attrnamesuser:
+                out_file.root.meta_data.attrs[name] = in_file.root.meta_data.attrs[name]
+    os.remove(scan_file)
+    os.rename(raw_data_file, scan_file)